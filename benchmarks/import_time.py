@@ -0,0 +1,112 @@
+"""
+Import-time regression guard for CLI startup
+
+Runs the CLI under `python -X importtime` for --help and a cached --list
+and fails if aiohttp is imported or startup imports exceed --max-ms.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --max-ms 150 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import make_catalog
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'cli.py')
+
+FORBIDDEN = ('aiohttp', 'mcbedrock_downloader.core.downloader', 'mcbedrock_downloader.core.transfer')
+
+
+def parse_importtime(stderr: str):
+    """Return ({module: cumulative_us}, total_us) from -X importtime output."""
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # Column header
+            continue
+        name = fields[2][1:].rstrip()
+        modules[name.strip()] = cumulative
+        if not name.startswith(' '):
+            total += cumulative
+    return modules, total
+
+
+def is_forbidden(name: str) -> bool:
+    return any(name == module or name.startswith(module + '.') for module in FORBIDDEN)
+
+
+def measure(args, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', CLI] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    modules, total = parse_importtime(result.stderr)
+    return {
+        'args': args,
+        'returncode': result.returncode,
+        'wall_ms': elapsed * 1000,
+        'import_ms': total / 1000,
+        'modules': len(modules),
+        'forbidden': sorted(name for name in modules if is_forbidden(name)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check CLI startup imports')
+    parser.add_argument('--max-ms', type=float, default=200.0,
+                        help='Fail if imports for a fast-path command take longer (default: 200)')
+    parser.add_argument('--output', metavar='FILE', help='Write results as JSON to FILE')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_home:
+        env = dict(os.environ, XDG_CACHE_HOME=cache_home, LOCALAPPDATA=cache_home)
+        # Nothing listens here, so any network access would fail the run
+        api = 'http://127.0.0.1:9/versions.json'
+        cache_path = os.path.join(cache_home, 'versions.json')
+        with open(cache_path, 'w') as f:
+            json.dump(make_catalog(2000), f)
+
+        cached = ['--api', api, '--catalog-cache', cache_path]
+        results = [
+            measure(['--help'], env),
+            measure(cached + ['--list', '--type', 'preview'], env),
+            measure(cached + ['--offline', '--search', '1.2'], env),
+        ]
+
+    failed = False
+    for result in results:
+        status = 'ok'
+        if result['returncode'] != 0:
+            status = f"exit {result['returncode']}"
+        elif result['forbidden']:
+            status = 'imports ' + ', '.join(result['forbidden'])
+        elif result['import_ms'] > args.max_ms:
+            status = f"slower than {args.max_ms:.0f} ms"
+        failed = failed or status != 'ok'
+        print(f"{' '.join(result['args'][-3:]):<32} imports {result['import_ms']:>7.1f} ms  "
+              f"wall {result['wall_ms']:>7.1f} ms  {result['modules']:>4} modules  {status}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
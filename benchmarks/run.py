@@ -0,0 +1,286 @@
+"""
+Benchmark harness for VersionDownloader, WUProtocol and VersionList against a local stand-in server
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --output new.json --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import asyncio
+import tempfile
+import tracemalloc
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import StubServer, StubOptions, make_package, make_catalog
+from mcbedrock_downloader.core.downloader import VersionDownloader
+from mcbedrock_downloader.core.hedging import HedgePolicy
+from mcbedrock_downloader.core.bulk_resolve import AimdLimiter, BulkResolver
+from mcbedrock_downloader.core import metrics
+from mcbedrock_downloader.core.tracing import tracer, TraceListener
+from mcbedrock_downloader.core.version_list import VersionList
+from mcbedrock_downloader.core.wu_protocol import WUProtocol
+
+
+MB = 1024 * 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def counter_total(counter) -> float:
+    return sum(sample[-1] for sample in counter.samples())
+
+
+def make_downloader(server: StubServer, **kwargs) -> VersionDownloader:
+    downloader = VersionDownloader(protocol=WUProtocol(server.soap_url), **kwargs)
+    downloader.download_url_prefixes = (server.cdn_prefix,)
+    return downloader
+
+
+async def bench_resolution(server: StubServer, update_id: str, iterations: int, **downloader_kwargs):
+    timings = []
+    async with make_downloader(server, **downloader_kwargs) as downloader:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            url = await downloader.get_download_url(update_id, "1")
+            timings.append(time.perf_counter() - started)
+            if not url:
+                raise RuntimeError("Stand-in server did not resolve a URL")
+
+    result = {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'max_ms': max(timings) * 1000,
+    }
+    if downloader.hedge is not None:
+        result.update(downloader.hedge.stats())
+    return result
+
+
+async def bench_bulk_resolution(server: StubServer, versions):
+    limiter = AimdLimiter()
+    async with make_downloader(server) as downloader:
+        resolver = BulkResolver(downloader, limiter=limiter, probe=False)
+        started = time.perf_counter()
+        async for _ in resolver.resolve(versions):
+            pass
+        elapsed = time.perf_counter() - started
+
+    return dict(resolver.stats, seconds=elapsed, per_second=len(versions) / elapsed,
+                peak_concurrency=int(limiter.peak), back_offs=limiter.decreases)
+
+
+async def bench_download(server: StubServer, update_ids, workdir: str, **downloader_kwargs):
+    steals_before = counter_total(metrics.SEGMENT_STEALS)
+    async with make_downloader(server, **downloader_kwargs) as downloader:
+        urls = [await downloader.get_download_url(update_id, "1") for update_id in update_ids]
+        paths = [os.path.join(workdir, f"{index}.appx") for index in range(len(urls))]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(downloader.download_file(url, path) for url, path in zip(urls, paths)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(os.path.getsize(path) for path in paths)
+    for path in paths:
+        os.remove(path)
+
+    result = {
+        'downloads': len(paths),
+        'bytes': total,
+        'seconds': elapsed,
+        'throughput_mb_s': total / MB / elapsed,
+    }
+    if downloader.last_transfer is not None:
+        result['final_connections'] = downloader.last_transfer.connections
+        result['final_segment_size'] = downloader.last_transfer.segment_size
+    result['segment_steals'] = counter_total(metrics.SEGMENT_STEALS) - steals_before
+    return result
+
+
+class TransferSpans(TraceListener):
+
+    def __init__(self):
+        self.spans = []
+
+    def on_span_end(self, span):
+        if span.name == 'transfer':
+            self.spans.append(span)
+
+
+async def bench_ordered_sink(server: StubServer, update_id: str, bandwidth: int):
+    """Download into an in-order sink (as for stdout), consuming at bandwidth bytes/s (0 = unthrottled)."""
+    received = 0
+
+    async def consume(chunk: bytes):
+        nonlocal received
+        received += len(chunk)
+        if bandwidth:
+            await asyncio.sleep(len(chunk) / bandwidth)
+
+    spans = TransferSpans()
+    tracer.add_listener(spans)
+    try:
+        async with make_downloader(server) as downloader:
+            url = await downloader.get_download_url(update_id, "1")
+            started = time.perf_counter()
+            await downloader.download_file(url, consume)
+            elapsed = time.perf_counter() - started
+    finally:
+        tracer.remove_listener(spans)
+
+    return {
+        'bytes': received,
+        'seconds': elapsed,
+        'throughput_mb_s': received / MB / elapsed,
+        'peak_held_mb': max((span.attributes.get('peak_held', 0) for span in spans.spans), default=0) / MB,
+    }
+
+
+async def bench_catalog(server: StubServer, iterations: int):
+    timings = []
+    peaks = []
+    for _ in range(iterations):
+        version_list = VersionList(server.catalog_url)
+        tracemalloc.start()
+        started = time.perf_counter()
+        await version_list.download_list()
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'versions': len(version_list.versions),
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'peak_memory_kb': max(peaks) / 1024,
+    }
+
+
+async def run_benchmarks(args):
+    options = StubOptions(latency=args.latency, soap_latency=args.soap_latency,
+                          bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+                          fail_rate=args.fail_rate, drop_rate=args.drop_rate,
+                          soap_slow_rate=args.soap_slow_rate, soap_slow_latency=args.soap_slow_latency,
+                          straggler_rate=args.straggler_rate, straggler_bandwidth=args.straggler_bandwidth * 1024,
+                          soap_capacity=args.soap_capacity or None)
+    server = StubServer(options)
+
+    catalog = make_catalog(args.versions)
+    server.set_catalog(catalog)
+    update_ids = [entry[1] for entry in catalog[:max(1, args.parallel)]]
+    for seed, update_id in enumerate(update_ids):
+        server.add_package(update_id, make_package(args.size * MB, seed=seed))
+
+    results = {}
+    async with server:
+        with tempfile.TemporaryDirectory() as workdir:
+            results['resolution'] = await bench_resolution(server, update_ids[0], args.iterations)
+            results['resolution_hedged'] = await bench_resolution(
+                server, update_ids[0], args.iterations,
+                hedge=HedgePolicy(initial_delay=max(0.05, args.soap_latency * 2)))
+            results['catalog'] = await bench_catalog(server, args.iterations)
+            # Unknown identities get a 500 from the stand-in, so only resolve the packages it serves
+            bulk = [{'name': name, 'uuid': update_id, 'version_type': version_type, 'type_name': ''}
+                    for name, update_id, version_type in catalog[:args.bulk_versions]]
+            for version in bulk:
+                server.packages.setdefault(version['uuid'], b'')
+            results['bulk_resolution'] = await bench_bulk_resolution(server, bulk)
+            results['download_single_adaptive'] = await bench_download(server, update_ids[:1], workdir)
+            results['download_single_fixed'] = await bench_download(server, update_ids[:1], workdir,
+                                                                     adaptive=False, max_connections=1)
+            results['download_parallel'] = await bench_download(server, update_ids, workdir)
+            results['download_ordered_sink'] = await bench_ordered_sink(server, update_ids[0],
+                                                                        args.sink_bandwidth * 1024)
+        results['server_requests'] = dict(server.requests)
+
+    return {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'size_mb': args.size, 'versions': args.versions, 'parallel': args.parallel,
+            'iterations': args.iterations, 'latency': args.latency, 'soap_latency': args.soap_latency,
+            'bandwidth_kb_s': args.bandwidth, 'fail_rate': args.fail_rate, 'drop_rate': args.drop_rate,
+            'soap_slow_rate': args.soap_slow_rate, 'soap_slow_latency': args.soap_slow_latency,
+            'straggler_rate': args.straggler_rate, 'straggler_bandwidth_kb_s': args.straggler_bandwidth,
+            'soap_capacity': args.soap_capacity, 'bulk_versions': args.bulk_versions,
+            'sink_bandwidth_kb_s': args.sink_bandwidth,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict):
+    print(f"Comparing {baseline.get('revision')} -> {current.get('revision')}")
+    for name, values in current['results'].items():
+        previous = baseline.get('results', {}).get(name, {})
+        for metric, value in values.items():
+            old = previous.get(metric)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                change = (value - old) / old * 100
+                print(f"  {name}.{metric:<20} {old:>14.3f} -> {value:>14.3f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the downloader against a local stand-in server')
+    parser.add_argument('--size', type=int, default=64, help='Package size in MB (default: 64)')
+    parser.add_argument('--versions', type=int, default=5000, help='Catalog entries (default: 5000)')
+    parser.add_argument('--parallel', type=int, default=4, help='Concurrent downloads (default: 4)')
+    parser.add_argument('--iterations', type=int, default=20, help='Resolution and catalog iterations')
+    parser.add_argument('--latency', type=float, default=0.0, help='CDN response latency in seconds')
+    parser.add_argument('--soap-latency', type=float, default=0.0, help='SOAP response latency in seconds')
+    parser.add_argument('--soap-slow-rate', type=float, default=0.0,
+                        help='Probability of a SOAP response taking --soap-slow-latency instead')
+    parser.add_argument('--soap-slow-latency', type=float, default=1.0, help='Latency of slow SOAP responses')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Per-connection cap in KB/s (0 = none)')
+    parser.add_argument('--soap-capacity', type=int, default=0,
+                        help='Concurrent SOAP requests before the stand-in answers 429 (0 = unlimited)')
+    parser.add_argument('--bulk-versions', type=int, default=500, help='Versions for the bulk resolution run')
+    parser.add_argument('--straggler-rate', type=float, default=0.0,
+                        help='Probability of a CDN response being throttled to --straggler-bandwidth')
+    parser.add_argument('--straggler-bandwidth', type=int, default=64, help='Straggler rate in KB/s (default: 64)')
+    parser.add_argument('--sink-bandwidth', type=int, default=0,
+                        help='Consumer rate in KB/s for the in-order sink download (0 = none)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Probability of a CDN 503')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of a CDN body being cut')
+    parser.add_argument('--output', metavar='FILE', help='Write results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare against a previous results file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Local stand-in for the Windows Update SOAP endpoint, the version catalog and the CDN
+"""
+import io
+import re
+import json
+import random
+import asyncio
+import zlib
+import zipfile
+import uuid as uuid_lib
+from aiohttp import web
+from typing import Optional
+
+
+SOAP_RESPONSE = (
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">'
+    '<s:Body>'
+    '<GetExtendedUpdateInfo2Response xmlns="http://www.microsoft.com/SoftwareDistribution/Server/ClientWebService">'
+    '<GetExtendedUpdateInfo2Result><FileLocations>'
+    '<FileLocation><FileDigest>AAAA</FileDigest><Url>{blockmap_url}</Url></FileLocation>'
+    '<FileLocation><FileDigest>BBBB</FileDigest><Url>{url}</Url></FileLocation>'
+    '</FileLocations></GetExtendedUpdateInfo2Result>'
+    '</GetExtendedUpdateInfo2Response>'
+    '</s:Body></s:Envelope>'
+)
+
+UPDATE_ID_RE = re.compile(r'<(?:\w+:)?UpdateID>([^<]+)</(?:\w+:)?UpdateID>')
+
+
+def make_package(size: int, members: int = 64, seed: int = 0) -> bytes:
+    """Build a zip package of roughly size bytes with an AppxManifest.xml."""
+    rng = random.Random(seed)
+    buf = io.BytesIO()
+    member_size = max(1, size // members)
+    with zipfile.ZipFile(buf, 'w') as archive:
+        archive.writestr('AppxManifest.xml', '<Package><Identity Name="Microsoft.MinecraftUWP"/></Package>',
+                         compress_type=zipfile.ZIP_DEFLATED)
+        for index in range(members):
+            data = rng.getrandbits(member_size * 8).to_bytes(member_size, 'little')
+            archive.writestr(f'data/chunk{index:04d}.bin', data)
+    return buf.getvalue()
+
+
+def make_catalog(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    catalog = []
+    for index in range(count):
+        name = f"1.{index // 400}.{(index // 20) % 20}.{index % 20}"
+        catalog.append([name, str(uuid_lib.UUID(int=rng.getrandbits(128))), index % 3])
+    return catalog
+
+
+class StubOptions:
+
+    def __init__(self, latency: float = 0.0, soap_latency: float = 0.0, bandwidth: Optional[int] = None,
+                 fail_rate: float = 0.0, drop_rate: float = 0.0, write_size: int = 64 * 1024,
+                 seed: int = 0, soap_slow_rate: float = 0.0, soap_slow_latency: float = 1.0,
+                 straggler_rate: float = 0.0, straggler_bandwidth: int = 64 * 1024,
+                 soap_capacity: Optional[int] = None):
+        # Seconds before response headers on CDN requests
+        self.latency = latency
+        self.soap_latency = soap_latency
+        # Probability that a SOAP call takes soap_slow_latency instead, for tail latency
+        self.soap_slow_rate = soap_slow_rate
+        self.soap_slow_latency = soap_slow_latency
+        # Concurrent SOAP calls served before answering 429; each one in flight adds 10% latency
+        self.soap_capacity = soap_capacity
+        # Bytes per second per connection, None for unlimited
+        self.bandwidth = bandwidth
+        # Probability that a CDN response is throttled to straggler_bandwidth instead
+        self.straggler_rate = straggler_rate
+        self.straggler_bandwidth = straggler_bandwidth
+        # Probability of a 503 response, and of cutting a body short
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.write_size = write_size
+        self.random = random.Random(seed)
+
+
+class StubServer:
+    """aiohttp application serving /client.asmx/secured, /versions.json.min and /cdn/NAME."""
+
+    def __init__(self, options: Optional[StubOptions] = None, host: str = '127.0.0.1', port: int = 0):
+        self.options = options or StubOptions()
+        self.host = host
+        self.port = port
+        self.packages = {}
+        self.catalog = []
+        self.requests = {'soap': 0, 'catalog': 0, 'cdn': 0, 'failed': 0, 'dropped': 0, 'stragglers': 0,
+                         'throttled': 0}
+        self.soap_inflight = 0
+        self.runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def soap_url(self) -> str:
+        return f"{self.base_url}/ClientWebService/client.asmx/secured"
+
+    @property
+    def catalog_url(self) -> str:
+        return f"{self.base_url}/versions.json.min"
+
+    @property
+    def cdn_prefix(self) -> str:
+        return f"{self.base_url}/cdn/"
+
+    def add_package(self, update_id: str, data: bytes):
+        self.packages[update_id] = data
+
+    def set_catalog(self, catalog):
+        self.catalog = catalog
+
+    async def handle_soap(self, request: web.Request) -> web.Response:
+        self.requests['soap'] += 1
+        body = await request.text()
+        capacity = self.options.soap_capacity
+        if capacity is not None and self.soap_inflight >= capacity:
+            self.requests['throttled'] += 1
+            return web.Response(status=429, headers={'Retry-After': '0.2'}, text='Too many requests')
+
+        latency = self.options.soap_latency
+        if self.options.soap_slow_rate and self.options.random.random() < self.options.soap_slow_rate:
+            latency = self.options.soap_slow_latency
+        if capacity is not None:
+            latency *= 1 + 0.1 * self.soap_inflight
+        self.soap_inflight += 1
+        try:
+            if latency:
+                await asyncio.sleep(latency)
+        finally:
+            self.soap_inflight -= 1
+
+        match = UPDATE_ID_RE.search(body)
+        if not match or match.group(1) not in self.packages:
+            return web.Response(status=500, text='Unknown update identity')
+
+        update_id = match.group(1)
+        xml = SOAP_RESPONSE.format(url=f"{self.cdn_prefix}{update_id}.appx",
+                                   blockmap_url=f"{self.base_url}/blockmap/{update_id}")
+        return web.Response(text=xml, content_type='application/soap+xml')
+
+    async def handle_catalog(self, request: web.Request) -> web.Response:
+        self.requests['catalog'] += 1
+        return web.Response(text=json.dumps(self.catalog), content_type='text/plain')
+
+    async def handle_cdn(self, request: web.Request) -> web.StreamResponse:
+        self.requests['cdn'] += 1
+        options = self.options
+        name = request.match_info['name']
+        data = self.packages.get(name[:-5] if name.endswith('.appx') else name)
+        if data is None:
+            raise web.HTTPNotFound()
+
+        if options.latency:
+            await asyncio.sleep(options.latency)
+        if options.fail_rate and options.random.random() < options.fail_rate:
+            self.requests['failed'] += 1
+            raise web.HTTPServiceUnavailable()
+
+        start, stop = 0, len(data)
+        status = 200
+        headers = {'Accept-Ranges': 'bytes', 'ETag': f'"{zlib.crc32(data):08x}"',
+                   'Last-Modified': 'Tue, 01 Jan 2030 00:00:00 GMT'}
+        if 'Range' in request.headers:
+            http_range = request.http_range
+            start = http_range.start or 0
+            stop = len(data) if http_range.stop is None else min(http_range.stop, len(data))
+            if start < 0:
+                start, stop = max(0, len(data) + start), len(data)
+            if start >= len(data):
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{len(data)}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(data)}'
+        headers['Content-Length'] = str(stop - start)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        bandwidth = options.bandwidth
+        if options.straggler_rate and options.random.random() < options.straggler_rate:
+            self.requests['stragglers'] += 1
+            bandwidth = options.straggler_bandwidth
+
+        drop_at = None
+        if options.drop_rate and options.random.random() < options.drop_rate:
+            drop_at = options.random.randint(start, stop)
+
+        loop = asyncio.get_event_loop()
+        began = loop.time()
+        sent = 0
+        for offset in range(start, stop, options.write_size):
+            end = min(stop, offset + options.write_size)
+            if drop_at is not None and end > drop_at:
+                self.requests['dropped'] += 1
+                request.transport.close()
+                return response
+
+            try:
+                await response.write(data[offset:end])
+            except ConnectionResetError:
+                # The client stopped reading, e.g. after splitting the segment
+                return response
+            sent += end - offset
+
+            if bandwidth:
+                ahead = sent / bandwidth - (loop.time() - began)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+        await response.write_eof()
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/ClientWebService/client.asmx/secured', self.handle_soap)
+        app.router.add_get('/versions.json.min', self.handle_catalog)
+        app.router.add_get('/cdn/{name}', self.handle_cdn)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the stand-in WU/CDN server')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--size', type=int, default=64, help='Package size in MB')
+    parser.add_argument('--versions', type=int, default=2000, help='Catalog size')
+    parser.add_argument('--latency', type=float, default=0.0, help='CDN latency in seconds')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Per-connection cap in KB/s')
+    args = parser.parse_args()
+
+    async def serve():
+        server = StubServer(StubOptions(latency=args.latency, bandwidth=args.bandwidth * 1024 or None),
+                            port=args.port)
+        catalog = make_catalog(args.versions)
+        server.set_catalog(catalog)
+        server.add_package(catalog[0][1], make_package(args.size * 1024 * 1024))
+        await server.start()
+        print(f"Serving on {server.base_url} (package UUID {catalog[0][1]})")
+        while True:
+            await asyncio.sleep(3600)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,138 +1,1002 @@
 import argparse
-import asyncio
 import sys
 import os
+import json
+import logging
+import contextlib
+from typing import Optional
 
-from .core.downloader import VersionDownloader
-from .core.version_list import VersionList
-from .core.exceptions import BadUpdateIdentityException
-from .utils.helpers import format_size, progress_callback, get_default_filename
+# Modules that pull in aiohttp (downloader, transfer, servers, ...) are imported
+# where a network operation needs them, so --help and cached --list/--search stay fast.
+from .core.version_list import CONFLICT_POLICIES, VersionList, default_cache_path
+from .core import metrics
+from .core.tracing import tracer, PhaseTimer
+from .core.exceptions import BadUpdateIdentityException, DownloadFailedException
+from .utils.helpers import format_size, free_disk_space, progress_callback, get_default_filename
+from .utils.output import FORMATS, EventStream, create_writer, parse_fields, sort_records
 
 
-async def main():
+VERSION_TYPES = {'release': 0, 'beta': 1, 'preview': 2}
+
+
+def find_target_version(version_list: VersionList, args):
+    if args.download:
+        return version_list.get_version_by_uuid(args.download)
+    if args.name:
+        return version_list.get_version_by_name(args.name)
+    return None
+
+
+async def inspect_package(target_version, members, args) -> int:
+    from .core.downloader import VersionDownloader
+    
+    print(f"\nInspecting {target_version['name']} ({target_version['type_name']})")
+    
+    try:
+        async with VersionDownloader(source=args.source) as downloader:
+            if args.token:
+                downloader.enable_user_authorization(args.token)
+                
+            remote = await downloader.open_remote_package(target_version['uuid'], "1")
+            
+            if not members:
+                print(f"{'Size':>12} {'Compressed':>12}  Name")
+                print("-" * 80)
+                for entry in remote.directory.in_file_order():
+                    print(f"{entry.file_size:>12} {entry.compress_size:>12}  {entry.display_name}")
+                print(f"\n{len(remote.directory.entries)} entries, package size {format_size(remote.size)}")
+            else:
+                output_dir = args.output or '.'
+                for name in members:
+                    entry = remote.directory.find(name)
+                    if not entry:
+                        print(f"Member not found: {name}")
+                        return 1
+                        
+                    path = os.path.join(output_dir, *entry.display_name.split('/'))
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    with open(path, 'wb') as f:
+                        async for chunk in remote.iter_member(entry):
+                            f.write(chunk)
+                    print(f"Extracted {entry.display_name} ({format_size(entry.file_size)}) -> {path}")
+                    
+            print(f"Transferred {format_size(remote.bytes_fetched)} in {remote.requests} range requests")
+            
+    except BadUpdateIdentityException:
+        print("\nError: Unable to fetch download URL")
+        return 1
+    except Exception as e:
+        print(f"\nInspection failed: {e}")
+        return 1
+        
+    return 0
+
+
+async def download_version(args, update_identity: str, version_list: VersionList, catalog_task=None) -> int:
+    """Download a version while catalog_task, if given, is still loading version_list.
+    
+    URL resolution, connection warm-up and the catalog fetch run concurrently. Without
+    --output the package is written under a temporary name and renamed once the catalog
+    supplies the version name. With --output - the package is streamed to stdout.
+    """
+    import asyncio
+    from .core.downloader import VersionDownloader
+    from .core.chunk_store import ChunkStore
+    from .core.sinks import StreamSink
+    
+    async def catalog_version():
+        if catalog_task is not None:
+            try:
+                await catalog_task
+            except Exception as e:
+                print(f"\nCould not load version list: {e}")
+        return version_list.get_version_by_uuid(update_identity)
+        
+    target_version = None if catalog_task else version_list.get_version_by_uuid(update_identity)
+    if target_version and target_version['version_type'] == 1 and not args.token and not args.source:
+        print("\\nWARNING: Beta versions require authentication!")
+        print("Please provide an MSA token using --token parameter")
+        print("You can obtain this token from the Xbox authentication process")
+        return 1
+        
+    if args.store and not args.output and target_version is None:
+        # Stored packages are indexed by file name, so it is needed up front
+        target_version = await catalog_version()
+        
+    output_path = args.output
+    if output_path is None and target_version is not None:
+        output_path = get_default_filename(target_version['name'], target_version['type_name'])
+    elif output_path is None and args.store:
+        output_path = f"{update_identity}.appx"
+    destination = output_path or f"{update_identity}.appx.part"
+    to_stdout = output_path == '-'
+    keep_file = not (args.extract and args.extract_only) and not to_stdout
+    if to_stdout:
+        destination = StreamSink(args.stdout.buffer)
+    
+    events = EventStream(args.stdout) if args.format in ('json', 'ndjson') else None
+    if events:
+        events.emit('start', uuid=update_identity, output=output_path)
+        
+    def discard_part():
+        # Without a known name the package is downloaded to UUID.appx.part first
+        if output_path is None and keep_file and os.path.exists(destination):
+            os.remove(destination)
+    
+    if target_version:
+        print(f"\\nDownloading {target_version['name']} ({target_version['type_name']})")
+    else:
+        print(f"\\nDownloading {update_identity}")
+    print(f"UUID: {update_identity}")
+    print(f"Output: {'stdout' if to_stdout else output_path or '(named once the version list arrives)'}")
+    
+    try:
+        store = ChunkStore(args.store) if args.store else None
+        async with VersionDownloader(adaptive=not args.no_adaptive,
+                                     max_connections=args.connections, store=store,
+                                     source=args.source, hedge=args.hedge_policy) as downloader:
+            if args.token:
+                downloader.enable_user_authorization(args.token)
+                
+            if args.shared_cache:
+                await fetch_shared(downloader, args.shared_cache, update_identity, destination,
+                                   events.progress if events else progress_callback)
+            else:
+                download_url, _ = await asyncio.gather(
+                    downloader.get_download_url(update_identity, "1"),
+                    downloader.warm_up())
+                if not download_url:
+                    raise BadUpdateIdentityException("Unable to get download URL")
+                    
+                await downloader.download(
+                    update_identity, 
+                    "1",
+                    destination if keep_file or to_stdout else None,
+                    events.progress if events else progress_callback,
+                    base_package=args.base,
+                    extract_to=args.extract,
+                    download_url=download_url
+                )
+            
+    except BadUpdateIdentityException:
+        discard_part()
+        target_version = target_version or await catalog_version()
+        if events:
+            events.emit('result', status='error', uuid=update_identity, error="Unable to fetch download URL")
+        print("\\nError: Unable to fetch download URL")
+        if target_version and target_version['version_type'] == 1:
+            print("For beta versions, make sure:")
+            print("1. Your account is subscribed to the Minecraft beta program")
+            print("2. You have provided a valid MSA token")
+        return 1
+    except Exception as e:
+        discard_part()
+        await catalog_version()
+        if events:
+            events.emit('result', status='error', uuid=update_identity, error=str(e))
+        print(f"\\nDownload failed: {e}")
+        return 1
+        
+    if target_version is None:
+        target_version = await catalog_version()
+        if target_version:
+            print(f"Version: {target_version['name']} ({target_version['type_name']})")
+    if output_path is None:
+        if target_version:
+            output_path = get_default_filename(target_version['name'], target_version['type_name'])
+        else:
+            output_path = f"{update_identity}.appx"
+        if keep_file:
+            os.replace(destination, output_path)
+            
+    if events:
+        events.emit('result', status='ok', uuid=update_identity, output=output_path,
+                    name=target_version['name'] if target_version else None,
+                    type_name=target_version['type_name'] if target_version else None,
+                    size=os.path.getsize(output_path) if keep_file and not store else None)
+    if args.catalog_db:
+        from .core.catalog_db import CatalogDatabase
+        with CatalogDatabase(args.catalog_db) as db:
+            db.record_download(update_identity, target_version['name'] if target_version else None,
+                               os.path.abspath(output_path) if keep_file else None,
+                               os.path.getsize(output_path) if keep_file and not store else None)
+    print(f"\\nDownload completed: {'stdout' if to_stdout else output_path}")
+    if store:
+        print_store_stats(store)
+    return 0
+
+
+async def fetch_shared(downloader, cache_dir: str, update_identity: str, destination: str, progress) -> None:
+    """Get a package through a cache directory shared by the processes on this host.
+    
+    Only the first process asking for a version downloads it; the others follow
+    its progress and copy the finished package.
+    """
+    import asyncio
+    import shutil
+    from .core.artifact_cache import ArtifactCache
+    
+    cache = ArtifactCache(cache_dir, downloader)
+    path, pending = cache.get(update_identity, "1")
+    if pending is not None:
+        try:
+            size = await pending.wait_size()
+            available = 0
+            while not pending.done:
+                available = await pending.wait_for(available + 1)
+                progress(available, size or available)
+        except DownloadFailedException:
+            if isinstance(pending.error, BadUpdateIdentityException):
+                raise pending.error
+            raise
+        await asyncio.shield(pending.task)
+        path = pending.path
+    if os.path.abspath(path) != os.path.abspath(destination):
+        shutil.copyfile(path, destination)
+
+
+def print_hedge_stats(policy):
+    stats = policy.stats()
+    print(f"SOAP hedging: {stats['hedges']} of {stats['requests']} requests hedged "
+          f"after {stats['delay_ms']:.0f} ms, hedge answered first {stats['hedge_wins']} times "
+          f"({stats['win_rate']:.0%}), {stats['skipped']} skipped by the rate cap")
+
+
+def print_store_stats(store):
+    stats = store.stats()
+    print(f"Store: {stats['versions']} versions, {format_size(stats['logical_bytes'])} logical, "
+          f"{format_size(stats['stored_bytes'])} stored in {stats['unique_chunks']} chunks "
+          f"(dedup ratio {stats['dedup_ratio']:.2f}x)")
+
+
+def run_store_command(args) -> int:
+    from .core.chunk_store import ChunkStore
+    
+    if not args.store:
+        print("The --store DIR option is required")
+        return 1
+        
+    store = ChunkStore(args.store)
+    
+    if args.command[0] == 'restore':
+        if len(args.command) < 2:
+            print("Usage: restore FILE --store DIR [--output PATH]")
+            return 1
+        name = args.command[1]
+        output_path = args.output or name
+        try:
+            store.restore(name, output_path)
+        except KeyError:
+            print(f"Not in store: {name}")
+            return 1
+        print(f"Restored {name} -> {output_path}")
+        return 0
+        
+    print(f"{'Name':<45} {'Size':>10} {'New data':>10} {'Chunks':>7}")
+    print("-" * 80)
+    for index in store.versions():
+        print(f"{index['name']:<45} {format_size(index['size']):>10} "
+              f"{format_size(index['new_bytes']):>10} {len(index['chunks']):>7}")
+    print()
+    print_store_stats(store)
+    return 0
+
+
+async def run_serve_command(args) -> int:
+    import asyncio
+    from .core.downloader import VersionDownloader
+    from .core.artifact_cache import ArtifactCache
+    from .core.cache_server import CacheServer
+    from .core.prefetch import PrefetchPolicy, TimeWindow, TokenBucket
+    
+    async with VersionDownloader(adaptive=not args.no_adaptive, max_connections=args.connections,
+                                 hedge=args.hedge_policy) as downloader:
+        if args.token:
+            downloader.enable_user_authorization(args.token)
+            
+        cache = ArtifactCache(args.cache_dir, downloader)
+        prefetch = None
+        if args.prefetch:
+            prefetch = PrefetchPolicy(
+                cache, VersionList(args.api),
+                version_types=[VERSION_TYPES[name] for name in args.prefetch_types.split(',')],
+                count=args.prefetch,
+                window=TimeWindow(args.prefetch_window) if args.prefetch_window else None,
+                limiter=TokenBucket(args.prefetch_rate * 1024) if args.prefetch_rate else None).start()
+                
+        try:
+            async with CacheServer(cache, args.api, host=args.host, port=args.port) as server:
+                print(f"Serving {args.cache_dir} on http://{args.host}:{server.port}/")
+                print(f"Clients: python cli.py --source http://<this-host>:{server.port} ...")
+                if prefetch:
+                    print(f"Prefetching the newest {args.prefetch} {args.prefetch_types} builds in the background")
+                await asyncio.Event().wait()
+        finally:
+            if prefetch:
+                await prefetch.stop()
+            
+    return 0
+
+
+async def run_service_command(args) -> int:
+    import asyncio
+    from .core.downloader import VersionDownloader
+    from .core.chunk_store import ChunkStore
+    from .core.jobs import JobManager
+    from .core.job_server import JobServer
+    
+    version_list = create_version_list(args)
+    try:
+        await version_list.download_list()
+    except Exception as e:
+        print(f"Error loading version list: {e}")
+        return 1
+    print(f"Loaded {len(version_list.versions)} versions")
+    
+    store = ChunkStore(args.store) if args.store else None
+    async with VersionDownloader(adaptive=not args.no_adaptive, max_connections=args.connections,
+                                 store=store, source=args.source, hedge=args.hedge_policy) as downloader:
+        if args.token:
+            downloader.enable_user_authorization(args.token)
+            
+        manager = await JobManager(downloader, version_list, args.jobs_dir, concurrency=args.concurrency).start()
+        try:
+            async with JobServer(manager, host=args.host, port=args.port) as server:
+                print(f"Job service on http://{args.host}:{server.port}/jobs "
+                      f"({len(manager.list('queued'))} queued jobs resumed)")
+                await asyncio.Event().wait()
+        finally:
+            await manager.stop()
+            
+    return 0
+
+
+async def run_mirror_command(args) -> int:
+    from .core.mirror import Mirror, run_mirror, shard_of
+    
+    root = args.command[1] if len(args.command) > 1 else 'mcbedrock-mirror'
+    version_list = create_version_list(args)
+    try:
+        await version_list.download_list()
+    except Exception as e:
+        print(f"Error loading version list: {e}")
+        return 1
+        
+    version_types = [VERSION_TYPES[name] for name in args.mirror_types.split(',')]
+    if VERSION_TYPES['beta'] in version_types and not args.token:
+        print("Skipping beta versions: they need --token")
+        version_types.remove(VERSION_TYPES['beta'])
+    versions = [v for v in version_list.versions if v['version_type'] in version_types]
+    
+    index, count = args.shard
+    if not args.no_space_check and not check_mirror_space(
+            root, Mirror(root).missing([v for v in versions if shard_of(v['uuid'], count) == index]),
+            version_list, args):
+        return 1
+        
+    print(f"Mirroring {len(versions)} versions into {root} (shard {index + 1}/{count}, {args.workers} workers)")
+    totals = await run_mirror(
+        root, versions, workers=args.workers, shard=args.shard, verify=args.verify, token=args.token,
+        downloader_options={'adaptive': not args.no_adaptive, 'max_connections': args.connections,
+                            'source': args.source, 'hedge': args.hedge_policy})
+    
+    print(f"Fetched {totals['fetched']} packages ({totals['bytes'] / 1024 / 1024:.1f} MB), "
+          f"{totals['failed']} failed, {totals['locked']} being fetched by other workers, "
+          f"{totals['missing']} still missing")
+    print(f"Manifest lists {totals['packages']} packages ({totals['manifest_bytes'] / 1024 / 1024:.1f} MB)")
+    return 1 if totals['failed'] else 0
+
+
+def check_mirror_space(root: str, missing, version_list: VersionList, args) -> bool:
+    """Compare the cached sizes of the missing packages with the free space under root."""
+    records = cached_metadata(missing, version_list, args)
+    sizes = [record['size'] for record in records if record['size'] is not None]
+    if not sizes:
+        return True
+    needed = sum(sizes)
+    unknown = len(records) - len(sizes)
+    print(f"{len(records)} packages missing, about {format_size(needed)}"
+          + (f" plus {unknown} of unknown size (run resolve to fill them in)" if unknown else ""))
+    free = free_disk_space(os.path.join(root, 'packages'))
+    if free is not None and free < needed:
+        print(f"Not enough disk space in {root}: {format_size(free)} free, {format_size(needed)} needed "
+              "(--no-space-check to mirror anyway)")
+        return False
+    return True
+
+
+def resolution_cache_path(version_list: VersionList, args) -> str:
+    from .core.resolution_cache import default_resolution_cache_path
+    return args.resolution_cache or default_resolution_cache_path(version_list.cache_path)
+
+
+def cached_metadata(versions, version_list: VersionList, args):
+    """Versions with size, ETag and Last-Modified from the resolution cache where known."""
+    from .core.resolution_cache import ResolutionCache
+    return ResolutionCache(resolution_cache_path(version_list, args)).metadata(versions)
+
+
+async def run_resolve_command(args) -> int:
+    from .core.downloader import VersionDownloader
+    from .core.bulk_resolve import AimdLimiter, BulkResolver
+    from .core.resolution_cache import ResolutionCache
+    
+    version_list = create_version_list(args)
+    if not await load_version_list(version_list, args):
+        return 1
+        
+    versions = version_list.search_versions(args.search) if args.search else list(version_list.versions)
+    if not args.token and not args.source:
+        skipped = sum(1 for version in versions if version['version_type'] == VERSION_TYPES['beta'])
+        if skipped:
+            print(f"Skipping {skipped} beta versions: they need --token")
+        versions = [version for version in versions if version['version_type'] != VERSION_TYPES['beta']]
+    if args.limit is not None:
+        versions = versions[args.offset:args.offset + args.limit]
+        
+    cache_path = resolution_cache_path(version_list, args)
+    print(f"Resolving {len(versions)} versions into {cache_path}")
+    writer = None
+    if args.format == 'table':
+        print(f"{'Name':<30} {'Type':<10} {'Size':>10}  URL or error", file=args.stdout)
+        print("-" * 80, file=args.stdout)
+    else:
+        writer = create_writer(args.format, args.stdout,
+                               ['name', 'uuid', 'type_name', 'size', 'etag', 'last_modified', 'url', 'error'])
+    
+    async with VersionDownloader(source=args.source, hedge=args.hedge_policy) as downloader:
+        if args.token:
+            downloader.enable_user_authorization(args.token)
+        with ResolutionCache(cache_path) as cache:
+            resolver = BulkResolver(downloader, cache, AimdLimiter(maximum=args.resolve_concurrency),
+                                    max_age=None if args.refresh else args.resolve_ttl)
+            try:
+                async for record in resolver.resolve(versions):
+                    if writer:
+                        writer.write(record)
+                        continue
+                    size = format_size(record['size']) if record['size'] is not None else '-'
+                    print(f"{record['name']:<30} {record['type_name']:<10} {size:>10}  "
+                          f"{record['url'] or record['error']}", file=args.stdout)
+            finally:
+                if writer:
+                    writer.close()
+                    
+    stats = resolver.stats
+    print(f"Resolved {stats['resolved']}, {stats['cached']} from cache, {stats['failed']} failed; "
+          f"{stats['retries']} retries, {stats['throttled']} throttled; concurrency peaked at "
+          f"{int(resolver.limiter.peak)} with {resolver.limiter.decreases} back-offs")
+    return 1 if stats['failed'] else 0
+
+
+def parse_shard(value: str):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected I/N")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, need 1 <= I <= N")
+    return index - 1, count
+
+
+def catalog_url(args) -> str:
+    if args.source:
+        return f"{args.source.rstrip('/')}/versions.json"
+    return args.api
+
+
+def create_version_list(args) -> VersionList:
+    url = catalog_url(args)
+    sources = args.catalog_source or []
+    return VersionList(url, cache_path=args.catalog_cache or default_cache_path('\n'.join([url] + sources)),
+                       extra_sources=sources, quorum=args.catalog_quorum, conflict=args.catalog_conflict,
+                       source_timeout=args.catalog_timeout)
+
+
+def load_cached_version_list(version_list: VersionList, args) -> bool:
+    if args.refresh:
+        return False
+    if not version_list.load_cached(None if args.offline else args.catalog_ttl):
+        return False
+    print(f"Loaded {len(version_list.versions)} versions (cached)")
+    return True
+
+
+async def load_version_list(version_list: VersionList, args) -> bool:
+    print("Loading version list...")
+    if load_cached_version_list(version_list, args):
+        return True
+    if args.offline:
+        print("No cached version list; run once without --offline")
+        return False
+        
+    try:
+        await version_list.download_list()
+    except Exception as e:
+        print(f"Error loading version list: {e}")
+        return False
+        
+    print(f"Loaded {len(version_list.versions)} versions")
+    return True
+
+
+async def resolve_target_version(version_list: VersionList, args):
+    target_version = find_target_version(version_list, args)
+    if target_version is None and version_list.from_cache and not args.offline:
+        # The cached catalog may predate the version asked for
+        try:
+            await version_list.download_list()
+        except Exception as e:
+            print(f"Error loading version list: {e}")
+            return None
+        target_version = find_target_version(version_list, args)
+    return target_version
+
+
+def version_filter(args):
+    """Title and predicate for the --list/--search selection."""
+    if args.search:
+        query = args.search.lower()
+        return f"\\nSearch results for '{args.search}':", lambda version: query in version['name'].lower()
+    version_type = VERSION_TYPES.get(args.type, 0)
+    return f"\\n{args.type.title()} versions:", lambda version: version['version_type'] == version_type
+
+
+def wants_metadata(args) -> bool:
+    from .core.resolution_cache import METADATA_FIELDS
+    return any(field in METADATA_FIELDS for field in args.fields + [args.sort])
+
+
+def open_version_listing(title: str, args):
+    if args.format == 'table':
+        print(title, file=args.stdout)
+        print("-" * 80, file=args.stdout)
+    return create_writer(args.format, args.stdout, args.fields)
+
+
+def open_catalog_db(version_list: VersionList, args):
+    """Open --catalog-db, merging the loaded catalog into it if it is newer than the last sync."""
+    import time
+    from .core.catalog_db import CatalogDatabase
+    
+    db = CatalogDatabase(args.catalog_db)
+    if version_list.versions:
+        seen_at = os.path.getmtime(version_list.cache_path) if version_list.from_cache else time.time()
+        if seen_at > db.synced_at():
+            db.sync(version_list.versions, seen_at)
+    return db
+
+
+def print_version_listing(version_list: VersionList, args) -> int:
+    title, _ = version_filter(args)
+    if args.catalog_db:
+        with open_catalog_db(version_list, args) as db:
+            records = db.query(version_type=None if args.search else VERSION_TYPES.get(args.type, 0),
+                               search=args.search, order=args.sort or 'position', reverse=args.reverse,
+                               limit=args.limit, offset=args.offset)
+        if wants_metadata(args):
+            records = cached_metadata(records, version_list, args)
+        open_version_listing(title, args).write_all(records)
+        return 0
+        
+    if args.search:
+        records = version_list.search_versions(args.search)
+    else:
+        records = version_list.get_versions_by_type(VERSION_TYPES.get(args.type, 0))
+    if wants_metadata(args):
+        records = cached_metadata(records, version_list, args)
+        
+    if args.sort:
+        records = sort_records(records, args.sort, reverse=args.reverse)
+    elif args.reverse:
+        records = list(reversed(records))
+        
+    end = None if args.limit is None else args.offset + args.limit
+    open_version_listing(title, args).write_all(records[args.offset:end])
+    return 0
+
+
+async def stream_version_listing(version_list: VersionList, args) -> int:
+    """Download the catalog and print matching versions as their records arrive."""
+    title, matches = version_filter(args)
+    writer = open_version_listing(title, args)
+    cache = None
+    if wants_metadata(args):
+        from .core.resolution_cache import ResolutionCache
+        cache = ResolutionCache(resolution_cache_path(version_list, args))
+    skip = args.offset
+    try:
+        async for version in version_list.iter_list():
+            if not matches(version):
+                continue
+            if skip:
+                skip -= 1
+            elif args.limit is None or writer.count < args.limit:
+                writer.write(cache.metadata([version])[0] if cache else version)
+    except Exception as e:
+        print(f"Error loading version list: {e}")
+        return 1
+    finally:
+        writer.close()
+    return 0
+
+
+async def run_history_command(args) -> int:
+    if not args.catalog_db:
+        print("history needs --catalog-db")
+        return 1
+        
+    version_list = create_version_list(args)
+    await load_version_list(version_list, args)
+    with open_catalog_db(version_list, args) as db:
+        uuid = None
+        if len(args.command) > 1:
+            version = db.get(args.command[1]) or db.get_by_name(args.command[1])
+            if version is None:
+                print(f"Version not found: {args.command[1]}")
+                return 1
+            uuid = version['uuid']
+        events = db.history(uuid, limit=args.limit or 50)
+        for download in db.downloads(uuid, limit=args.limit or 50):
+            events.append({'uuid': download['uuid'], 'name': download['name'], 'type_name': None,
+                           'event': 'downloaded', 'at': download['downloaded_at'], 'path': download['path']})
+            
+    events.sort(key=lambda event: event['at'], reverse=True)
+    fields = ['at', 'event', 'name', 'type_name', 'uuid']
+    if args.format == 'table':
+        print("\nCatalog history:", file=args.stdout)
+        print("-" * 80, file=args.stdout)
+    create_writer(args.format, args.stdout, fields).write_all(events[:args.limit or 50])
+    return 0
+
+
+def run_offline(args, parser) -> Optional[int]:
+    """Handle what needs no network (help, cached --list/--search); None means go async."""
+    if not any([args.list, args.download, args.name, args.search, args.command]):
+        parser.print_help()
+        return 0
+        
+    if args.command or not (args.list or args.search) or args.metrics_port is not None:
+        return None
+        
+    version_list = create_version_list(args)
+    if load_cached_version_list(version_list, args):
+        return print_version_listing(version_list, args)
+    if args.offline:
+        print("No cached version list; run once without --offline")
+        return 1
+    return None
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Minecraft Bedrock Version Downloader')
+    parser.add_argument('command', nargs='*', metavar='COMMAND',
+                       help='Optional command: inspect [MEMBER ...] lists or extracts package members remotely, '
+                            'store reports the chunk store, restore FILE rebuilds a stored package, '
+                            'serve runs a LAN caching server, service runs the download job service, '
+                            'mirror [DIR] keeps a full copy of the catalog packages in DIR, '
+                            'history [UUID|NAME] shows catalog changes and downloads from --catalog-db, '
+                            'resolve resolves download URLs and sizes for the catalog (or --search matches)')
     parser.add_argument('--list', action='store_true', help='List available versions')
     parser.add_argument('--download', metavar='UUID', help='Download version by UUID')
     parser.add_argument('--name', metavar='NAME', help='Download version by name')
     parser.add_argument('--type', choices=['release', 'beta', 'preview'], default='release', 
                        help='Version type to filter (default: release)')
-    parser.add_argument('--output', '-o', metavar='PATH', help='Output file path')
+    parser.add_argument('--output', '-o', metavar='PATH', help='Output file path, or - to write the package to stdout')
     parser.add_argument('--token', metavar='TOKEN', help='MSA token for beta versions')
     parser.add_argument('--api', metavar='URL', 
                        default="https://raw.githubusercontent.com/ddf8196/mc-w10-versiondb-auto-update/refs/heads/master/versions.json.min",
                        help='Version list API URL')
     parser.add_argument('--search', metavar='QUERY', help='Search versions by name')
+    parser.add_argument('--format', choices=FORMATS, default='table',
+                       help='Output format for --list/--search; json and ndjson also turn download '
+                            'progress into NDJSON events (default: table)')
+    parser.add_argument('--fields', metavar='FIELD,...',
+                       help='Fields to output for --list/--search (default: name,type_name,uuid)')
+    parser.add_argument('--sort', metavar='FIELD',
+                       help='Sort --list/--search output by FIELD, comparing digit runs as numbers')
+    parser.add_argument('--reverse', action='store_true', help='Reverse the --list/--search order')
+    parser.add_argument('--limit', type=int, metavar='N',
+                       help='Output at most N versions for --list/--search')
+    parser.add_argument('--offset', type=int, default=0, metavar='N',
+                       help='Skip the first N matching versions for --list/--search')
+    parser.add_argument('--catalog-db', metavar='FILE',
+                       help='Keep the catalog with first/last seen history and downloads in a SQLite '
+                            'database and answer --list/--search from it')
+    parser.add_argument('--catalog-source', action='append', metavar='URL|FILE',
+                       help='Additional catalog source (URL or local JSON file), fetched concurrently with --api; '
+                            'may be repeated')
+    parser.add_argument('--catalog-quorum', type=int, default=1, metavar='N',
+                       help='With --catalog-source, stop waiting once N sources (or --api) answered (default: 1)')
+    parser.add_argument('--catalog-conflict', choices=CONFLICT_POLICIES, default='prefer',
+                       help='How to resolve sources disagreeing about a UUID: prefer the earliest source '
+                            'or take the majority (default: prefer)')
+    parser.add_argument('--catalog-timeout', type=float, default=15, metavar='SECONDS',
+                       help='Per-source timeout for federated catalog fetches (default: 15)')
+    parser.add_argument('--catalog-ttl', type=int, default=3600, metavar='SECONDS',
+                       help='Use the cached version list when it is younger than this (default: 3600)')
+    parser.add_argument('--catalog-cache', metavar='FILE',
+                       help='Version list cache file (default: per-user cache directory)')
+    parser.add_argument('--refresh', action='store_true', help='Always download the version list')
+    parser.add_argument('--offline', action='store_true',
+                       help='Only use the cached version list, whatever its age')
+    parser.add_argument('--connections', type=int, default=8, metavar='N',
+                       help='Maximum parallel connections per download (default: 8)')
+    parser.add_argument('--no-adaptive', action='store_true',
+                       help='Use fixed chunk and segment sizes instead of adaptive tuning')
+    parser.add_argument('--base', metavar='APPX',
+                       help='Local package of an earlier version; only changed members are downloaded')
+    parser.add_argument('--store', metavar='DIR',
+                       help='Keep downloads in a deduplicated chunk store at DIR')
+    parser.add_argument('--shared-cache', metavar='DIR',
+                       help='Download through a cache directory shared with other runs on this host, '
+                            'so concurrent requests for a version download it once')
+    parser.add_argument('--extract', metavar='DIR',
+                       help='Unpack the package into DIR while it downloads')
+    parser.add_argument('--extract-only', action='store_true',
+                       help='With --extract, do not keep the package file')
+    parser.add_argument('--source', metavar='URL',
+                       help='Get the catalog and packages from a LAN caching server started with serve')
+    parser.add_argument('--cache-dir', metavar='DIR', default='mcbedrock-cache',
+                       help='Package and catalog cache for serve (default: mcbedrock-cache)')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                       help='With serve, keep the newest N builds of each prefetch type cached')
+    parser.add_argument('--prefetch-types', default='release,preview', metavar='TYPES',
+                       help='Comma separated types to prefetch (default: release,preview)')
+    parser.add_argument('--prefetch-window', metavar='HH:MM-HH:MM',
+                       help='Only prefetch inside this daily local-time window')
+    parser.add_argument('--prefetch-rate', type=int, default=0, metavar='KBPS',
+                       help='Bandwidth limit for prefetching in KB/s (default: unlimited)')
+    parser.add_argument('--jobs-dir', metavar='DIR', default='mcbedrock-jobs',
+                       help='Job journal and downloads for service (default: mcbedrock-jobs)')
+    parser.add_argument('--concurrency', type=int, default=2, metavar='N',
+                       help='Jobs the service runs at once (default: 2)')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                       help='Worker processes for mirror (default: 1)')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), metavar='I/N',
+                       help='With mirror, only handle shard I of N, e.g. one per host sharing DIR (default: 1/1)')
+    parser.add_argument('--mirror-types', default='release,preview', metavar='TYPES',
+                       help='Comma separated types to mirror (default: release,preview)')
+    parser.add_argument('--verify', action='store_true',
+                       help='With mirror, re-hash mirrored packages and fetch any that changed')
+    parser.add_argument('--no-space-check', action='store_true',
+                       help='With mirror, skip comparing the sizes of missing packages with free disk space')
+    parser.add_argument('--hedge-after', type=float, metavar='PERCENTILE',
+                       help='Send a duplicate SOAP request once one has taken longer than this '
+                            'percentile of recent ones, e.g. 95 (default: off)')
+    parser.add_argument('--hedge-rate', type=float, default=0.1, metavar='FRACTION',
+                       help='Most SOAP requests that may be hedged (default: 0.1)')
+    parser.add_argument('--resolution-cache', metavar='FILE',
+                       help='Resolved URL and package size cache, filled by resolve and read by --list '
+                            'for the size, etag and last_modified fields (default: next to the version list cache)')
+    parser.add_argument('--resolve-concurrency', type=int, default=32, metavar='N',
+                       help='Most SOAP requests resolve keeps in flight; it adapts below this (default: 32)')
+    parser.add_argument('--resolve-ttl', type=int, default=86400, metavar='SECONDS',
+                       help='With resolve, reuse URLs resolved within this time (default: 86400)')
+    parser.add_argument('--host', default='0.0.0.0',
+                       help='Address for serve and service to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8080,
+                       help='Port for serve and service to listen on (default: 8080)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                       help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics during the run')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                       help="Write a JSON metrics summary to FILE when done ('-' for stdout)")
+    parser.add_argument('--timings', action='store_true',
+                       help='Print a per-phase timing breakdown when done')
+    parser.add_argument('--profile', metavar='FILE',
+                       help='Profile the run with cProfile and write pstats data to FILE')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Log transfer tuning decisions')
+    return parser
+
+
+def configure_logging(verbose: bool):
+    if verbose:
+        logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    else:
+        logging.basicConfig(level=logging.WARNING, format='%(message)s')
+        logging.getLogger('mcbedrock_downloader.core.downloader').setLevel(logging.INFO)
+
+
+def write_metrics_summary(path: str):
+    summary = json.dumps(metrics.REGISTRY.to_dict(), indent=2)
+    if path == '-':
+        print(summary)
+    else:
+        with open(path, 'w') as f:
+            f.write(summary)
+
+
+def main() -> int:
+    parser = build_parser()
+    args = parser.parse_intermixed_args()
     
-    args = parser.parse_args()
+    if args.prefetch and any(name not in VERSION_TYPES for name in args.prefetch_types.split(',')):
+        parser.error(f"--prefetch-types must be a comma separated list of {', '.join(VERSION_TYPES)}")
+    if any(name not in VERSION_TYPES for name in args.mirror_types.split(',')):
+        parser.error(f"--mirror-types must be a comma separated list of {', '.join(VERSION_TYPES)}")
+    if args.prefetch_window:
+        from .core.prefetch import TimeWindow
+        try:
+            TimeWindow(args.prefetch_window)
+        except ValueError as e:
+            parser.error(str(e))
     
-    print("Loading version list...")
-    version_list = VersionList(args.api)
+    if args.shared_cache and (args.base or args.store or args.extract):
+        parser.error("--shared-cache cannot be combined with --base, --store or --extract")
+    if args.output == '-' and (args.command or args.base or args.store or args.extract or args.shared_cache
+                               or args.format != 'table'):
+        parser.error("--output - only streams plain downloads; it cannot be combined with commands, "
+                     "--base, --store, --extract, --shared-cache or --format")
+    if args.resolve_concurrency < 1:
+        parser.error("--resolve-concurrency must be at least 1")
+    if args.catalog_quorum < 1:
+        parser.error("--catalog-quorum must be at least 1")
+    if args.offset < 0 or (args.limit is not None and args.limit < 0):
+        parser.error("--limit and --offset must not be negative")
+    if args.hedge_after is not None and not 0 < args.hedge_after < 100:
+        parser.error("--hedge-after must be a percentile between 0 and 100")
+    if not 0 <= args.hedge_rate <= 1:
+        parser.error("--hedge-rate must be between 0 and 1")
+    args.hedge_policy = None
+    if args.hedge_after is not None:
+        from .core.hedging import HedgePolicy
+        args.hedge_policy = HedgePolicy(percentile=args.hedge_after / 100, max_rate=args.hedge_rate)
     
     try:
-        await version_list.download_list()
-    except Exception as e:
-        print(f"Error loading version list: {e}")
-        return 1
+        args.fields = parse_fields(args.fields)
+        if args.sort:
+            parse_fields(args.sort)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.catalog_db and args.sort in ('size', 'etag', 'last_modified'):
+        parser.error(f"--sort {args.sort} is not available with --catalog-db")
         
-    print(f"Loaded {len(version_list.versions)} versions")
-    
-    if args.search:
-        results = version_list.search_versions(args.search)
-        print(f"\\nSearch results for '{args.search}':")
-        print("-" * 80)
-        for version in results:
-            print(f"{version['name']:<30} {version['type_name']:<10} {version['uuid']}")
-        return 0
+    configure_logging(args.verbose)
     
-    if args.list:
-        type_filter = {'release': 0, 'beta': 1, 'preview': 2}.get(args.type, 0)
-        filtered_versions = version_list.get_versions_by_type(type_filter)
+    # Records and events in the machine-readable formats, or a package with --output -, own stdout;
+    # everything else goes to stderr
+    args.stdout = sys.stdout
+    if args.format == 'table' and args.output != '-':
+        return run_main(args, parser)
+    with contextlib.redirect_stdout(sys.stderr):
+        return run_main(args, parser)
+
+
+def run_main(args, parser) -> int:
+    phase_timer = None
+    if args.timings:
+        phase_timer = PhaseTimer()
+        tracer.add_listener(phase_timer)
         
-        print(f"\\n{args.type.title()} versions:")
-        print("-" * 80)
-        for version in filtered_versions:
-            print(f"{version['name']:<30} {version['type_name']:<10} {version['uuid']}")
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
         
-        return 0
+    try:
+        if profiler:
+            profiler.enable()
+        exit_code = run_offline(args, parser)
+        if exit_code is None:
+            exit_code = run_async(main_async(args, parser))
+        return exit_code
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"Profile written to {args.profile}")
+        if phase_timer:
+            print()
+            print(phase_timer.report())
+        if args.hedge_policy and args.hedge_policy.requests:
+            print_hedge_stats(args.hedge_policy)
+        if args.metrics_json:
+            write_metrics_summary(args.metrics_json)
+
+
+async def main_async(args, parser) -> int:
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = await metrics.MetricsServer(port=args.metrics_port).start()
+        print(f"Serving metrics on http://127.0.0.1:{metrics_server.port}/metrics")
+        
+    try:
+        return await run(args, parser)
+    finally:
+        if metrics_server:
+            await metrics_server.stop()
+
+
+def run_async(coroutine):
+    import asyncio
     
-    if args.download or args.name:
-        target_version = None
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+    return asyncio.run(coroutine)
+
+
+async def run(args, parser) -> int:
+    if args.command and args.command[0] in ('store', 'restore'):
+        return run_store_command(args)
         
-        if args.download:
-            target_version = version_list.get_version_by_uuid(args.download)
-        elif args.name:
-            target_version = version_list.get_version_by_name(args.name)
-                    
-        if not target_version:
-            print("Version not found!")
+    if args.command and args.command[0] == 'serve':
+        return await run_serve_command(args)
+        
+    if args.command and args.command[0] == 'service':
+        return await run_service_command(args)
+        
+    if args.command and args.command[0] == 'mirror':
+        return await run_mirror_command(args)
+        
+    if args.command and args.command[0] == 'history':
+        return await run_history_command(args)
+        
+    if args.command and args.command[0] == 'resolve':
+        return await run_resolve_command(args)
+    
+    version_list = create_version_list(args)
+    
+    if args.download and not (args.command or args.list or args.search):
+        # The UUID is enough to resolve the package; the catalog only adds its name and type
+        import asyncio
+        catalog_task = None
+        if not load_cached_version_list(version_list, args) and not args.offline:
+            catalog_task = asyncio.ensure_future(version_list.download_list())
+        return await download_version(args, args.download, version_list, catalog_task)
+    
+    if (args.search or args.list) and not (args.command or args.sort or args.reverse or args.catalog_db):
+        # Without ordering, records can be printed while the catalog downloads
+        print("Loading version list...")
+        if load_cached_version_list(version_list, args):
+            return print_version_listing(version_list, args)
+        if args.offline:
+            print("No cached version list; run once without --offline")
+            return 1
+        return await stream_version_listing(version_list, args)
+    
+    if not await load_version_list(version_list, args):
+        return 1
+    
+    if args.search or args.list:
+        return print_version_listing(version_list, args)
+    
+    if args.command:
+        if args.command[0] != 'inspect':
+            print(f"Unknown command: {args.command[0]}")
             return 1
             
-        if args.output:
-            output_path = args.output
-        else:
-            output_path = get_default_filename(target_version['name'], target_version['type_name'])
-                
-        print(f"\\nDownloading {target_version['name']} ({target_version['type_name']})")
-        print(f"UUID: {target_version['uuid']}")
-        print(f"Output: {output_path}")
-        
-        if target_version['version_type'] == 1 and not args.token:
-            print("\\nWARNING: Beta versions require authentication!")
-            print("Please provide an MSA token using --token parameter")
-            print("You can obtain this token from the Xbox authentication process")
+        target_version = await resolve_target_version(version_list, args)
+        if not target_version:
+            print("Version not found!")
             return 1
             
-        try:
-            async with VersionDownloader() as downloader:
-                if args.token:
-                    downloader.enable_user_authorization(args.token)
+        return await inspect_package(target_version, args.command[1:], args)
+    
+    if args.download or args.name:
+        target_version = await resolve_target_version(version_list, args)
                     
-                await downloader.download(
-                    target_version['uuid'], 
-                    "1",
-                    output_path,
-                    progress_callback
-                )
-                
-            print(f"\\nDownload completed: {output_path}")
-            
-        except BadUpdateIdentityException:
-            print("\\nError: Unable to fetch download URL")
-            if target_version['version_type'] == 1:
-                print("For beta versions, make sure:")
-                print("1. Your account is subscribed to the Minecraft beta program")
-                print("2. You have provided a valid MSA token")
-            return 1
-        except Exception as e:
-            print(f"\\nDownload failed: {e}")
+        if not target_version:
+            print("Version not found!")
             return 1
-    
-    if not any([args.list, args.download, args.name, args.search]):
-        parser.print_help()
-        return 0
             
+        return await download_version(args, target_version['uuid'], version_list)
+    
     return 0
 
 
 def cli_main():
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        
-        if os.environ.get('PYTHONIOENCODING') is None:
-            os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if sys.platform == 'win32' and os.environ.get('PYTHONIOENCODING') is None:
+        os.environ['PYTHONIOENCODING'] = 'utf-8'
     
     try:
-        if sys.platform == 'win32':
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                exit_code = loop.run_until_complete(main())
-                sys.exit(exit_code)
-            finally:
-                loop.close()
-        else:
-            exit_code = asyncio.run(main())
-            sys.exit(exit_code)
+        exit_code = main()
+        sys.exit(exit_code)
     except KeyboardInterrupt:
         print("\\nOperation cancelled by user")
         sys.exit(1)
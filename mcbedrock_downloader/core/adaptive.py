@@ -0,0 +1,198 @@
+"""
+Adaptive tuning of read size, segment size and connection count
+"""
+import time
+import logging
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+KB = 1024
+MB = 1024 * 1024
+
+MIN_SEGMENT_SIZE = 1 * MB
+# Read size used where no controller is tuning it, e.g. a single streamed request
+DEFAULT_READ_SIZE = 1 * MB
+
+
+def _clamp(value: float, low: int, high: int) -> int:
+    return int(max(low, min(high, value)))
+
+
+def _round_pow2(value: int) -> int:
+    return 1 << max(0, int(value).bit_length() - 1)
+
+
+class ConnectionStats:
+
+    def __init__(self, connection_id: int):
+        self.connection_id = connection_id
+        self.bytes = 0
+        self.busy_time = 0.0
+        self.rtt = None
+
+    def record_rtt(self, rtt: float):
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt = 0.8 * self.rtt + 0.2 * rtt
+
+    def record_transfer(self, size: int, elapsed: float):
+        self.bytes += size
+        self.busy_time += elapsed
+
+    @property
+    def throughput(self) -> float:
+        if self.busy_time <= 0:
+            return 0.0
+        return self.bytes / self.busy_time
+
+
+class AdaptiveController:
+    """Tunes transfer parameters from measured per-connection throughput and RTT.
+
+    Connections are added one at a time while aggregate throughput keeps
+    improving and removed again when it drops. Segment and read sizes follow
+    the per-connection rate so that each request amortises its round trip.
+    """
+
+    def __init__(self, min_connections: int = 1, max_connections: int = 8,
+                 initial_connections: int = 2, min_segment_size: int = MIN_SEGMENT_SIZE,
+                 max_segment_size: int = 64 * MB, min_read_size: int = 64 * KB,
+                 max_read_size: int = 4 * MB, segment_seconds: float = 4.0,
+                 interval: float = 1.0, improve_ratio: float = 1.05,
+                 drop_ratio: float = 0.90, enabled: bool = True):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.min_segment_size = min_segment_size
+        self.max_segment_size = max_segment_size
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+        self.segment_seconds = segment_seconds
+        self.interval = interval
+        self.improve_ratio = improve_ratio
+        self.drop_ratio = drop_ratio
+        self.enabled = enabled
+
+        self.connections = _clamp(initial_connections, min_connections, max_connections)
+        self.segment_size = 8 * MB
+        self.read_size = DEFAULT_READ_SIZE
+
+        self.stats = {}
+        self.decisions = []
+
+        self._window_start = None
+        self._window_bytes = 0
+        self._best_throughput = 0.0
+        self._last_throughput = 0.0
+        self._last_action = None
+
+    @classmethod
+    def fixed(cls, connections: int = 1, segment_size: int = 8 * MB, read_size: int = DEFAULT_READ_SIZE):
+        controller = cls(min_connections=connections, max_connections=connections,
+                         initial_connections=connections, enabled=False)
+        controller.segment_size = segment_size
+        controller.read_size = read_size
+        return controller
+
+    def connection(self, connection_id: int) -> ConnectionStats:
+        if connection_id not in self.stats:
+            self.stats[connection_id] = ConnectionStats(connection_id)
+        return self.stats[connection_id]
+
+    def record_rtt(self, connection_id: int, rtt: float):
+        self.connection(connection_id).record_rtt(rtt)
+
+    def record_transfer(self, connection_id: int, size: int, elapsed: float):
+        self.connection(connection_id).record_transfer(size, elapsed)
+
+        now = time.monotonic()
+        if self._window_start is None:
+            self._window_start = now
+        self._window_bytes += size
+
+        if now - self._window_start >= self.interval:
+            self._evaluate(self._window_bytes / (now - self._window_start))
+            self._window_start = now
+            self._window_bytes = 0
+
+    def per_connection_throughput(self) -> float:
+        rates = [s.throughput for s in self.stats.values() if s.throughput > 0]
+        if not rates:
+            return 0.0
+        return sum(rates) / len(rates)
+
+    def mean_rtt(self) -> Optional[float]:
+        rtts = [s.rtt for s in self.stats.values() if s.rtt is not None]
+        if not rtts:
+            return None
+        return sum(rtts) / len(rtts)
+
+    def _evaluate(self, throughput: float):
+        if not self.enabled:
+            return
+
+        previous = self._last_throughput
+        action = "hold"
+
+        if previous <= 0:
+            action = "grow" if self.connections < self.max_connections else "hold"
+        elif throughput >= previous * self.improve_ratio:
+            if self._last_action != "shrink" and self.connections < self.max_connections:
+                action = "grow"
+        elif throughput < previous * self.drop_ratio:
+            if self._last_action == "grow" and self.connections > self.min_connections:
+                action = "shrink"
+            elif throughput < self._best_throughput * self.drop_ratio and self.connections > self.min_connections:
+                action = "shrink"
+
+        if action == "grow":
+            self.connections += 1
+        elif action == "shrink":
+            self.connections -= 1
+
+        self._retune_sizes()
+        self._best_throughput = max(self._best_throughput, throughput)
+        self._last_throughput = throughput
+        self._last_action = action
+
+        decision = {
+            'time': time.time(),
+            'throughput': throughput,
+            'action': action,
+            'connections': self.connections,
+            'segment_size': self.segment_size,
+            'read_size': self.read_size,
+            'rtt': self.mean_rtt(),
+        }
+        self.decisions.append(decision)
+
+        logger.info("adaptive: %s connections=%d throughput=%.1f KB/s segment=%d read=%d rtt=%s",
+                    action, self.connections, throughput / KB, self.segment_size,
+                    self.read_size, "%.3fs" % decision['rtt'] if decision['rtt'] is not None else "n/a")
+
+    def _retune_sizes(self):
+        rate = self.per_connection_throughput()
+        if rate <= 0:
+            return
+
+        rtt = self.mean_rtt() or 0.0
+        # A segment should last several seconds and dwarf the request round trip
+        target = max(rate * self.segment_seconds, rate * rtt * 20)
+        self.segment_size = _round_pow2(_clamp(target, self.min_segment_size, self.max_segment_size))
+        self.read_size = _round_pow2(_clamp(rate * 0.1, self.min_read_size, self.max_read_size))
+
+    def summary(self) -> dict:
+        return {
+            'adaptive': self.enabled,
+            'connections': self.connections,
+            'segment_size': self.segment_size,
+            'read_size': self.read_size,
+            'decisions': list(self.decisions),
+            'per_connection': {
+                cid: {'bytes': s.bytes, 'throughput': s.throughput, 'rtt': s.rtt}
+                for cid, s in self.stats.items()
+            },
+        }
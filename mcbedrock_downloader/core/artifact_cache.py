@@ -0,0 +1,341 @@
+"""
+On-disk package cache with single-flight upstream fetches, shared between processes
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from . import metrics
+from .tracing import tracer
+from .locks import FileLock
+from .transfer import SegmentedTransfer, probe
+from .exceptions import BadUpdateIdentityException, DownloadFailedException
+
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_RE = re.compile(r'[0-9A-Za-z-]+')
+
+
+class PendingArtifact:
+    """A package being fetched upstream; readers can follow the bytes written so far."""
+
+    def __init__(self, update_identity: str, revision: str, path: str):
+        self.update_identity = update_identity
+        self.revision = revision
+        self.path = path
+        self.size = None
+        self.size_known = False
+        self.available = 0
+        self.done = False
+        self.error = None
+        self.task = None
+        self.transfer = None
+        self.limiter = None
+        self.shared_at = 0.0
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def set_size(self, size: Optional[int]):
+        self.size = size
+        self.size_known = True
+        self._notify()
+
+    def advance(self, available: int):
+        if available > self.available:
+            self.available = available
+            self._notify()
+
+    def finish(self):
+        self.size = self.available
+        self.size_known = True
+        self.done = True
+        self._notify()
+
+    def fail(self, error: Exception):
+        self.error = error
+        self._notify()
+
+    def unthrottle(self):
+        """Lift the bandwidth limit, e.g. when a client starts waiting on a background fetch."""
+        self.limiter = None
+        if self.transfer is not None:
+            self.transfer.limiter = None
+
+    def _check(self):
+        if self.error is not None:
+            raise DownloadFailedException(f"Upstream download failed: {self.error}")
+
+    async def wait_size(self) -> Optional[int]:
+        """Wait until the upstream size is known; None if the upstream did not send one."""
+        while not self.size_known and self.error is None:
+            await self._changed.wait()
+        self._check()
+        return self.size
+
+    async def wait_for(self, offset: int) -> int:
+        """Wait until offset bytes are on disk (or the fetch ended) and return how many are."""
+        while self.available < offset and not self.done and self.error is None:
+            await self._changed.wait()
+        self._check()
+        return self.available
+
+
+class ArtifactCache:
+    """Packages stored once under root, fetched upstream at most once at a time.
+
+    Several processes can share root: the first to ask for a package takes its
+    lock file and fetches it, publishing its progress; the others follow that
+    progress and read the same file. If the fetching process dies, a follower
+    takes over the fetch.
+
+    Layout under root:
+        packages/UUID-REV.appx       package data
+        packages/UUID-REV.json       written when the package is complete
+        packages/UUID-REV.lock       held by the process fetching the package
+        packages/UUID-REV.progress   size and bytes written so far, for followers
+    """
+
+    def __init__(self, root: str, downloader, max_concurrent: int = 2, stale_after: float = 60,
+                 poll_interval: float = 0.25):
+        self.root = root
+        self.downloader = downloader
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.packages_dir = os.path.join(root, 'packages')
+        self.pending = {}
+        self.last_request = 0.0
+        self._limit = asyncio.Semaphore(max_concurrent)
+        os.makedirs(self.packages_dir, exist_ok=True)
+
+    def _paths(self, update_identity: str, revision: str) -> Tuple[str, str]:
+        if not IDENTITY_RE.fullmatch(update_identity) or not IDENTITY_RE.fullmatch(revision):
+            raise ValueError(f"Invalid update identity: {update_identity}/{revision}")
+        base = os.path.join(self.packages_dir, f"{update_identity}-{revision}")
+        return base + '.appx', base + '.json'
+
+    def _lock(self, pending: PendingArtifact) -> FileLock:
+        path, _ = self._paths(pending.update_identity, pending.revision)
+        return FileLock(path[:-len('.appx')] + '.lock', self.stale_after)
+
+    def _progress_path(self, pending: PendingArtifact) -> str:
+        path, _ = self._paths(pending.update_identity, pending.revision)
+        return path[:-len('.appx')] + '.progress'
+
+    def lookup(self, update_identity: str, revision: str = "1") -> Optional[str]:
+        """Return the path of a completed package, or None."""
+        path, meta_path = self._paths(update_identity, revision)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if os.path.getsize(path) == meta['size']:
+                return path
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def entries(self) -> List[Dict]:
+        entries = []
+        for name in sorted(os.listdir(self.packages_dir)):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.packages_dir, name)) as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return entries
+
+    def busy(self) -> bool:
+        """Whether a client-requested (unthrottled) fetch is in progress."""
+        return any(pending.limiter is None for pending in self.pending.values())
+
+    def get(self, update_identity: str, revision: str = "1",
+            limiter=None) -> Tuple[Optional[str], Optional[PendingArtifact]]:
+        """Return (path, None) for a cached package, otherwise (None, pending fetch).
+
+        A limiter marks a background fetch; client requests (no limiter) joining
+        a background fetch lift its limit.
+        """
+        if limiter is None:
+            self.last_request = time.monotonic()
+        path = self.lookup(update_identity, revision)
+        if path:
+            metrics.CACHE_HITS.inc(cache='artifact')
+            return path, None
+
+        key = (update_identity, revision)
+        pending = self.pending.get(key)
+        if pending is not None:
+            metrics.CACHE_HITS.inc(cache='artifact_inflight')
+            if limiter is None and pending.limiter is not None:
+                pending.unthrottle()
+            return None, pending
+
+        metrics.CACHE_MISSES.inc(cache='artifact')
+        pending = PendingArtifact(update_identity, revision, self._paths(update_identity, revision)[0])
+        pending.limiter = limiter
+        self.pending[key] = pending
+        pending.task = asyncio.ensure_future(self._run(pending))
+        return None, pending
+
+    async def ensure(self, update_identity: str, revision: str = "1", limiter=None) -> str:
+        """Return the path of the package, fetching it upstream if needed."""
+        path, pending = self.get(update_identity, revision, limiter)
+        if path:
+            return path
+        await asyncio.shield(pending.task)
+        pending._check()
+        return pending.path
+
+    async def _run(self, pending: PendingArtifact):
+        key = (pending.update_identity, pending.revision)
+        try:
+            while True:
+                lock = self._lock(pending)
+                if lock.acquire():
+                    await self._fill(pending, lock)
+                    break
+                if await self._follow(pending, lock):
+                    break
+                # The other process stopped without finishing the package; try to take over
+        except asyncio.CancelledError:
+            pending.fail(DownloadFailedException("cancelled"))
+            raise
+        except Exception as e:
+            logger.warning("Upstream fetch of %s failed: %s", pending.update_identity, e)
+            pending.fail(e)
+        finally:
+            self.pending.pop(key, None)
+
+    async def _fill(self, pending: PendingArtifact, lock: FileLock):
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.stale_after / 4)
+                lock.refresh()
+
+        refresher = asyncio.ensure_future(heartbeat())
+        try:
+            if self.lookup(pending.update_identity, pending.revision):
+                # Completed by another process between get() and taking the lock
+                self._adopt(pending)
+                return
+            async with self._limit:
+                with tracer.span('cache_fill', update_identity=pending.update_identity):
+                    await self._fetch(pending)
+            pending.finish()
+            self._write_meta(pending)
+            logger.info("Cached %s (%d bytes)", pending.update_identity, pending.size)
+        finally:
+            refresher.cancel()
+            try:
+                os.remove(self._progress_path(pending))
+            except FileNotFoundError:
+                pass
+            lock.release()
+
+    async def _follow(self, pending: PendingArtifact, lock: FileLock) -> bool:
+        """Tail a fetch running in another process; False if it stopped without completing."""
+        logger.info("Waiting for %s, fetched by %s", pending.update_identity, (lock.holder() or {}).get('owner'))
+        metrics.CACHE_HITS.inc(cache='artifact_shared')
+        progress_path = self._progress_path(pending)
+        while True:
+            if self.lookup(pending.update_identity, pending.revision):
+                self._adopt(pending)
+                return True
+            try:
+                with open(progress_path) as f:
+                    progress = json.load(f)
+            except (OSError, ValueError):
+                progress = None
+            if progress is not None:
+                if progress['size_known'] and not pending.size_known:
+                    pending.set_size(progress['size'])
+                pending.advance(progress['available'])
+            if lock.is_stale():
+                # Released or abandoned; it may have completed just before
+                if self.lookup(pending.update_identity, pending.revision):
+                    self._adopt(pending)
+                    return True
+                return False
+            await asyncio.sleep(self.poll_interval)
+
+    def _adopt(self, pending: PendingArtifact):
+        size = os.path.getsize(pending.path)
+        if not pending.size_known:
+            pending.set_size(size)
+        pending.advance(size)
+        pending.finish()
+
+    def _share(self, pending: PendingArtifact, force: bool = False):
+        """Publish the fetch progress for other processes, at most every poll_interval."""
+        now = time.monotonic()
+        if not force and now - pending.shared_at < self.poll_interval:
+            return
+        pending.shared_at = now
+        path = self._progress_path(pending)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'size': pending.size, 'size_known': pending.size_known, 'available': pending.available}, f)
+        os.replace(path + '.tmp', path)
+
+    async def _fetch(self, pending: PendingArtifact):
+        url = await self.downloader.get_download_url(pending.update_identity, pending.revision)
+        if not url:
+            raise BadUpdateIdentityException("Unable to get download URL")
+
+        session = self.downloader.session
+        total_size, ranged = await probe(session, url)
+        controller = self.downloader.create_controller()
+
+        def publish(f, available):
+            if available > pending.available:
+                f.flush()
+                pending.advance(available)
+                self._share(pending)
+
+        with open(pending.path, 'w+b') as f:
+            if ranged and total_size > controller.min_segment_size * 2:
+                pending.set_size(total_size)
+                self._share(pending, force=True)
+                f.truncate(total_size)
+                transfer = SegmentedTransfer(session, url, total_size, f, controller,
+                                             lambda done, total: publish(f, transfer.contiguous_bytes()),
+                                             limiter=pending.limiter)
+                pending.transfer = transfer
+                await transfer.run()
+                return
+
+            async with session.get(url) as response:
+                response.raise_for_status()
+                pending.set_size(int(response.headers.get('content-length', 0)) or None)
+                self._share(pending, force=True)
+                written = 0
+                async for chunk in response.content.iter_chunked(controller.read_size):
+                    f.write(chunk)
+                    written += len(chunk)
+                    metrics.BYTES_TRANSFERRED.inc(len(chunk), source='cdn')
+                    publish(f, written)
+                    if pending.limiter is not None:
+                        await pending.limiter.consume(len(chunk))
+            f.flush()
+
+        if pending.size is not None and pending.available != pending.size:
+            raise DownloadFailedException(f"Incomplete download: {pending.available} of {pending.size} bytes")
+
+    def _write_meta(self, pending: PendingArtifact):
+        _, meta_path = self._paths(pending.update_identity, pending.revision)
+        meta = {
+            'uuid': pending.update_identity,
+            'revision': pending.revision,
+            'size': pending.size,
+            'cached_at': time.time(),
+        }
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
@@ -0,0 +1,193 @@
+"""
+Catalog-wide URL resolution with adaptive (AIMD) concurrency
+"""
+import time
+import asyncio
+import logging
+import aiohttp
+from typing import AsyncIterator, Dict, Optional, Sequence
+
+from . import metrics
+from .transfer import probe_metadata
+from .resolution_cache import ResolutionCache
+
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying after backing off; other errors are final for that version
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class AimdLimiter:
+    """Concurrency limit that grows additively and shrinks multiplicatively.
+
+    Each healthy completion adds 1/limit, i.e. about one slot per round of
+    requests. Throttling, server errors or a smoothed latency above
+    latency_tolerance times the best seen (plus latency_slack seconds, so
+    jitter on a fast server does not count) multiply the limit by decrease,
+    at most once per round so a burst of failures counts as one signal.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, decrease: float = 0.5,
+                 latency_tolerance: float = 2.0, latency_slack: float = 0.05):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.inflight = 0
+        self.peak = self.limit
+        self.decreases = 0
+        self.baseline = None
+        self.smoothed = None
+        self._issued = 0
+        self._decreased_at = 0
+        self._changed = asyncio.Event()
+
+    async def acquire(self) -> int:
+        """Wait for a free slot; returns a ticket to pass to release()."""
+        while self.inflight >= int(self.limit):
+            await self._changed.wait()
+        self.inflight += 1
+        self._issued += 1
+        return self._issued
+
+    def release(self, ticket: int, latency: Optional[float] = None, congested: bool = False):
+        self.inflight -= 1
+        if latency is not None:
+            self.smoothed = latency if self.smoothed is None else 0.8 * self.smoothed + 0.2 * latency
+            # The best latency seen, allowed to drift up slowly as conditions change
+            self.baseline = latency if self.baseline is None else min(latency, self.baseline * 1.01)
+            congested = congested or self.smoothed > self.baseline * self.latency_tolerance + self.latency_slack
+
+        if congested:
+            if ticket > self._decreased_at:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._decreased_at = self._issued
+                self.decreases += 1
+                logger.info("resolver concurrency down to %d", int(self.limit))
+        elif latency is not None:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.limit)
+
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class BulkResolver:
+    """Resolves download URLs for many versions, streaming results to a ResolutionCache.
+
+    With probe, each URL also gets a HEAD request for its size, ETag and
+    Last-Modified.
+    """
+
+    def __init__(self, downloader, cache: Optional[ResolutionCache] = None, limiter: Optional[AimdLimiter] = None,
+                 probe: bool = True, max_retries: int = 4, max_age: Optional[float] = None):
+        self.downloader = downloader
+        self.cache = cache
+        self.limiter = limiter or AimdLimiter()
+        self.probe = probe
+        self.max_retries = max_retries
+        self.max_age = max_age
+        self.stats = {'resolved': 0, 'cached': 0, 'failed': 0, 'retries': 0, 'throttled': 0}
+
+    async def resolve(self, versions: Sequence[Dict]) -> AsyncIterator[Dict]:
+        """Yield a record per version as each completes (cached ones first)."""
+        todo = []
+        for version in versions:
+            record = self.cache.get(version['uuid'], max_age=self.max_age) if self.cache else None
+            if record is not None and record.get('url'):
+                self.stats['cached'] += 1
+                yield dict(record, name=version['name'], type_name=version['type_name'])
+            else:
+                todo.append(version)
+
+        results = asyncio.Queue()
+        tasks = set()
+
+        async def run(version: Dict, ticket: int):
+            try:
+                record = await self._resolve(version, ticket)
+            except Exception as e:
+                record = self._record(version, error=str(e))
+            results.put_nowait(record)
+
+        async def feed():
+            for version in todo:
+                ticket = await self.limiter.acquire()
+                task = asyncio.ensure_future(run(version, ticket))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            for _ in range(len(todo)):
+                record = await results.get()
+                self.stats['failed' if record['error'] else 'resolved'] += 1
+                if self.cache is not None:
+                    self.cache.put(record)
+                yield record
+        finally:
+            feeder.cancel()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(feeder, *tasks, return_exceptions=True)
+
+    def _record(self, version: Dict, url: Optional[str] = None, metadata: Optional[Dict] = None,
+                error: Optional[str] = None) -> Dict:
+        metadata = metadata or {}
+        return {
+            'uuid': version['uuid'],
+            'revision': '1',
+            'name': version['name'],
+            'type_name': version['type_name'],
+            'url': url,
+            'size': metadata.get('size'),
+            'etag': metadata.get('etag'),
+            'last_modified': metadata.get('last_modified'),
+            'error': error,
+            'resolved_at': time.time(),
+        }
+
+    async def _resolve(self, version: Dict, ticket: int) -> Dict:
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                url = await self.downloader.fetch_download_url(version['uuid'], "1")
+                metadata = None
+                if url and self.probe:
+                    metadata = await probe_metadata(self.downloader.session, url)
+            except aiohttp.ClientResponseError as e:
+                self.limiter.release(ticket, congested=e.status == 429 or e.status >= 500)
+                if e.status == 429:
+                    self.stats['throttled'] += 1
+                if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return self._record(version, error=f"HTTP {e.status}")
+                delay = self._retry_after(e) or min(2 ** attempt, 30)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.limiter.release(ticket, congested=True)
+                if attempt >= self.max_retries:
+                    return self._record(version, error=str(e) or type(e).__name__)
+                delay = min(2 ** attempt, 30)
+            except BaseException:
+                self.limiter.release(ticket)
+                raise
+            else:
+                self.limiter.release(ticket, latency=time.monotonic() - started)
+                return self._record(version, url=url, metadata=metadata,
+                                    error=None if url else "No download URL in the response")
+
+            attempt += 1
+            self.stats['retries'] += 1
+            metrics.RETRIES.inc(operation='bulk_resolve')
+            await asyncio.sleep(delay)
+            ticket = await self.limiter.acquire()
+
+    @staticmethod
+    def _retry_after(error: aiohttp.ClientResponseError) -> Optional[float]:
+        try:
+            return float(error.headers.get('Retry-After')) if error.headers else None
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,184 @@
+"""
+LAN caching server that shares the version catalog and packages with many clients
+"""
+import os
+import time
+import asyncio
+import logging
+
+from aiohttp import web
+
+from . import metrics
+from .artifact_cache import ArtifactCache, PendingArtifact
+from .exceptions import DownloadFailedException
+
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class CacheServer:
+    """Serve a cached catalog and packages over HTTP.
+
+    GET /versions.json            catalog, fetched upstream at most once per catalog_ttl
+    GET /download/UUID?revision=N package, fetched upstream once and shared by all clients
+    GET /status                   cached and in-flight packages
+
+    Completed packages are sent with FileResponse (sendfile and range support).
+    Clients that ask for a package that is still downloading are streamed the
+    bytes as they arrive, including ranged requests.
+    """
+
+    def __init__(self, cache: ArtifactCache, versions_api: str, host: str = '0.0.0.0', port: int = 8080,
+                 catalog_ttl: float = 3600):
+        self.cache = cache
+        self.versions_api = versions_api
+        self.host = host
+        self.port = port
+        self.catalog_ttl = catalog_ttl
+        self.catalog_path = os.path.join(cache.root, 'versions.json')
+        self.runner = None
+        self._catalog = None
+        self._catalog_fetched = 0.0
+        self._catalog_lock = asyncio.Lock()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/versions.json', self.handle_versions)
+        app.router.add_get('/download/{uuid}', self.handle_download)
+        app.router.add_get('/status', self.handle_status)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def get_catalog(self) -> bytes:
+        async with self._catalog_lock:
+            if self._catalog is None and os.path.exists(self.catalog_path):
+                with open(self.catalog_path, 'rb') as f:
+                    self._catalog = f.read()
+                self._catalog_fetched = os.path.getmtime(self.catalog_path)
+
+            if self._catalog is not None and time.time() - self._catalog_fetched < self.catalog_ttl:
+                metrics.CACHE_HITS.inc(cache='catalog')
+                return self._catalog
+
+            metrics.CACHE_MISSES.inc(cache='catalog')
+            try:
+                async with self.cache.downloader.session.get(self.versions_api) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+            except Exception as e:
+                if self._catalog is None:
+                    raise
+                logger.warning("Catalog refresh failed, serving cached copy: %s", e)
+                return self._catalog
+
+            with open(self.catalog_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(self.catalog_path + '.tmp', self.catalog_path)
+            self._catalog = data
+            self._catalog_fetched = time.time()
+            return data
+
+    async def handle_versions(self, request: web.Request) -> web.Response:
+        try:
+            data = await self.get_catalog()
+        except Exception as e:
+            raise web.HTTPBadGateway(text=f"Catalog unavailable: {e}")
+        return web.Response(body=data, content_type='application/json')
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        pending = [{
+            'uuid': artifact.update_identity,
+            'revision': artifact.revision,
+            'size': artifact.size,
+            'available': artifact.available,
+        } for artifact in self.cache.pending.values()]
+        return web.json_response({'cached': self.cache.entries(), 'pending': pending})
+
+    async def handle_download(self, request: web.Request) -> web.StreamResponse:
+        update_identity = request.match_info['uuid']
+        revision = request.query.get('revision', '1')
+        try:
+            path, pending = self.cache.get(update_identity, revision)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        if path:
+            return web.FileResponse(path, headers={'X-Cache': 'HIT'})
+        return await self.stream_pending(request, pending)
+
+    async def stream_pending(self, request: web.Request, pending: PendingArtifact) -> web.StreamResponse:
+        try:
+            size = await pending.wait_size()
+        except DownloadFailedException as e:
+            raise web.HTTPBadGateway(text=str(e))
+
+        start, end, status = 0, size, 200
+        headers = {'Content-Type': 'application/octet-stream', 'X-Cache': 'MISS'}
+        if size is not None:
+            try:
+                requested = request.http_range
+            except ValueError:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{size}'})
+
+            if requested.start is not None or requested.stop is not None:
+                start = requested.start or 0
+                end = size if requested.stop is None else min(requested.stop, size)
+                if start < 0:
+                    start, end = max(0, size + start), size
+                if start >= end:
+                    raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{size}'})
+                status = 206
+                headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+
+            headers['Accept-Ranges'] = 'bytes'
+            headers['Content-Length'] = str(end - start)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+
+        position = start
+        try:
+            # Unbuffered, so read-ahead never returns the zero-filled tail that is not written yet
+            with open(pending.path, 'rb', buffering=0) as f:
+                while end is None or position < end:
+                    available = await pending.wait_for(position + 1)
+                    if available <= position:
+                        break
+                    limit = available if end is None else min(available, end)
+                    f.seek(position)
+                    while position < limit:
+                        data = f.read(min(STREAM_CHUNK_SIZE, limit - position))
+                        if not data:
+                            break
+                        await response.write(data)
+                        position += len(data)
+        except DownloadFailedException as e:
+            # Headers are already sent; close the connection so the client sees a short body and retries
+            logger.warning("Aborting stream of %s: %s", pending.update_identity, e)
+            response.force_close()
+            return response
+        except ConnectionResetError:
+            # Client went away, e.g. a one byte probe closing its connection early
+            return response
+
+        await response.write_eof()
+        return response
@@ -0,0 +1,270 @@
+"""
+SQLite catalog store with full-text search and version history
+"""
+import time
+import sqlite3
+import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..utils.helpers import parse_version_string
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    uuid TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    version_type INTEGER NOT NULL,
+    type_name TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    removed_at REAL
+);
+CREATE INDEX IF NOT EXISTS versions_name ON versions (name);
+CREATE INDEX IF NOT EXISTS versions_type ON versions (version_type, position);
+CREATE INDEX IF NOT EXISTS versions_key ON versions (version_key);
+CREATE TABLE IF NOT EXISTS catalog_events (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    event TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS catalog_events_uuid ON catalog_events (uuid);
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    name TEXT,
+    path TEXT,
+    size INTEGER,
+    downloaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_uuid ON downloads (uuid);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Trigram tokens give substring matches like the in-memory search; needs SQLite 3.34+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS versions_fts USING fts5(
+    name, uuid, type_name, content='versions', tokenize='trigram'
+);
+"""
+
+ORDERS = {
+    'position': 'position',
+    'name': 'version_key, name, position',
+    'uuid': 'uuid',
+    'type_name': 'version_type, position',
+    'version_type': 'version_type, position',
+    'first_seen': 'first_seen, position',
+    'last_seen': 'last_seen, position',
+}
+
+SEARCH_COLUMNS = ('name', 'uuid', 'type_name')
+
+FTS_REBUILD_ROWS = 500
+
+
+def version_key(name: str) -> str:
+    """Text key that sorts version names numerically, e.g. 1.9 before 1.10."""
+    parsed = parse_version_string(name)
+    if parsed is None:
+        return ''
+    return '.'.join(f'{part:010d}' for part in parsed)
+
+
+def format_timestamp(value: Optional[float]) -> Optional[str]:
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+class CatalogDatabase:
+    """Catalog kept in SQLite across refreshes.
+
+    sync() records when each version first and last appeared in the catalog
+    and when it disappeared; query() and count() serve paged, filtered and
+    sorted listings without loading the catalog into Python lists.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        had_fts = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'versions_fts'").fetchone() is not None
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # Built without FTS5 or the trigram tokenizer; search falls back to LIKE
+            self.fts = False
+        if self.fts and not had_fts:
+            self.connection.execute("INSERT INTO versions_fts (versions_fts) VALUES ('rebuild')")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def synced_at(self) -> float:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'synced_at'").fetchone()
+        return float(row['value']) if row else 0.0
+
+    def sync(self, versions: Iterable[Dict], seen_at: Optional[float] = None) -> Dict[str, int]:
+        """Merge a full catalog snapshot seen at seen_at; returns counts of added, returned and removed."""
+        seen_at = seen_at or time.time()
+        known = {row['uuid']: tuple(row)[1:] for row in self.connection.execute(
+            "SELECT uuid, name, version_type, position, removed_at FROM versions")}
+        changes = {'added': 0, 'returned': 0, 'removed': 0}
+        events = []
+        rows = []
+        current = set()
+        for position, version in enumerate(versions):
+            uuid = version['uuid']
+            current.add(uuid)
+            previous = known.get(uuid)
+            if previous is None:
+                events.append((uuid, 'added', seen_at))
+                changes['added'] += 1
+            elif previous[3] is not None:
+                events.append((uuid, 'returned', seen_at))
+                changes['returned'] += 1
+            elif previous[:3] == (version['name'], version['version_type'], position):
+                # Unchanged rows only get last_seen bumped below
+                continue
+            rows.append((uuid, version['name'], version['version_type'], version['type_name'],
+                         version_key(version['name']), position, seen_at, seen_at))
+
+        removed = [uuid for uuid, previous in known.items() if previous[3] is None and uuid not in current]
+        events.extend((uuid, 'removed', seen_at) for uuid in removed)
+        changes['removed'] = len(removed)
+
+        # Updating the index row by row only pays off for small changes
+        rebuild_fts = self.fts and len(rows) > FTS_REBUILD_ROWS
+        with self.connection:
+            self.connection.executemany("UPDATE versions SET removed_at = ? WHERE uuid = ?",
+                                        [(seen_at, uuid) for uuid in removed])
+            self.connection.execute("UPDATE versions SET last_seen = ? WHERE removed_at IS NULL", (seen_at,))
+            if self.fts and not rebuild_fts:
+                # External content index: remove the old terms of rows about to change
+                self.connection.executemany("""
+                    INSERT INTO versions_fts (versions_fts, rowid, name, uuid, type_name)
+                    SELECT 'delete', rowid, name, uuid, type_name FROM versions WHERE uuid = ?
+                """, [(row[0],) for row in rows if row[0] in known])
+            self.connection.executemany("""
+                INSERT INTO versions (uuid, name, version_type, type_name, version_key, position,
+                                      first_seen, last_seen, removed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)
+                ON CONFLICT (uuid) DO UPDATE SET
+                    name = excluded.name, version_type = excluded.version_type,
+                    type_name = excluded.type_name, version_key = excluded.version_key,
+                    position = excluded.position, last_seen = excluded.last_seen, removed_at = NULL
+            """, rows)
+            self.connection.executemany("INSERT INTO catalog_events (uuid, event, at) VALUES (?, ?, ?)", events)
+            if rebuild_fts:
+                self.connection.execute("INSERT INTO versions_fts (versions_fts) VALUES ('rebuild')")
+            elif self.fts:
+                self.connection.executemany("""
+                    INSERT INTO versions_fts (rowid, name, uuid, type_name)
+                    SELECT rowid, name, uuid, type_name FROM versions WHERE uuid = ?
+                """, [(row[0],) for row in rows])
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)",
+                                    (str(seen_at),))
+        return changes
+
+    def _where(self, version_type: Optional[int], search: Optional[str], search_columns: Sequence[str],
+               include_removed: bool) -> Tuple[str, List]:
+        clauses = []
+        params = []
+        if not include_removed:
+            clauses.append("removed_at IS NULL")
+        if version_type is not None:
+            clauses.append("version_type = ?")
+            params.append(version_type)
+        if search:
+            if self.fts and len(search) >= 3:
+                phrase = '"' + search.replace('"', '""') + '"'
+                clauses.append("rowid IN (SELECT rowid FROM versions_fts WHERE versions_fts MATCH ?)")
+                params.append(f"{{{' '.join(search_columns)}}} : {phrase}")
+            else:
+                pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                clauses.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in search_columns) + ')')
+                params.extend([pattern] * len(search_columns))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, version_type: Optional[int] = None, search: Optional[str] = None,
+              search_columns: Sequence[str] = ('name',), order: str = 'position', reverse: bool = False,
+              limit: Optional[int] = None, offset: int = 0, include_removed: bool = False) -> List[Dict]:
+        where, params = self._where(version_type, search, search_columns, include_removed)
+        direction = ' DESC' if reverse else ''
+        order_by = ', '.join(column + direction for column in ORDERS[order].split(', '))
+        sql = f"SELECT * FROM versions{where} ORDER BY {order_by} LIMIT ? OFFSET ?"
+        params.extend([-1 if limit is None else limit, offset])
+        return [self._record(row) for row in self.connection.execute(sql, params)]
+
+    def count(self, version_type: Optional[int] = None, search: Optional[str] = None,
+              search_columns: Sequence[str] = ('name',), include_removed: bool = False) -> int:
+        where, params = self._where(version_type, search, search_columns, include_removed)
+        return self.connection.execute(f"SELECT COUNT(*) FROM versions{where}", params).fetchone()[0]
+
+    def _record(self, row: sqlite3.Row) -> Dict:
+        return {
+            'name': row['name'],
+            'uuid': row['uuid'],
+            'version_type': row['version_type'],
+            'type_name': row['type_name'],
+            'first_seen': format_timestamp(row['first_seen']),
+            'last_seen': format_timestamp(row['last_seen']),
+            'removed_at': format_timestamp(row['removed_at']),
+        }
+
+    def get(self, uuid: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT * FROM versions WHERE uuid = ?", (uuid,)).fetchone()
+        return self._record(row) if row else None
+
+    def get_by_name(self, name: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT * FROM versions WHERE name = ? ORDER BY removed_at IS NOT NULL, "
+                                      "position LIMIT 1", (name,)).fetchone()
+        return self._record(row) if row else None
+
+    def history(self, uuid: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Catalog events (added, removed, returned), newest first."""
+        sql = ("SELECT e.uuid, e.event, e.at, v.name, v.type_name FROM catalog_events e "
+               "LEFT JOIN versions v ON v.uuid = e.uuid")
+        params = []
+        if uuid:
+            sql += " WHERE e.uuid = ?"
+            params.append(uuid)
+        sql += " ORDER BY e.at DESC, e.id DESC LIMIT ?"
+        params.append(limit)
+        return [{'uuid': row['uuid'], 'name': row['name'], 'type_name': row['type_name'],
+                 'event': row['event'], 'at': format_timestamp(row['at'])}
+                for row in self.connection.execute(sql, params)]
+
+    def record_download(self, uuid: str, name: Optional[str], path: Optional[str], size: Optional[int]):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO downloads (uuid, name, path, size, downloaded_at) VALUES (?, ?, ?, ?, ?)",
+                (uuid, name, path, size, time.time()))
+
+    def downloads(self, uuid: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        sql = "SELECT * FROM downloads"
+        params = []
+        if uuid:
+            sql += " WHERE uuid = ?"
+            params.append(uuid)
+        sql += " ORDER BY downloaded_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return [{'uuid': row['uuid'], 'name': row['name'], 'path': row['path'], 'size': row['size'],
+                 'downloaded_at': format_timestamp(row['downloaded_at'])}
+                for row in self.connection.execute(sql, params)]
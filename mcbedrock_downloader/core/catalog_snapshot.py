@@ -0,0 +1,196 @@
+"""
+Memory-mapped binary snapshot of the version catalog
+"""
+import os
+import mmap
+import time
+import struct
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+MAGIC = b'MCBVSNP1'
+FORMAT_VERSION = 1
+
+# magic, format version, record count, created_at, then section offsets:
+# strings, records, name index, uuid index, type starts, type index, search starts, search text
+HEADER = struct.Struct('<8sIId8I')
+# name offset, name length, uuid offset, uuid length, version type
+RECORD = struct.Struct('<IHIHB3x')
+U32 = struct.Struct('<I')
+TYPE_SLOTS = 256
+
+
+def _u32_array(values: Sequence[int]) -> bytes:
+    return struct.pack(f'<{len(values)}I', *values)
+
+
+def write_snapshot(path: str, versions: Sequence[Dict]):
+    """Write versions to path as a snapshot, atomically replacing any previous one."""
+    strings = bytearray()
+    records = bytearray()
+    for version in versions:
+        name = version['name'].encode('utf-8')
+        uuid = version['uuid'].encode('utf-8')
+        records += RECORD.pack(len(strings), len(name), len(strings) + len(name), len(uuid),
+                               version['version_type'] & 0xFF)
+        strings += name + uuid
+
+    count = len(versions)
+    # UTF-8 byte order matches str order, so the indexes can be searched on raw bytes
+    name_index = sorted(range(count), key=lambda i: versions[i]['name'])
+    uuid_index = sorted(range(count), key=lambda i: versions[i]['uuid'])
+    type_index = sorted(range(count), key=lambda i: versions[i]['version_type'] & 0xFF)
+    type_starts = [0] * (TYPE_SLOTS + 1)
+    for index in type_index:
+        type_starts[(versions[index]['version_type'] & 0xFF) + 1] += 1
+    for slot in range(TYPE_SLOTS):
+        type_starts[slot + 1] += type_starts[slot]
+
+    # Lower-cased names separated by NUL, searched with a single find() per match
+    search_text = bytearray()
+    search_starts = []
+    for version in versions:
+        search_starts.append(len(search_text))
+        search_text += version['name'].lower().encode('utf-8') + b'\0'
+
+    sections = [bytes(strings), bytes(records), _u32_array(name_index), _u32_array(uuid_index),
+                _u32_array(type_starts), _u32_array(type_index), _u32_array(search_starts), bytes(search_text)]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        position += -position % 4
+        offsets.append(position)
+        position += len(section)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, time.time(), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class CatalogSnapshot:
+    """Read-only, lazily decoded view of a snapshot file.
+
+    Behaves as a sequence of version dicts in catalog order; opening it only
+    maps the file and reads the header, and each lookup decodes just the
+    records it touches.
+    """
+
+    def __init__(self, path: str, type_names: Optional[Dict[int, str]] = None):
+        self.path = path
+        self.type_names = type_names or {}
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.count, self.created_at, *offsets = HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            self._map.close()
+            raise ValueError(f"Truncated catalog snapshot: {path}")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"Not a catalog snapshot: {path}")
+        (self._strings, self._records, self._name_index, self._uuid_index,
+         self._type_starts, self._type_index, self._search_starts, self._search_text) = offsets
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._version(i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("catalog snapshot index out of range")
+        return self._version(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for index in range(self.count):
+            yield self._version(index)
+
+    def _u32(self, offset: int, index: int) -> int:
+        return U32.unpack_from(self._map, offset + index * 4)[0]
+
+    def _fields(self, index: int):
+        name_offset, name_length, uuid_offset, uuid_length, version_type = RECORD.unpack_from(
+            self._map, self._records + index * RECORD.size)
+        name = self._map[self._strings + name_offset:self._strings + name_offset + name_length]
+        uuid = self._map[self._strings + uuid_offset:self._strings + uuid_offset + uuid_length]
+        return name, uuid, version_type
+
+    def _version(self, index: int) -> Dict:
+        name, uuid, version_type = self._fields(index)
+        return {
+            'name': name.decode('utf-8'),
+            'uuid': uuid.decode('utf-8'),
+            'version_type': version_type,
+            'type_name': self.type_names.get(version_type, "Unknown"),
+        }
+
+    def _find(self, index_offset: int, field: int, key: str) -> Optional[Dict]:
+        """Binary search a sorted index for the first record whose field equals key."""
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._fields(self._u32(index_offset, middle))[field] < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            index = self._u32(index_offset, low)
+            if self._fields(index)[field] == target:
+                return self._version(index)
+        return None
+
+    def by_name(self, name: str) -> Optional[Dict]:
+        return self._find(self._name_index, 0, name)
+
+    def by_uuid(self, uuid: str) -> Optional[Dict]:
+        return self._find(self._uuid_index, 1, uuid)
+
+    def of_type(self, version_type: int) -> List[Dict]:
+        if version_type not in range(TYPE_SLOTS):
+            return []
+        start = self._u32(self._type_starts, version_type)
+        end = self._u32(self._type_starts, version_type + 1)
+        return [self._version(self._u32(self._type_index, i)) for i in range(start, end)]
+
+    def sorted_by_name(self, reverse: bool = False) -> List[Dict]:
+        order = range(self.count - 1, -1, -1) if reverse else range(self.count)
+        return [self._version(self._u32(self._name_index, i)) for i in order]
+
+    def search(self, query: str) -> List[Dict]:
+        """Versions whose name contains query, case-insensitively, in catalog order."""
+        needle = query.lower().encode('utf-8')
+        # The search text is the last section
+        end = len(self._map)
+        results = []
+        position = self._search_text
+        while True:
+            position = self._map.find(needle, position, end)
+            if position < 0:
+                break
+            index = self._record_at(position - self._search_text)
+            results.append(self._version(index))
+            # One hit per record: continue after this record's name
+            if index + 1 == self.count:
+                break
+            position = self._search_text + self._u32(self._search_starts, index + 1)
+        return results
+
+    def _record_at(self, text_offset: int) -> int:
+        low, high = 0, self.count - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._u32(self._search_starts, middle) <= text_offset:
+                low = middle
+            else:
+                high = middle - 1
+        return low
@@ -0,0 +1,261 @@
+"""
+Deduplicated chunk storage for downloaded packages
+"""
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .remote_zip import read_directory
+from .exceptions import RemoteArchiveException
+
+
+logger = logging.getLogger(__name__)
+
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def chunk_boundaries(f, size: int, max_chunk: int = MAX_CHUNK_SIZE) -> List[int]:
+    """Split a package at zip member boundaries, capping each chunk at max_chunk.
+
+    Large members are cut at fixed offsets relative to their own start, so an
+    unchanged member yields the same chunks whatever its position in the file.
+    Files that are not zip archives fall back to fixed-size chunks.
+    """
+    points = {0, size}
+    try:
+        directory = read_directory(f, size)
+        points.update(entry.header_offset for entry in directory.entries)
+        points.add(directory.cd_offset)
+    except (RemoteArchiveException, struct.error, OSError):
+        pass
+
+    boundaries = []
+    ordered = sorted(p for p in points if 0 <= p <= size)
+    for start, end in zip(ordered, ordered[1:]):
+        boundaries.extend(range(start, end, max_chunk))
+    boundaries.append(size)
+    return boundaries
+
+
+class ChunkStore:
+    """Content-addressed store that keeps each unique chunk once.
+
+    Layout under root:
+        objects/ab/abcdef...   chunk data named by SHA-256
+        versions/NAME.json     ordered chunk list for each stored package
+    """
+
+    def __init__(self, root: str, max_chunk: int = MAX_CHUNK_SIZE):
+        self.root = root
+        self.max_chunk = max_chunk
+        self.objects_dir = os.path.join(root, 'objects')
+        self.versions_dir = os.path.join(root, 'versions')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        for path in (self.objects_dir, self.versions_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _index_path(self, name: str) -> str:
+        return os.path.join(self.versions_dir, os.path.basename(name) + '.json')
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self._object_path(digest))
+
+    def _put_chunk(self, data: bytes) -> Tuple[str, bool]:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            metrics.CACHE_HITS.inc(cache='chunk_store')
+            return digest, False
+
+        metrics.CACHE_MISSES.inc(cache='chunk_store')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest, True
+
+    def add_file(self, name: str, path: str) -> Dict:
+        size = os.path.getsize(path)
+        chunks = []
+        new_bytes = 0
+        file_hash = hashlib.sha256()
+
+        with open(path, 'rb') as f:
+            boundaries = chunk_boundaries(f, size, self.max_chunk)
+            f.seek(0)
+            for start, end in zip(boundaries, boundaries[1:]):
+                data = f.read(end - start)
+                file_hash.update(data)
+                digest, created = self._put_chunk(data)
+                if created:
+                    new_bytes += len(data)
+                chunks.append([digest, len(data)])
+
+        index = {
+            'name': os.path.basename(name),
+            'size': size,
+            'sha256': file_hash.hexdigest(),
+            'chunks': chunks,
+            'new_bytes': new_bytes,
+        }
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path(name))
+
+        logger.info("store: %s stored with %d chunks, %d new bytes of %d",
+                    index['name'], len(chunks), new_bytes, size)
+        return index
+
+    def writer(self, name: str) -> 'StoreWriter':
+        return StoreWriter(self, name)
+
+    def get_index(self, name: str) -> Optional[Dict]:
+        path = self._index_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def versions(self) -> List[Dict]:
+        indexes = []
+        for filename in sorted(os.listdir(self.versions_dir)):
+            if filename.endswith('.json'):
+                index = self.get_index(filename[:-5])
+                if index:
+                    indexes.append(index)
+        return indexes
+
+    def stream(self, name: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        index = self.get_index(name)
+        if index is None:
+            raise KeyError(name)
+
+        for digest, size in index['chunks']:
+            with open(self._object_path(digest), 'rb') as f:
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+
+    def restore(self, name: str, destination: str, verify: bool = True) -> str:
+        index = self.get_index(name)
+        if index is None:
+            raise KeyError(name)
+
+        file_hash = hashlib.sha256()
+        with open(destination, 'wb') as f:
+            for data in self.stream(name):
+                file_hash.update(data)
+                f.write(data)
+
+        if verify and file_hash.hexdigest() != index['sha256']:
+            raise ValueError(f"Restored {name} does not match its stored checksum")
+        return destination
+
+    def remove(self, name: str):
+        path = self._index_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def gc(self) -> int:
+        """Delete chunks no longer referenced by any version and return bytes freed."""
+        referenced = set()
+        for index in self.versions():
+            referenced.update(digest for digest, _ in index['chunks'])
+
+        freed = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest not in referenced:
+                    path = os.path.join(prefix_dir, digest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+    def stats(self) -> Dict:
+        versions = self.versions()
+        logical = sum(index['size'] for index in versions)
+
+        stored = 0
+        chunks = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                stored += os.path.getsize(os.path.join(prefix_dir, digest))
+                chunks += 1
+
+        return {
+            'versions': len(versions),
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'unique_chunks': chunks,
+            'dedup_ratio': (logical / stored) if stored else 1.0,
+        }
+
+
+class StoreWriter:
+    """Seekable file-like object that lands its content in a ChunkStore on close.
+
+    Output is spooled to a temporary file inside the store so that segmented
+    downloads can write at arbitrary offsets, then chunked and deduplicated.
+    """
+
+    def __init__(self, store: ChunkStore, name: str):
+        self.store = store
+        self.name = name
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.index = None
+
+    def write(self, data: bytes) -> int:
+        return self.file.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self.file.truncate(size)
+
+    def flush(self):
+        self.file.flush()
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        try:
+            self.index = self.store.add_file(self.name, self.tmp_path)
+        finally:
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,226 @@
+"""
+Delta downloads that reuse unchanged members from a local package of an earlier version
+"""
+import os
+import bisect
+import struct
+import asyncio
+import zipfile
+import logging
+import aiohttp
+from typing import Optional, Callable, List, Tuple
+
+from . import metrics
+from .remote_zip import RemoteZip, ZipDirectory, read_directory, local_header_length, LOCAL_STRUCT
+from .exceptions import DownloadFailedException, RemoteArchiveException
+
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce(ranges: List[Tuple[int, int]], gap: int) -> List[Tuple[int, int]]:
+    """Merge [start, end) ranges that overlap or are separated by at most gap bytes."""
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class DeltaPlan:
+
+    def __init__(self):
+        # (destination offset, base offset, length)
+        self.copies = []
+        self.fetches = []
+        self.reused_members = 0
+        self.changed_members = 0
+
+    @property
+    def reused_bytes(self) -> int:
+        return sum(length for _, _, length in self.copies)
+
+    @property
+    def fetched_bytes(self) -> int:
+        return sum(end - start for start, end in self.fetches)
+
+
+class DeltaDownloader:
+    """Assemble a remote package from a local base package plus ranged fetches.
+
+    Members are matched on name, CRC32, sizes and compression method. The
+    compressed data of matching members is copied from the base package and
+    every other byte (local headers, data descriptors, changed members and the
+    central directory) comes from the remote archive, so the result is
+    byte-identical to the remote file.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, base_path: str,
+                 gap: int = 64 * 1024, concurrency: int = 8):
+        self.session = session
+        self.url = url
+        self.base_path = base_path
+        self.gap = gap
+        self.concurrency = concurrency
+        self.remote = RemoteZip(session, url)
+        self.plan = None
+
+    def _base_index(self, f, directory: ZipDirectory):
+        index = {}
+        for entry in directory.entries:
+            f.seek(entry.header_offset)
+            try:
+                header_length = local_header_length(f.read(LOCAL_STRUCT.size))
+            except (RemoteArchiveException, struct.error):
+                continue
+            index[entry.key()] = entry.header_offset + header_length
+        return index
+
+    async def _fetch_header_offsets(self, entries) -> dict:
+        """Read the fixed part of each remote local header and return its data offset."""
+        windows = coalesce([(e.header_offset, e.header_offset + LOCAL_STRUCT.size) for e in entries], self.gap)
+        buffers = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(start, end):
+            async with semaphore:
+                buffers[start] = await self.remote.fetch(start, end)
+
+        await asyncio.gather(*(fetch(start, end) for start, end in windows))
+
+        starts = [start for start, _ in windows]
+        offsets = {}
+        for entry in entries:
+            start = starts[bisect.bisect_right(starts, entry.header_offset) - 1]
+            relative = entry.header_offset - start
+            header = buffers[start][relative:relative + LOCAL_STRUCT.size]
+            offsets[entry.header_offset] = entry.header_offset + local_header_length(header)
+        return offsets
+
+    async def build_plan(self) -> DeltaPlan:
+        directory = await self.remote.open()
+        plan = DeltaPlan()
+
+        with open(self.base_path, 'rb') as f:
+            base_directory = read_directory(f, os.path.getsize(self.base_path))
+            base_index = self._base_index(f, base_directory)
+
+        entries = directory.in_file_order()
+        # Anything stored ahead of the first member, e.g. a self-extractor stub
+        plan.fetches.append((0, entries[0].header_offset if entries else directory.cd_offset))
+
+        reused = []
+        for entry in entries:
+            # Small members are cheaper to fetch than to splice around
+            if entry.key() in base_index and entry.compress_size > self.gap:
+                reused.append(entry)
+            else:
+                plan.fetches.append((entry.header_offset, entry.region_end))
+                plan.changed_members += 1
+
+        data_offsets = await self._fetch_header_offsets(reused)
+
+        for entry in reused:
+            base_data_offset = base_index[entry.key()]
+            data_offset = data_offsets[entry.header_offset]
+            data_end = data_offset + entry.compress_size
+            if data_end > entry.region_end:
+                plan.fetches.append((entry.header_offset, entry.region_end))
+                plan.changed_members += 1
+                continue
+
+            plan.copies.append((data_offset, base_data_offset, entry.compress_size))
+            plan.fetches.append((entry.header_offset, data_offset))
+            plan.fetches.append((data_end, entry.region_end))
+            plan.reused_members += 1
+
+        plan.fetches.append((directory.cd_offset, directory.archive_size))
+        plan.fetches = coalesce(plan.fetches, self.gap)
+        self.plan = plan
+        return plan
+
+    async def run(self, destination: str, progress_callback: Optional[Callable] = None, verify: bool = True):
+        plan = await self.build_plan()
+        total_size = self.remote.size
+        written = 0
+
+        metrics.CACHE_HITS.inc(plan.reused_members, cache='delta')
+        metrics.CACHE_MISSES.inc(plan.changed_members, cache='delta')
+
+        logger.info("delta: reusing %d members (%d bytes), fetching %d ranges (%d bytes)",
+                    plan.reused_members, plan.reused_bytes, len(plan.fetches), plan.fetched_bytes)
+
+        def advance(size):
+            nonlocal written
+            written += size
+            if progress_callback:
+                progress_callback(written, total_size)
+
+        part = destination + '.part'
+        try:
+            with open(part, 'wb') as out:
+                out.truncate(total_size)
+                if progress_callback:
+                    progress_callback(0, total_size)
+                await self._assemble(out, plan, advance)
+
+            if written != total_size:
+                raise DownloadFailedException(
+                    f"Delta plan covered {written} of {total_size} bytes of the remote package")
+            if verify:
+                self.verify(part)
+            os.replace(part, destination)
+        except BaseException:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            raise
+
+        return plan
+
+    async def _assemble(self, out, plan: DeltaPlan, advance: Callable):
+        with open(self.base_path, 'rb') as base:
+            for offset, base_offset, length in plan.copies:
+                base.seek(base_offset)
+                out.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    chunk = base.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise DownloadFailedException("Base package is truncated")
+                    out.write(chunk)
+                    remaining -= len(chunk)
+                    advance(len(chunk))
+                    metrics.BYTES_TRANSFERRED.inc(len(chunk), source='delta_reused')
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(start, end):
+            async with semaphore:
+                position = start
+                async for chunk in self.remote.iter_range(start, end):
+                    out.seek(position)
+                    out.write(chunk)
+                    position += len(chunk)
+                    advance(len(chunk))
+                if position != end:
+                    raise DownloadFailedException(f"Range {start}-{end} ended early")
+
+        await asyncio.gather(*(fetch(start, end) for start, end in plan.fetches))
+
+    def verify(self, destination: str):
+        if os.path.getsize(destination) != self.remote.size:
+            raise DownloadFailedException("Delta package size does not match the remote package")
+
+        with open(destination, 'rb') as f:
+            directory = read_directory(f, self.remote.size)
+        if [e.key() for e in directory.entries] != [e.key() for e in self.remote.directory.entries]:
+            raise DownloadFailedException("Delta package central directory does not match the remote package")
+
+        with zipfile.ZipFile(destination) as archive:
+            bad = archive.testzip()
+        if bad is not None:
+            raise DownloadFailedException(f"Delta package failed CRC check at {bad}")
@@ -1,11 +1,28 @@
+import os
 import warnings
 import sys
+import logging
+import time
+import contextlib
 import asyncio
 import aiohttp
-from typing import Optional, Callable
+from typing import Optional, Callable, Union
 
+from . import metrics
+from .tracing import tracer
 from .wu_protocol import WUProtocol
-from .exceptions import BadUpdateIdentityException, DownloadFailedException
+from .hedging import HedgePolicy
+from .adaptive import AdaptiveController, DEFAULT_READ_SIZE, MIN_SEGMENT_SIZE
+from .transfer import SegmentedTransfer, probe
+from .sinks import FileSink, Sink, open_sink
+from .remote_zip import RemoteZip
+from .delta import DeltaDownloader
+from .chunk_store import ChunkStore
+from .stream_extract import StreamExtractor
+from .exceptions import BadUpdateIdentityException, DownloadFailedException, RemoteArchiveException
+from ..utils.helpers import format_size, free_disk_space
+
+logger = logging.getLogger(__name__)
 
 if sys.platform == 'win32':
     warnings.filterwarnings("ignore", category=RuntimeWarning, message=".*Event loop is closed.*")
@@ -13,12 +30,26 @@ if sys.platform == 'win32':
 
 class VersionDownloader:
     
-    def __init__(self):
-        self.protocol = WUProtocol()
+    DOWNLOAD_URL_PREFIXES = ("http://tlu.dl.delivery.mp.microsoft.com/",)
+    
+    def __init__(self, adaptive: bool = True, max_connections: int = 8, store: Optional[ChunkStore] = None,
+                 protocol: Optional[WUProtocol] = None, source: Optional[str] = None,
+                 hedge: Optional[HedgePolicy] = None):
+        self.protocol = protocol or WUProtocol()
+        # Base URL of a LAN cache server used instead of Windows Update and the CDN
+        self.source = source.rstrip('/') if source else None
+        self.download_url_prefixes = self.DOWNLOAD_URL_PREFIXES
         self.session = None
+        self.adaptive = adaptive
+        self.max_connections = max_connections
+        self.store = store
+        self.hedge = hedge
+        self.last_transfer = None
+        # In-flight URL resolutions by (update identity, revision), shared by concurrent callers
+        self._resolving = {}
         
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        self.session = aiohttp.ClientSession(trace_configs=[tracer.aiohttp_trace_config()])
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -39,53 +70,281 @@ class VersionDownloader:
             return await response.text()
             
     async def get_download_url(self, update_identity: str, revision_number: str) -> Optional[str]:
-        request_xml = self.protocol.build_download_request(update_identity, revision_number)
+        if self.source:
+            metrics.RESOLUTIONS.inc(result='source')
+            return f"{self.source}/download/{update_identity}?revision={revision_number}"
+            
+        key = (update_identity, revision_number)
+        resolution = self._resolving.get(key)
+        if resolution is None:
+            resolution = asyncio.ensure_future(self._resolve_download_url(update_identity, revision_number))
+            self._resolving[key] = resolution
+            resolution.add_done_callback(lambda _: self._resolving.pop(key, None))
+        else:
+            metrics.RESOLUTIONS.inc(result='shared')
+        # One caller giving up must not cancel the request for the others
+        return await asyncio.shield(resolution)
         
+    async def _resolve_download_url(self, update_identity: str, revision_number: str) -> Optional[str]:
         try:
-            response_xml = await self.post_xml_async(self.protocol.get_download_url(), request_xml)
+            return await self.fetch_download_url(update_identity, revision_number)
+        except Exception as e:
+            metrics.RESOLUTIONS.inc(result='error')
+            logger.warning("Error getting download URL: %s", e)
+            return None
+            
+    async def fetch_download_url(self, update_identity: str, revision_number: str) -> Optional[str]:
+        """Resolve the download URL with one SOAP request; unlike get_download_url, errors are raised."""
+        if self.source:
+            return f"{self.source}/download/{update_identity}?revision={revision_number}"
             
+        started = time.monotonic()
+        with tracer.span('soap_round_trip') as span:
+            response_xml = await self._post_download_request(update_identity, revision_number, span)
+        metrics.RESOLUTION_SECONDS.observe(time.monotonic() - started)
+        
+        with tracer.span('url_selection') as span:
             urls = self.protocol.extract_download_response_urls(response_xml)
+            span.set(candidates=len(urls))
             for url in urls:
-                if url.startswith("http://tlu.dl.delivery.mp.microsoft.com/"):
+                if url.startswith(self.download_url_prefixes):
+                    metrics.RESOLUTIONS.inc(result='ok')
                     return url
                     
-        except Exception as e:
-            print(f"Error getting download URL: {e}")
-            
+        metrics.RESOLUTIONS.inc(result='no_url')
         return None
         
-    async def download_file(self, url: str, destination: str, progress_callback: Optional[Callable] = None):
-        print(f"Downloading from: {url}")
-        
+    async def _post_download_request(self, update_identity: str, revision_number: str, span) -> str:
+        """Send the GetExtendedUpdateInfo2 call, hedged with a duplicate if self.hedge says so."""
+        def send():
+            # Every envelope gets a fresh MessageID, so a hedge is a distinct request
+            with tracer.span('envelope_build', update_identity=update_identity):
+                request_xml = self.protocol.build_download_request(update_identity, revision_number)
+            return self.post_xml_async(self.protocol.get_download_url(), request_xml)
+            
+        if self.hedge is None:
+            return await send()
+            
+        policy = self.hedge
+        policy.started()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(send())
+        tasks = {primary: started}
         try:
-            async with self.session.get(url) as response:
-                response.raise_for_status()
-                total_size = int(response.headers.get('content-length', 0))
+            done, _ = await asyncio.wait({primary}, timeout=policy.delay())
+            if done:
+                policy.record(time.monotonic() - started)
+                return primary.result()
+            if not policy.try_hedge():
+                metrics.SOAP_HEDGES.inc(result='skipped')
+                response = await primary
+                policy.record(time.monotonic() - started)
+                return response
                 
-                if progress_callback:
-                    progress_callback(0, total_size)
-                    
-                downloaded = 0
-                chunk_size = 1024 * 1024
+            metrics.SOAP_HEDGES.inc(result='sent')
+            hedge = asyncio.ensure_future(send())
+            tasks[hedge] = time.monotonic()
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    policy.record(time.monotonic() - tasks[task])
+                    policy.finished(hedge_won=task is hedge)
+                    metrics.SOAP_HEDGES.inc(result='won' if task is hedge else 'lost')
+                    span.set(hedged=True, winner='hedge' if task is hedge else 'primary')
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            
+    async def warm_up(self):
+        """Open a connection to the download host so the transfer does not pay for it."""
+        url = f"{self.source}/" if self.source else self.download_url_prefixes[0]
+        try:
+            with tracer.span('warm_up', url=url):
+                async with self.session.head(url, allow_redirects=False) as response:
+                    await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("Connection warm-up failed: %s", e)
+            
+    async def download_file(self, url: str, destination: Union[str, Sink, Callable, None],
+                            progress_callback: Optional[Callable] = None, extract_to: Optional[str] = None):
+        """destination is a file path, '-' for stdout, a Sink or a callable taking each chunk in order."""
+        logger.info("Downloading from: %s", url)
+        
+        started = time.monotonic()
+        try:
+            with tracer.span('download', url=url):
+                size = await self._download_file(url, destination, progress_callback, extract_to)
+        except asyncio.CancelledError:
+            metrics.DOWNLOADS.inc(result='cancelled')
+            raise
+        except Exception:
+            metrics.DOWNLOADS.inc(result='error')
+            raise
+            
+        elapsed = time.monotonic() - started
+        metrics.DOWNLOADS.inc(result='ok')
+        metrics.DOWNLOAD_SECONDS.observe(elapsed)
+        if elapsed > 0:
+            metrics.DOWNLOAD_THROUGHPUT.observe(size / elapsed)
+            
+    async def _download_file(self, url: str, destination: Union[str, Sink, Callable, None],
+                             progress_callback: Optional[Callable], extract_to: Optional[str]) -> int:
+        self.last_transfer = None
+        
+        try:
+            with tracer.span('probe'):
+                total_size, ranged = await probe(self.session, url)
+            if isinstance(destination, str) and destination != '-' and total_size and self.store is None:
+                self.check_disk_space(destination, total_size)
+            
+            extractor = None
+            if extract_to:
+                directory = await self.prefetch_directory(url, total_size) if ranged else None
+                extractor = StreamExtractor(extract_to, directory)
+            
+            if ranged and total_size > MIN_SEGMENT_SIZE * 2 and extractor is None:
+                controller = self.create_controller()
+                self.last_transfer = controller
+                with self.open_output(destination) as f:
+                    f.truncate(total_size)
+                    transfer = SegmentedTransfer(self.session, url, total_size, f, controller, progress_callback)
+                    started = time.perf_counter()
+                    with tracer.span('transfer', mode='segmented', size=total_size) as span:
+                        await transfer.run()
+                        span.set(steals=transfer.steals, discarded=transfer.discarded,
+                                 peak_held=transfer.peak_held)
+                    if transfer.first_byte_at is not None:
+                        tracer.record('time_to_first_byte', started, transfer.first_byte_at)
+                    with tracer.span('finalize'):
+                        f.close()
+                return transfer.downloaded
                 
-                with open(destination, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(chunk_size):
-                        f.write(chunk)
-                        downloaded += len(chunk)
+            started = time.perf_counter()
+            first_byte_at = None
+            downloaded = 0
+            
+            with self.open_output(destination) as f:
+                with tracer.span('transfer', mode='stream'):
+                    async with self.session.get(url) as response:
+                        response.raise_for_status()
+                        total_size = int(response.headers.get('content-length', 0))
                         
                         if progress_callback:
-                            progress_callback(downloaded, total_size)
+                            progress_callback(0, total_size)
+                            
+                        async for chunk in response.content.iter_chunked(DEFAULT_READ_SIZE):
+                            if first_byte_at is None:
+                                first_byte_at = time.perf_counter()
+                            if f:
+                                await f.write(chunk)
+                            if extractor:
+                                extractor.feed(chunk)
+                            downloaded += len(chunk)
+                            metrics.BYTES_TRANSFERRED.inc(len(chunk), source='cdn')
+                            
+                            if progress_callback:
+                                progress_callback(downloaded, total_size)
+                                
+                if first_byte_at is not None:
+                    tracer.record('time_to_first_byte', started, first_byte_at)
+                    
+                with tracer.span('finalize'):
+                    if f:
+                        f.close()
+                    if extractor:
+                        extracted = extractor.finish()
+                        logger.info("Extracted %d members to: %s", len(extracted), extract_to)
+                
+            return downloaded
                             
+        except DownloadFailedException:
+            raise
         except Exception as e:
             raise DownloadFailedException(f"Failed to download file: {e}")
+            
+    async def prefetch_directory(self, url: str, total_size: int):
+        remote = RemoteZip(self.session, url, total_size)
+        try:
+            return await remote.open()
+        except (RemoteArchiveException, aiohttp.ClientError):
+            return None
+            
+    def check_disk_space(self, destination: str, size: int):
+        free = free_disk_space(destination)
+        if os.path.exists(destination):
+            # Overwritten in place
+            free = None if free is None else free + os.path.getsize(destination)
+        if free is not None and free < size:
+            raise DownloadFailedException(
+                f"Not enough disk space for {format_size(size)} at {destination} ({format_size(free)} free)")
+        
+    def open_output(self, destination: Union[str, Sink, Callable, None]):
+        if destination is None:
+            return contextlib.nullcontext()
+        if self.store is not None and isinstance(destination, str):
+            return FileSink(self.store.writer(destination))
+        return open_sink(destination)
+        
+    def create_controller(self) -> AdaptiveController:
+        if self.adaptive:
+            return AdaptiveController(max_connections=self.max_connections)
+        return AdaptiveController.fixed(self.max_connections)
                         
-    async def download(self, update_identity: str, revision_number: str, destination: str, 
-                      progress_callback: Optional[Callable] = None):
-        print(f"Starting download for update identity: {update_identity}")
+    async def download_delta(self, url: str, destination: str, base_package: str,
+                             progress_callback: Optional[Callable] = None):
+        logger.info("Delta downloading from: %s", url)
+        logger.info("Reusing unchanged members from: %s", base_package)
         
+        delta = DeltaDownloader(self.session, url, base_package)
+        try:
+            with tracer.span('delta', url=url):
+                plan = await delta.run(destination, progress_callback)
+        except RemoteArchiveException as e:
+            logger.warning("Delta download not possible (%s), falling back to full download", e)
+            await self.download_file(url, destination, progress_callback)
+            return None
+        except DownloadFailedException:
+            raise
+        except Exception as e:
+            raise DownloadFailedException(f"Failed to download file: {e}")
+            
+        logger.info("Reused %d members (%d bytes), fetched %d bytes in %d ranges",
+                    plan.reused_members, plan.reused_bytes, plan.fetched_bytes, len(plan.fetches))
+        return plan
+        
+    async def open_remote_package(self, update_identity: str, revision_number: str) -> RemoteZip:
         download_url = await self.get_download_url(update_identity, revision_number)
         if not download_url:
             raise BadUpdateIdentityException("Unable to get download URL")
             
-        print(f"Resolved download link: {download_url}")
-        await self.download_file(download_url, destination, progress_callback)
+        remote = RemoteZip(self.session, download_url)
+        await remote.open()
+        return remote
+        
+    async def download(self, update_identity: str, revision_number: str,
+                      destination: Union[str, Sink, Callable, None],
+                      progress_callback: Optional[Callable] = None, base_package: Optional[str] = None,
+                      extract_to: Optional[str] = None, download_url: Optional[str] = None):
+        logger.info("Starting download for update identity: %s", update_identity)
+        
+        if download_url is None:
+            download_url = await self.get_download_url(update_identity, revision_number)
+        if not download_url:
+            raise BadUpdateIdentityException("Unable to get download URL")
+            
+        logger.info("Resolved download link: %s", download_url)
+        if base_package and not (isinstance(destination, str) and destination != '-'):
+            logger.warning("Delta downloads need a file destination; downloading the full package")
+            base_package = None
+        if base_package:
+            await self.download_delta(download_url, destination, base_package, progress_callback)
+        else:
+            await self.download_file(download_url, destination, progress_callback, extract_to=extract_to)
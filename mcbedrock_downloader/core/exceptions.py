@@ -12,3 +12,7 @@ class VersionListException(Exception):
 
 class AuthenticationException(Exception):
     pass
+
+
+class RemoteArchiveException(Exception):
+    pass
@@ -0,0 +1,69 @@
+"""
+Hedged requests: duplicate a slow call and take whichever answers first
+"""
+from collections import deque
+from typing import Dict
+
+
+class HedgePolicy:
+    """Decides when to send a duplicate of an outstanding request.
+
+    A hedge is sent once a request has been waiting longer than the given
+    percentile of recent latencies. Hedges spend a budget that grows by
+    max_rate per request (up to burst), which caps them at roughly max_rate
+    of all requests however slow the server gets. One policy is meant to be
+    shared by every request it governs.
+    """
+
+    def __init__(self, percentile: float = 0.95, max_rate: float = 0.1, initial_delay: float = 1.0,
+                 min_delay: float = 0.02, window: int = 200, min_samples: int = 10, burst: float = 2.0):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self.latencies = deque(maxlen=window)
+        self.budget = 1.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+
+    def delay(self) -> float:
+        """Seconds to wait for the original request before hedging it."""
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def started(self):
+        self.requests += 1
+        self.budget = min(self.burst, self.budget + self.max_rate)
+
+    def try_hedge(self) -> bool:
+        if self.budget < 1:
+            self.skipped += 1
+            return False
+        self.budget -= 1
+        self.hedges += 1
+        return True
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+
+    def finished(self, hedge_won: bool):
+        if hedge_won:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'skipped': self.skipped,
+            'hedge_rate': self.hedges / self.requests if self.requests else 0.0,
+            'win_rate': self.hedge_wins / self.hedges if self.hedges else 0.0,
+            'delay_ms': self.delay() * 1000,
+        }
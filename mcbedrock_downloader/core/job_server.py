@@ -0,0 +1,138 @@
+"""
+HTTP API for the download job service
+"""
+import json
+import logging
+
+from aiohttp import web
+
+from .jobs import JobManager, FINISHED_STATES
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_TYPES = {'release': 0, 'beta': 1, 'preview': 2}
+
+
+class JobServer:
+    """Expose a JobManager over HTTP.
+
+    POST   /jobs              submit {"uuid" or "name", "revision", "output"}
+    GET    /jobs[?status=S]   list jobs
+    GET    /jobs/ID           job state
+    DELETE /jobs/ID           cancel
+    GET    /jobs/ID/events    NDJSON stream of job state until the job finishes
+    GET    /versions          catalog, filtered by ?type= and ?search=
+    POST   /catalog/refresh   reload the catalog
+    """
+
+    def __init__(self, manager: JobManager, host: str = '127.0.0.1', port: int = 8081):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/jobs', self.handle_submit)
+        app.router.add_get('/jobs', self.handle_list)
+        app.router.add_get('/jobs/{id}', self.handle_get)
+        app.router.add_delete('/jobs/{id}', self.handle_cancel)
+        app.router.add_get('/jobs/{id}/events', self.handle_events)
+        app.router.add_get('/versions', self.handle_versions)
+        app.router.add_post('/catalog/refresh', self.handle_refresh)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def _job(self, request: web.Request):
+        job = self.manager.get(request.match_info['id'])
+        if job is None:
+            raise web.HTTPNotFound(text='No such job')
+        return job
+
+    async def handle_submit(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='Expected a JSON body')
+        if not isinstance(body, dict) or not (body.get('uuid') or body.get('name')):
+            raise web.HTTPBadRequest(text='Either uuid or name is required')
+
+        try:
+            job = self.manager.submit(uuid=body.get('uuid'), name=body.get('name'),
+                                      revision=str(body.get('revision', '1')), output=body.get('output'))
+        except KeyError:
+            raise web.HTTPNotFound(text='Version not found')
+        return web.json_response(job.to_dict(), status=201)
+
+    async def handle_list(self, request: web.Request) -> web.Response:
+        jobs = self.manager.list(request.query.get('status'))
+        return web.json_response([job.to_dict() for job in jobs])
+
+    async def handle_get(self, request: web.Request) -> web.Response:
+        return web.json_response(self._job(request).to_dict())
+
+    async def handle_cancel(self, request: web.Request) -> web.Response:
+        job = self._job(request)
+        return web.json_response(self.manager.cancel(job.id).to_dict())
+
+    async def handle_events(self, request: web.Request) -> web.StreamResponse:
+        job = self._job(request)
+        queue = self.manager.subscribe(job.id)
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+
+        try:
+            event = job.to_dict()
+            while True:
+                await response.write(json.dumps(event).encode() + b'\n')
+                if event['status'] in FINISHED_STATES:
+                    break
+                event = await queue.get()
+                # Slow readers only get the latest progress, not every chunk
+                while not queue.empty() and event['status'] not in FINISHED_STATES:
+                    event = queue.get_nowait()
+        except ConnectionResetError:
+            return response
+        finally:
+            self.manager.unsubscribe(job.id, queue)
+
+        await response.write_eof()
+        return response
+
+    async def handle_versions(self, request: web.Request) -> web.Response:
+        version_list = self.manager.version_list
+        if 'search' in request.query:
+            versions = version_list.search_versions(request.query['search'])
+            if 'type' in request.query:
+                version_type = VERSION_TYPES.get(request.query['type'])
+                versions = [v for v in versions if v['version_type'] == version_type]
+        elif 'type' in request.query:
+            versions = version_list.get_versions_by_type(VERSION_TYPES.get(request.query['type']))
+        else:
+            versions = list(version_list.versions)
+        return web.json_response(versions)
+
+    async def handle_refresh(self, request: web.Request) -> web.Response:
+        try:
+            await self.manager.version_list.download_list()
+        except Exception as e:
+            raise web.HTTPBadGateway(text=f"Catalog unavailable: {e}")
+        return web.json_response({'versions': len(self.manager.version_list.versions)})
@@ -0,0 +1,256 @@
+"""
+Download job queue with a persistent journal
+"""
+import os
+import json
+import time
+import asyncio
+import secrets
+import logging
+from typing import Dict, List, Optional
+
+from .version_list import VersionList
+from ..utils.helpers import get_default_filename, sanitize_filename
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+
+    FIELDS = ('id', 'uuid', 'revision', 'name', 'output', 'status', 'downloaded', 'total',
+              'error', 'attempts', 'created', 'updated')
+
+    def __init__(self, id: str, uuid: str, revision: str = "1", name: Optional[str] = None,
+                 output: Optional[str] = None, status: str = QUEUED, downloaded: int = 0, total: int = 0,
+                 error: Optional[str] = None, attempts: int = 0, created: Optional[float] = None,
+                 updated: Optional[float] = None):
+        self.id = id
+        self.uuid = uuid
+        self.revision = revision
+        self.name = name
+        self.output = output
+        self.status = status
+        self.downloaded = downloaded
+        self.total = total
+        self.error = error
+        self.attempts = attempts
+        self.created = created or time.time()
+        self.updated = updated or self.created
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Job':
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+
+class JobJournal:
+    """Append-only JSONL log of job snapshots; the last line for an id wins."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def load(self) -> Dict[str, Job]:
+        jobs = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        job = Job.from_dict(json.loads(line))
+                    except (ValueError, TypeError, KeyError):
+                        # A torn final line from a crash mid-write
+                        continue
+                    jobs[job.id] = job
+        return jobs
+
+    def compact(self, jobs: Dict[str, Job]):
+        """Rewrite the journal with one line per job."""
+        self.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in jobs.values():
+                f.write(json.dumps(job.to_dict()) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def append(self, job: Job):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(job.to_dict()) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class JobManager:
+    """Runs download jobs with a shared VersionDownloader and catalog.
+
+    Jobs that were queued or running when the service stopped are queued
+    again on start; an interrupted download restarts from the beginning.
+    """
+
+    def __init__(self, downloader, version_list: VersionList, root: str, concurrency: int = 2,
+                 max_attempts: int = 3):
+        self.downloader = downloader
+        self.version_list = version_list
+        self.root = root
+        self.downloads_dir = os.path.join(root, 'downloads')
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.journal = JobJournal(os.path.join(root, 'journal.jsonl'))
+        self.jobs = {}
+        self.tasks = {}
+        self.queue = None
+        self.workers = []
+        self.subscribers = {}
+        self.stopping = False
+        os.makedirs(self.downloads_dir, exist_ok=True)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.jobs = self.journal.load()
+        for job in sorted(self.jobs.values(), key=lambda j: j.created):
+            if not job.finished:
+                if job.status == RUNNING:
+                    logger.info("Resuming interrupted job %s (%s)", job.id, job.name or job.uuid)
+                job.status = QUEUED
+                self.queue.put_nowait(job.id)
+        self.journal.compact(self.jobs)
+
+        self.workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def stop(self):
+        # Running jobs keep their journal state so they are resumed on the next start
+        self.stopping = True
+        for task in self.workers + list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.workers, *self.tasks.values(), return_exceptions=True)
+        self.workers = []
+        self.journal.close()
+
+    def _update(self, job: Job, **changes):
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated = time.time()
+        if 'status' in changes or 'error' in changes:
+            self.journal.append(job)
+        self._publish(job)
+
+    def _publish(self, job: Job):
+        event = job.to_dict()
+        for queue in self.subscribers.get(job.id, []):
+            queue.put_nowait(event)
+
+    def resolve_version(self, uuid: Optional[str] = None, name: Optional[str] = None) -> Optional[Dict]:
+        if uuid:
+            return self.version_list.get_version_by_uuid(uuid) or {'uuid': uuid, 'name': None}
+        if name:
+            return self.version_list.get_version_by_name(name)
+        return None
+
+    def submit(self, uuid: Optional[str] = None, name: Optional[str] = None, revision: str = "1",
+               output: Optional[str] = None) -> Job:
+        version = self.resolve_version(uuid, name)
+        if version is None:
+            raise KeyError(name or uuid)
+
+        if output:
+            filename = sanitize_filename(os.path.basename(output))
+        elif version['name']:
+            filename = get_default_filename(version['name'], version['type_name'])
+        else:
+            filename = f"{version['uuid']}.appx"
+
+        job = Job(secrets.token_hex(6), version['uuid'], revision,
+                  version['name'], os.path.join(self.downloads_dir, filename))
+        self.jobs[job.id] = job
+        self.journal.append(job)
+        self.queue.put_nowait(job.id)
+        return job
+
+    def list(self, status: Optional[str] = None) -> List[Job]:
+        jobs = sorted(self.jobs.values(), key=lambda j: j.created)
+        return [job for job in jobs if status is None or job.status == status]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.jobs[job_id]
+        if job.finished:
+            return job
+        task = self.tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        self._update(job, status=CANCELLED)
+        return job
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self.subscribers.pop(job_id, None)
+
+    async def _worker(self):
+        while True:
+            job = self.jobs.get(await self.queue.get())
+            if job is None or job.status != QUEUED:
+                continue
+
+            self.tasks[job.id] = asyncio.ensure_future(self._run(job))
+            try:
+                await asyncio.wait([self.tasks[job.id]])
+            finally:
+                self.tasks.pop(job.id, None)
+
+    async def _run(self, job: Job):
+        self._update(job, status=RUNNING, attempts=job.attempts + 1, error=None, downloaded=0, total=0)
+
+        def progress(downloaded: int, total: int):
+            job.downloaded = downloaded
+            job.total = total
+            self._publish(job)
+
+        try:
+            await self.downloader.download(job.uuid, job.revision, job.output, progress)
+        except asyncio.CancelledError:
+            if job.status != CANCELLED and not self.stopping:
+                self._update(job, status=CANCELLED)
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job.id, e)
+            if job.attempts < self.max_attempts:
+                self._update(job, status=QUEUED, error=str(e))
+                self.queue.put_nowait(job.id)
+            else:
+                self._update(job, status=FAILED, error=str(e))
+            return
+
+        self._update(job, status=DONE, downloaded=job.total or job.downloaded)
@@ -0,0 +1,169 @@
+"""
+Lock files for coordinating processes through a shared directory
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+from typing import Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid: int) -> bool:
+    if sys.platform == 'win32':
+        return _windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Exists but belongs to someone else, or cannot be checked on this platform
+        return True
+    return True
+
+
+def _windows_pid_alive(pid: int) -> bool:
+    # os.kill(pid, 0) would send CTRL_C_EVENT to the process group on Windows
+    import ctypes
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # Access denied means it exists but belongs to someone else
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class FileLock:
+    """Exclusive lock file, taken over once stale.
+
+    A lock is stale when its holder has not refreshed it for stale_after
+    seconds, or, for a holder on this host, as soon as its process is gone.
+    A stale lock is renamed aside rather than deleted, and only removed if
+    the file moved is still the one judged stale, so two processes breaking
+    the same lock cannot both end up holding it.
+    """
+
+    def __init__(self, path: str, stale_after: float = 600):
+        self.path = path
+        self.stale_after = stale_after
+        self.host = socket.gethostname()
+        self.owner = f"{self.host}:{os.getpid()}"
+        # Tells this lock apart from others taken by the same process
+        self.token = uuid.uuid4().hex
+
+    def acquire(self) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._break_stale():
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'owner': self.owner, 'token': self.token, 'acquired': time.time()}, f)
+            return True
+        return False
+
+    def holder(self) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _snapshot(self, path: Optional[str] = None) -> Optional[Tuple]:
+        """(file identity, mtime, contents) of a lock file, read through one descriptor."""
+        try:
+            with open(path or self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                return (stat.st_dev, stat.st_ino), stat.st_mtime, f.read()
+        except FileNotFoundError:
+            return None
+
+    def _stale(self, snapshot: Optional[Tuple]) -> bool:
+        if snapshot is None:
+            return True
+        _, mtime, data = snapshot
+        if time.time() - mtime >= self.stale_after:
+            return True
+        try:
+            holder = json.loads(data)
+        except ValueError:
+            # Just created and not written yet, or unreadable; rely on the age
+            return False
+        host, _, pid = str(holder.get('owner', '')).rpartition(':')
+        return host == self.host and pid.isdigit() and not _pid_alive(int(pid))
+
+    def is_stale(self) -> bool:
+        return self._stale(self._snapshot())
+
+    def _break_stale(self) -> bool:
+        """Move a stale lock out of the way; True if creating the lock is worth retrying."""
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return True
+        if not self._stale(snapshot):
+            return False
+
+        aside = f"{self.path}.{self.token}.stale"
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            # Broken or released by someone else meanwhile
+            return True
+        except OSError:
+            # Windows refuses to rename a file another process has open
+            return False
+        if self._snapshot(aside) != snapshot:
+            # Another process broke the stale lock and took it between our check and the rename
+            self._restore(aside)
+            return False
+        holder = self._holder_of(snapshot)
+        logger.info("Taking over stale lock %s (held by %s)", self.path, holder.get('owner'))
+        os.remove(aside)
+        return True
+
+    def _restore(self, aside: str):
+        try:
+            # link() fails instead of replacing a lock created in the meantime
+            os.link(aside, self.path)
+        except OSError as e:
+            logger.warning("Could not put back lock %s: %s", self.path, e)
+        finally:
+            os.remove(aside)
+
+    @staticmethod
+    def _holder_of(snapshot: Tuple) -> Dict:
+        try:
+            return json.loads(snapshot[2])
+        except ValueError:
+            return {}
+
+    def refresh(self):
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+
+    def release(self):
+        """Remove the lock file, unless it has been taken over since."""
+        if (self.holder() or {}).get('token') != self.token:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,248 @@
+"""
+Prometheus-style metrics for download, resolution and catalog activity
+"""
+import math
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + list(extra or ())
+    if not items:
+        return ''
+    body = ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in items)
+    return '{' + body + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def to_dict(self):
+        with self._lock:
+            if list(self._values) == [()]:
+                return self._values[()]
+            return {_format_labels(key) or '': value for key, value in sorted(self._values.items())}
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state['buckets']):
+                    samples.append((self.name + '_bucket', key + (('le', _format_value(bound)),), count))
+                samples.append((self.name + '_sum', key, state['sum']))
+                samples.append((self.name + '_count', key, state['count']))
+        return samples
+
+    def to_dict(self):
+        with self._lock:
+            summary = {}
+            for key, state in sorted(self._values.items()):
+                count = state['count']
+                summary[_format_labels(key) or ''] = {
+                    'count': count,
+                    'sum': state['sum'],
+                    'mean': state['sum'] / count if count else 0.0,
+                }
+            if list(summary) == ['']:
+                return summary['']
+            return summary
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float]) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> Dict:
+        return {name: metric.to_dict() for name, metric in list(self._metrics.items())}
+
+
+REGISTRY = Registry()
+
+BYTES_TRANSFERRED = REGISTRY.counter(
+    'mcbedrock_bytes_transferred_total', 'Bytes received from the network or reused locally, by source')
+DOWNLOADS = REGISTRY.counter(
+    'mcbedrock_downloads_total', 'Package downloads by result')
+DOWNLOAD_THROUGHPUT = REGISTRY.histogram(
+    'mcbedrock_download_throughput_bytes_per_second', 'Average throughput of completed downloads',
+    [256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2])
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    'mcbedrock_download_seconds', 'Wall time of package downloads',
+    [1, 5, 15, 30, 60, 120, 300, 600, 1800])
+RESOLUTION_SECONDS = REGISTRY.histogram(
+    'mcbedrock_resolution_seconds', 'SOAP download URL resolution latency',
+    [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10])
+RESOLUTIONS = REGISTRY.counter(
+    'mcbedrock_resolutions_total', 'Download URL resolutions by result')
+SOAP_ENVELOPES = REGISTRY.counter(
+    'mcbedrock_soap_envelopes_total', 'SOAP request envelopes built by method')
+SOAP_URLS = REGISTRY.counter(
+    'mcbedrock_soap_response_urls_total', 'File URLs extracted from SOAP responses')
+SOAP_PARSE_ERRORS = REGISTRY.counter(
+    'mcbedrock_soap_parse_errors_total', 'SOAP responses that could not be parsed')
+SOAP_HEDGES = REGISTRY.counter(
+    'mcbedrock_soap_hedges_total', 'Hedged SOAP requests by outcome (sent, won, lost, skipped)')
+RETRIES = REGISTRY.counter(
+    'mcbedrock_retries_total', 'Retried network operations by operation')
+SEGMENT_STEALS = REGISTRY.counter(
+    'mcbedrock_segment_steals_total', 'Segments split to hand their tail to an idle connection, by reason')
+CACHE_HITS = REGISTRY.counter(
+    'mcbedrock_cache_hits_total', 'Cache hits by cache')
+CACHE_MISSES = REGISTRY.counter(
+    'mcbedrock_cache_misses_total', 'Cache misses by cache')
+ACTIVE_CONNECTIONS = REGISTRY.gauge(
+    'mcbedrock_active_connections', 'Open download connections')
+QUEUE_DEPTH = REGISTRY.gauge(
+    'mcbedrock_queue_depth', 'Download segments waiting for a connection')
+CATALOG_LOAD_SECONDS = REGISTRY.histogram(
+    'mcbedrock_catalog_load_seconds', 'Version catalog load time',
+    [0.1, 0.25, 0.5, 1, 2, 5, 10, 30])
+CATALOG_VERSIONS = REGISTRY.gauge(
+    'mcbedrock_catalog_versions', 'Versions in the loaded catalog')
+CATALOG_LOADS = REGISTRY.counter(
+    'mcbedrock_catalog_loads_total', 'Version catalog loads by result')
+CATALOG_SOURCE_LOADS = REGISTRY.counter(
+    'mcbedrock_catalog_source_loads_total', 'Federated catalog source fetches by source and result')
+PREFETCHES = REGISTRY.counter(
+    'mcbedrock_prefetches_total', 'Background package prefetches by result')
+
+
+class MetricsServer:
+    """Serve a registry on /metrics (Prometheus text) and /metrics.json."""
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = '127.0.0.1', port: int = 9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(text=self.registry.render(), content_type='text/plain',
+                                charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+        async def metrics_json(request):
+            return web.json_response(self.registry.to_dict())
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        app.router.add_get('/metrics.json', metrics_json)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,275 @@
+"""
+Catalog mirroring with a shared manifest and lock directory
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .locks import FileLock
+from .sinks import CallbackSink
+from .transfer import CONTENT_RANGE_RE
+from .exceptions import DownloadFailedException
+from ..utils.helpers import get_default_filename
+
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def shard_of(update_identity: str, shards: int) -> int:
+    """Stable shard number for a version, the same on every host."""
+    return zlib.crc32(update_identity.encode('utf-8')) % shards
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Mirror:
+    """A mirror directory shared by any number of processes and hosts.
+
+    Layout under root:
+        packages/FILE.appx      mirrored packages, named after the version and its UUID
+        records/UUID.json       one manifest record per completed package
+        locks/UUID.lock         held while a worker fetches the package
+        manifest.json           all records, rebuilt after each run
+    """
+
+    def __init__(self, root: str, stale_after: float = 600):
+        self.root = root
+        self.stale_after = stale_after
+        self.packages_dir = os.path.join(root, 'packages')
+        self.records_dir = os.path.join(root, 'records')
+        self.locks_dir = os.path.join(root, 'locks')
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        for path in (self.packages_dir, self.records_dir, self.locks_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def record(self, update_identity: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.records_dir, update_identity + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_complete(self, update_identity: str, verify: bool = False) -> bool:
+        record = self.record(update_identity)
+        if record is None:
+            return False
+        path = os.path.join(self.packages_dir, record['file'])
+        try:
+            if os.path.getsize(path) != record['size']:
+                return False
+        except OSError:
+            return False
+        return not verify or file_sha256(path) == record['sha256']
+
+    def missing(self, versions: Sequence[Dict], verify: bool = False) -> List[Dict]:
+        """Versions without a complete package; with verify, records whose hash no longer matches are dropped."""
+        missing = []
+        for version in versions:
+            if self.is_complete(version['uuid']):
+                if not verify or self.is_complete(version['uuid'], verify=True):
+                    continue
+                logger.warning("Hash mismatch for %s, fetching again", version['name'])
+                self.remove_record(version['uuid'])
+            missing.append(version)
+        return missing
+
+    def remove_record(self, update_identity: str):
+        try:
+            os.remove(os.path.join(self.records_dir, update_identity + '.json'))
+        except FileNotFoundError:
+            pass
+
+    def lock(self, update_identity: str) -> FileLock:
+        return FileLock(os.path.join(self.locks_dir, update_identity + '.lock'), self.stale_after)
+
+    def write_record(self, version: Dict, filename: str, size: int, sha256: str):
+        record = {
+            'uuid': version['uuid'],
+            'name': version['name'],
+            'type_name': version['type_name'],
+            'file': filename,
+            'size': size,
+            'sha256': sha256,
+            'mirrored_at': time.time(),
+        }
+        path = os.path.join(self.records_dir, version['uuid'] + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.replace(path + '.tmp', path)
+
+    def write_manifest(self) -> Dict:
+        records = []
+        for name in sorted(os.listdir(self.records_dir)):
+            if name.endswith('.json'):
+                record = self.record(name[:-len('.json')])
+                if record:
+                    records.append(record)
+        manifest = {
+            'generated_at': time.time(),
+            'packages': len(records),
+            'bytes': sum(record['size'] for record in records),
+            'records': records,
+        }
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+        return manifest
+
+
+async def mirror_versions(mirror: Mirror, versions: Sequence[Dict], downloader_options: Dict,
+                          token: Optional[str] = None) -> Dict:
+    """Fetch every version in versions that is missing and not locked by another worker."""
+    from .downloader import VersionDownloader
+
+    stats = {'fetched': 0, 'skipped': 0, 'locked': 0, 'failed': 0, 'bytes': 0}
+    async with VersionDownloader(**downloader_options) as downloader:
+        if token:
+            downloader.enable_user_authorization(token)
+
+        for version in versions:
+            if mirror.is_complete(version['uuid']):
+                stats['skipped'] += 1
+                continue
+
+            lock = mirror.lock(version['uuid'])
+            if not lock.acquire():
+                stats['locked'] += 1
+                continue
+
+            try:
+                # Another worker may have finished it between the check and the lock
+                if mirror.is_complete(version['uuid']):
+                    stats['skipped'] += 1
+                    continue
+                size = await _fetch(mirror, downloader, version, lock)
+                stats['fetched'] += 1
+                stats['bytes'] += size
+            except Exception as e:
+                logger.warning("Mirroring %s failed: %s", version['name'], e)
+                stats['failed'] += 1
+            finally:
+                lock.release()
+
+    return stats
+
+
+def package_filename(version: Dict) -> str:
+    """File name for a mirrored package; versions can share a name, so it includes the UUID."""
+    stem, extension = os.path.splitext(get_default_filename(version['name'], version['type_name']))
+    return f"{stem}-{version['uuid']}{extension}"
+
+
+async def _fetch(mirror: Mirror, downloader, version: Dict, lock: FileLock) -> int:
+    filename = package_filename(version)
+    path = os.path.join(mirror.packages_dir, filename)
+    part_path = path + '.part'
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(mirror.stale_after / 4)
+            lock.refresh()
+
+    logger.info("Mirroring %s (%s)", version['name'], version['type_name'])
+    refresher = asyncio.ensure_future(heartbeat())
+    try:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        resumed = False
+        if offset:
+            url = await downloader.get_download_url(version['uuid'], "1")
+            resumed = bool(url) and await _resume(downloader.session, url, part_path, offset)
+        if not resumed:
+            # Written strictly in order, so an interrupted .part holds a prefix of the package to resume from
+            with open(part_path, 'wb') as f:
+                await downloader.download(version['uuid'], "1", CallbackSink(f.write))
+    finally:
+        refresher.cancel()
+
+    sha256 = await asyncio.get_event_loop().run_in_executor(None, file_sha256, part_path)
+    size = os.path.getsize(part_path)
+    os.replace(part_path, path)
+    mirror.write_record(version, filename, size, sha256)
+    return size
+
+
+async def _resume(session, url: str, part_path: str, offset: int) -> bool:
+    """Append the rest of url to part_path from offset; False if the server will not resume it."""
+    async with session.get(url, headers={'Range': f'bytes={offset}-'}) as response:
+        match = CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+        if response.status != 206 or not match or int(match.group(1)) != offset:
+            return False
+        logger.info("Resuming %s at %d bytes", os.path.basename(part_path), offset)
+        position = offset
+        with open(part_path, 'ab') as f:
+            async for chunk in response.content.iter_chunked(READ_SIZE):
+                f.write(chunk)
+                position += len(chunk)
+    if match.group(3) != '*' and position != int(match.group(3)):
+        raise DownloadFailedException(f"Resumed download ended at {position} of {match.group(3)} bytes")
+    return True
+
+
+def worker_main(root: str, versions: List[Dict], downloader_options: Dict, token: Optional[str],
+                stale_after: float, log_level: int = logging.WARNING) -> Dict:
+    """Entry point for mirror worker processes."""
+    logging.basicConfig(level=log_level, format='%(processName)s: %(message)s')
+    return asyncio.run(mirror_versions(Mirror(root, stale_after), versions, downloader_options, token))
+
+
+async def run_mirror(root: str, versions: Sequence[Dict], workers: int = 1, shard: Tuple[int, int] = (0, 1),
+                     downloader_options: Optional[Dict] = None, token: Optional[str] = None,
+                     verify: bool = False, stale_after: float = 600) -> Dict:
+    """Mirror the missing versions into root and return combined stats.
+
+    Only versions in shard (index, count) are considered, so hosts sharing the
+    directory can split the catalog. Each of the workers processes walks the
+    list from a different offset and skips versions another worker has locked,
+    which balances the load without coordination.
+    """
+    mirror = Mirror(root, stale_after)
+    downloader_options = downloader_options or {}
+    index, count = shard
+    versions = [v for v in versions if shard_of(v['uuid'], count) == index]
+    todo = mirror.missing(versions, verify)
+    logger.info("%d of %d versions need mirroring", len(todo), len(versions))
+
+    totals = {'versions': len(versions), 'fetched': 0, 'failed': 0, 'locked': 0, 'bytes': 0}
+    if todo:
+        if workers <= 1:
+            results = [await mirror_versions(mirror, todo, downloader_options, token)]
+        else:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            loop = asyncio.get_event_loop()
+            step = max(1, len(todo) // workers)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(pool, worker_main, root, todo[n * step:] + todo[:n * step],
+                                         downloader_options, token, stale_after,
+                                         logging.getLogger().getEffectiveLevel())
+                    for n in range(workers)))
+
+        for result in results:
+            for key in ('fetched', 'failed', 'locked', 'bytes'):
+                totals[key] += result[key]
+
+    # Anything still missing was locked by another host or failed
+    totals['missing'] = len(mirror.missing(todo))
+    manifest = mirror.write_manifest()
+    totals['packages'] = manifest['packages']
+    totals['manifest_bytes'] = manifest['bytes']
+    return totals
@@ -0,0 +1,143 @@
+"""
+Background prefetch of the newest builds into the artifact cache
+"""
+import time
+import asyncio
+import logging
+import datetime
+from typing import Dict, List, Optional, Sequence
+
+from . import metrics
+from .version_list import VersionList
+from .artifact_cache import ArtifactCache
+from ..utils.helpers import parse_version_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Shared bandwidth limit: consume(n) waits until n bytes fit in rate bytes/s."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, amount: int):
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens < 0:
+                # Holding the lock while in debt keeps every consumer under the shared rate
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class TimeWindow:
+    """Daily local-time window such as '01:00-06:00'; may wrap past midnight."""
+
+    def __init__(self, spec: str):
+        try:
+            start, end = spec.split('-')
+            self.start = datetime.time.fromisoformat(start.strip())
+            self.end = datetime.time.fromisoformat(end.strip())
+        except ValueError:
+            raise ValueError(f"Invalid time window {spec!r}, expected HH:MM-HH:MM")
+        self.spec = spec
+
+    def contains(self, moment: Optional[datetime.datetime] = None) -> bool:
+        now = (moment or datetime.datetime.now()).time()
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        return now >= self.start or now < self.end
+
+
+def newest_versions(versions: List[Dict], version_types: Sequence[int], count: int) -> List[Dict]:
+    """Newest count versions of each type, ordered by parsed version number."""
+    selected = []
+    for version_type in version_types:
+        candidates = [(index, v) for index, v in enumerate(versions) if v['version_type'] == version_type]
+        # Names that do not parse keep their catalog position, which is oldest first
+        candidates.sort(key=lambda item: (parse_version_string(item[1]['name']) or (0,), item[0]), reverse=True)
+        selected.extend(v for _, v in candidates[:count])
+    return selected
+
+
+class PrefetchPolicy:
+    """Periodically download the newest builds into an ArtifactCache.
+
+    Fetches run one at a time, only inside window (if given), only when no
+    client request has been seen for idle_after seconds and no client-driven
+    fetch is running, and under limiter (if given). A client asking for a
+    version that is being prefetched lifts the limit for that download.
+    """
+
+    def __init__(self, cache: ArtifactCache, version_list: VersionList, version_types: Sequence[int] = (0, 2),
+                 count: int = 1, window: Optional[TimeWindow] = None, limiter: Optional[TokenBucket] = None,
+                 interval: float = 900, idle_after: float = 60):
+        self.cache = cache
+        self.version_list = version_list
+        self.version_types = version_types
+        self.count = count
+        self.window = window
+        self.limiter = limiter
+        self.interval = interval
+        self.idle_after = idle_after
+        self.task = None
+
+    def allowed(self) -> bool:
+        if self.window is not None and not self.window.contains():
+            return False
+        if self.cache.busy():
+            return False
+        return time.monotonic() - self.cache.last_request >= self.idle_after
+
+    async def wait_allowed(self):
+        while not self.allowed():
+            await asyncio.sleep(min(30, self.interval))
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Prefetch cycle failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Prefetch whatever is missing now; returns the number of packages fetched."""
+        await self.wait_allowed()
+        await self.version_list.download_list()
+
+        fetched = 0
+        for version in newest_versions(self.version_list.versions, self.version_types, self.count):
+            if self.cache.lookup(version['uuid']):
+                continue
+            await self.wait_allowed()
+
+            logger.info("Prefetching %s (%s)", version['name'], version['type_name'])
+            try:
+                await self.cache.ensure(version['uuid'], limiter=self.limiter)
+            except Exception as e:
+                metrics.PREFETCHES.inc(result='error')
+                logger.warning("Prefetch of %s failed: %s", version['name'], e)
+                continue
+            metrics.PREFETCHES.inc(result='ok')
+            fetched += 1
+        return fetched
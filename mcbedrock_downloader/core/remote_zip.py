@@ -0,0 +1,281 @@
+"""
+Zip central directory parsing and remote member access over HTTP range requests
+"""
+import zlib
+import struct
+import aiohttp
+from urllib.parse import unquote
+from typing import List, Optional, AsyncIterator
+
+from . import metrics
+from .transfer import probe
+from .exceptions import RemoteArchiveException
+
+
+EOCD_SIGNATURE = b'PK\x05\x06'
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+LOCAL_SIGNATURE = b'PK\x03\x04'
+
+EOCD_STRUCT = struct.Struct('<4s4H2LH')
+ZIP64_LOCATOR_STRUCT = struct.Struct('<4sLQL')
+ZIP64_EOCD_STRUCT = struct.Struct('<4sQ2H2L4Q')
+CENTRAL_STRUCT = struct.Struct('<4s6H3L5H2L')
+LOCAL_STRUCT = struct.Struct('<4s5H3L2H')
+
+STORED = 0
+DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x08
+
+MAX_EOCD_SEARCH = EOCD_STRUCT.size + 0xFFFF + ZIP64_LOCATOR_STRUCT.size
+
+
+class ZipEntry:
+
+    def __init__(self, name: str, flags: int, compress_type: int, crc32: int,
+                 compress_size: int, file_size: int, header_offset: int):
+        self.name = name
+        self.flags = flags
+        self.compress_type = compress_type
+        self.crc32 = crc32
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+        # Offset of the next local header (or the central directory) once known
+        self.region_end = None
+
+    @property
+    def display_name(self) -> str:
+        return unquote(self.name)
+
+    @property
+    def has_data_descriptor(self) -> bool:
+        return bool(self.flags & FLAG_DATA_DESCRIPTOR)
+
+    def key(self):
+        return (self.name, self.crc32, self.compress_size, self.file_size, self.compress_type)
+
+    def __repr__(self):
+        return f"ZipEntry({self.name!r}, size={self.file_size}, offset={self.header_offset})"
+
+
+class ZipDirectory:
+
+    def __init__(self, entries: List[ZipEntry], cd_offset: int, cd_size: int, archive_size: int):
+        self.entries = entries
+        self.cd_offset = cd_offset
+        self.cd_size = cd_size
+        self.archive_size = archive_size
+
+        ordered = sorted(entries, key=lambda e: e.header_offset)
+        for entry, following in zip(ordered, ordered[1:] + [None]):
+            entry.region_end = following.header_offset if following else cd_offset
+
+    def find(self, name: str) -> Optional[ZipEntry]:
+        for entry in self.entries:
+            if entry.name == name or entry.display_name == name:
+                return entry
+        return None
+
+    def in_file_order(self) -> List[ZipEntry]:
+        return sorted(self.entries, key=lambda e: e.header_offset)
+
+
+def find_eocd(tail: bytes, tail_offset: int):
+    """Locate the central directory from the archive tail.
+
+    Returns (cd_offset, cd_size, zip64_eocd_offset). When the archive is
+    ZIP64 and the ZIP64 record is not inside tail, cd_offset and cd_size
+    are None and the caller must read the record at zip64_eocd_offset.
+    """
+    position = tail.rfind(EOCD_SIGNATURE)
+    if position < 0:
+        raise RemoteArchiveException("End of central directory record not found")
+
+    (_, _, _, _, _, cd_size, cd_offset, _) = EOCD_STRUCT.unpack_from(tail, position)
+
+    locator = position - ZIP64_LOCATOR_STRUCT.size
+    if locator >= 0 and tail[locator:locator + 4] == ZIP64_LOCATOR_SIGNATURE:
+        _, _, zip64_offset, _ = ZIP64_LOCATOR_STRUCT.unpack_from(tail, locator)
+        relative = zip64_offset - tail_offset
+        if 0 <= relative <= len(tail) - ZIP64_EOCD_STRUCT.size:
+            cd_size, cd_offset = parse_zip64_eocd(tail[relative:relative + ZIP64_EOCD_STRUCT.size])
+            return cd_offset, cd_size, zip64_offset
+        return None, None, zip64_offset
+
+    return cd_offset, cd_size, None
+
+
+def parse_zip64_eocd(record: bytes):
+    fields = ZIP64_EOCD_STRUCT.unpack_from(record)
+    if fields[0] != ZIP64_EOCD_SIGNATURE:
+        raise RemoteArchiveException("Invalid ZIP64 end of central directory record")
+    return fields[8], fields[9]
+
+
+def parse_central_directory(data: bytes, archive_size: int, cd_offset: int) -> ZipDirectory:
+    entries = []
+    position = 0
+
+    while position + CENTRAL_STRUCT.size <= len(data):
+        fields = CENTRAL_STRUCT.unpack_from(data, position)
+        if fields[0] != CENTRAL_SIGNATURE:
+            break
+
+        (_, _, _, flags, method, _, _, crc, csize, usize,
+         name_len, extra_len, comment_len, _, _, _, offset) = fields
+
+        start = position + CENTRAL_STRUCT.size
+        raw_name = data[start:start + name_len]
+        extra = data[start + name_len:start + name_len + extra_len]
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+
+        usize, csize, offset = _apply_zip64_extra(extra, usize, csize, offset)
+        entries.append(ZipEntry(name, flags, method, crc, csize, usize, offset))
+        position = start + name_len + extra_len + comment_len
+
+    return ZipDirectory(entries, cd_offset, len(data), archive_size)
+
+
+def _apply_zip64_extra(extra: bytes, usize: int, csize: int, offset: int):
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack_from('<HH', extra, position)
+        if header_id == 0x0001:
+            values = extra[position + 4:position + 4 + size]
+            cursor = 0
+            if usize == 0xFFFFFFFF:
+                usize, = struct.unpack_from('<Q', values, cursor)
+                cursor += 8
+            if csize == 0xFFFFFFFF:
+                csize, = struct.unpack_from('<Q', values, cursor)
+                cursor += 8
+            if offset == 0xFFFFFFFF:
+                offset, = struct.unpack_from('<Q', values, cursor)
+            break
+        position += 4 + size
+    return usize, csize, offset
+
+
+def read_directory(f, archive_size: int) -> ZipDirectory:
+    """Parse the central directory of a local seekable archive."""
+    tail_size = min(archive_size, MAX_EOCD_SEARCH)
+    f.seek(archive_size - tail_size)
+    tail = f.read(tail_size)
+
+    cd_offset, cd_size, zip64_offset = find_eocd(tail, archive_size - tail_size)
+    if cd_offset is None:
+        f.seek(zip64_offset)
+        cd_size, cd_offset = parse_zip64_eocd(f.read(ZIP64_EOCD_STRUCT.size))
+
+    f.seek(cd_offset)
+    return parse_central_directory(f.read(cd_size), archive_size, cd_offset)
+
+
+def local_header_length(header: bytes) -> int:
+    fields = LOCAL_STRUCT.unpack_from(header)
+    if fields[0] != LOCAL_SIGNATURE:
+        raise RemoteArchiveException("Invalid local file header")
+    return LOCAL_STRUCT.size + fields[9] + fields[10]
+
+
+class RemoteZip:
+    """Read-only view of a zip archive served over HTTP with range support."""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, size: Optional[int] = None):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.directory = None
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    async def fetch(self, start: int, end: int) -> bytes:
+        """Fetch bytes [start, end) from the archive."""
+        if end <= start:
+            return b''
+
+        headers = {'Range': f'bytes={start}-{end - 1}'}
+        async with self.session.get(self.url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RemoteArchiveException("Server does not support range requests")
+            data = await response.read()
+
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        metrics.BYTES_TRANSFERRED.inc(len(data), source='cdn')
+        return data
+
+    async def iter_range(self, start: int, end: int, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        if end <= start:
+            return
+
+        headers = {'Range': f'bytes={start}-{end - 1}'}
+        async with self.session.get(self.url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RemoteArchiveException("Server does not support range requests")
+            self.requests += 1
+            async for chunk in response.content.iter_chunked(chunk_size):
+                self.bytes_fetched += len(chunk)
+                metrics.BYTES_TRANSFERRED.inc(len(chunk), source='cdn')
+                yield chunk
+
+    async def open(self) -> ZipDirectory:
+        if self.size is None:
+            self.size, ranged = await probe(self.session, self.url)
+            if not ranged:
+                raise RemoteArchiveException("Server does not support range requests")
+
+        tail_offset = max(0, self.size - MAX_EOCD_SEARCH)
+        tail = await self.fetch(tail_offset, self.size)
+
+        cd_offset, cd_size, zip64_offset = find_eocd(tail, tail_offset)
+        if cd_offset is None:
+            record = await self.fetch(zip64_offset, zip64_offset + ZIP64_EOCD_STRUCT.size)
+            cd_size, cd_offset = parse_zip64_eocd(record)
+
+        if cd_offset >= tail_offset:
+            relative = cd_offset - tail_offset
+            data = tail[relative:relative + cd_size]
+        else:
+            data = await self.fetch(cd_offset, cd_offset + cd_size)
+
+        self.directory = parse_central_directory(data, self.size, cd_offset)
+        return self.directory
+
+    async def data_offset(self, entry: ZipEntry) -> int:
+        header = await self.fetch(entry.header_offset, entry.header_offset + LOCAL_STRUCT.size)
+        return entry.header_offset + local_header_length(header)
+
+    async def iter_member(self, entry: ZipEntry) -> AsyncIterator[bytes]:
+        """Yield the decompressed contents of entry, verifying its CRC32."""
+        if entry.compress_type not in (STORED, DEFLATED):
+            raise RemoteArchiveException(f"Unsupported compression method {entry.compress_type} for {entry.name}")
+
+        start = await self.data_offset(entry)
+        decompressor = zlib.decompressobj(-15) if entry.compress_type == DEFLATED else None
+        crc = 0
+        size = 0
+
+        async for chunk in self.iter_range(start, start + entry.compress_size):
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+
+        if decompressor:
+            chunk = decompressor.flush()
+            if chunk:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                yield chunk
+
+        if size != entry.file_size or crc != entry.crc32:
+            raise RemoteArchiveException(f"Checksum mismatch for {entry.name}")
+
+    async def read_member(self, entry: ZipEntry) -> bytes:
+        return b''.join([chunk async for chunk in self.iter_member(entry)])
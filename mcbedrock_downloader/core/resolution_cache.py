@@ -0,0 +1,107 @@
+"""
+Append-only cache of resolved download URLs and package sizes
+"""
+import os
+import json
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# Package metadata from the resolution cache that listings can show next to each version
+METADATA_FIELDS = ('size', 'etag', 'last_modified')
+
+
+def default_resolution_cache_path(catalog_cache_path: str) -> str:
+    """Resolution cache kept in the same directory as the catalog cache."""
+    return os.path.join(os.path.dirname(catalog_cache_path), 'resolutions.jsonl')
+
+
+class ResolutionCache:
+    """Resolved URLs by update identity, one JSON record per line.
+
+    put() appends and flushes a line at once, so results survive an
+    interrupted bulk run; the last record for an update identity wins.
+    compact() rewrites the file with only the current records.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        self._file = None
+        self._lines = 0
+        self._torn = False
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    # Unreadable lines count too, so compact() drops them
+                    self._lines += 1
+                    self._torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                        self.records[(record['uuid'], record.get('revision', '1'))] = record
+                    except (ValueError, KeyError, TypeError):
+                        # A line cut short by an interrupted run
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.records.values())
+
+    def get(self, update_identity: str, revision: str = "1", max_age: Optional[float] = None) -> Optional[Dict]:
+        record = self.records.get((update_identity, revision))
+        if record is None:
+            return None
+        if max_age is not None and time.time() - record.get('resolved_at', 0) > max_age:
+            return None
+        return record
+
+    def metadata(self, versions: Iterable[Dict]) -> List[Dict]:
+        """Copies of versions with the cached METADATA_FIELDS added (None where unknown)."""
+        enriched = []
+        for version in versions:
+            record = self.records.get((version['uuid'], '1')) or {}
+            enriched.append(dict(version, **{field: record.get(field) for field in METADATA_FIELDS}))
+        return enriched
+
+    def put(self, record: Dict):
+        record = dict(record, revision=record.get('revision', '1'))
+        record.setdefault('resolved_at', time.time())
+        self.records[(record['uuid'], record['revision'])] = record
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if self._torn:
+                # End the cut-short line rather than appending to it
+                self._file.write('\n')
+                self._torn = False
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._lines += 1
+
+    def compact(self):
+        """Drop superseded records once they make up most of the file."""
+        if self._lines <= 2 * len(self.records):
+            return
+        self.close()
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        self._lines = len(self.records)
+        self._torn = False
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.compact()
+        self.close()
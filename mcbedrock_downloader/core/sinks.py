@@ -0,0 +1,136 @@
+"""
+Destinations for downloaded bytes: files, pipes, memory and callables
+"""
+import io
+import sys
+import asyncio
+import inspect
+from typing import BinaryIO, Callable, Union
+
+
+class Sink:
+    """Where a download writes its bytes.
+
+    Seekable sinks accept writes at any offset, so every connection of a
+    segmented transfer writes straight through. The others get the package
+    in order through write(), and a download waits for each write to finish,
+    so a slow consumer slows the network reads instead of filling memory.
+    """
+
+    seekable = False
+
+    async def write(self, data: bytes):
+        raise NotImplementedError
+
+    async def write_at(self, offset: int, data: bytes):
+        raise NotImplementedError
+
+    def truncate(self, size: int):
+        """Preallocate size bytes, where the sink supports it."""
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """Called instead of close() when the download fails."""
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FileSink(Sink):
+    """A file path, or an open seekable binary file such as a ChunkStore writer."""
+
+    seekable = True
+
+    def __init__(self, target: Union[str, BinaryIO]):
+        self.file = open(target, 'wb') if isinstance(target, str) else target
+
+    async def write(self, data: bytes):
+        self.file.write(data)
+
+    async def write_at(self, offset: int, data: bytes):
+        self.file.seek(offset)
+        self.file.write(data)
+
+    def truncate(self, size: int):
+        self.file.truncate(size)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        # A ChunkStore writer would otherwise index the incomplete package on close
+        if hasattr(self.file, 'discard'):
+            self.file.discard()
+        else:
+            self.file.close()
+
+
+class BufferSink(Sink):
+    """Keeps the package in memory; getvalue() returns it after the download."""
+
+    seekable = True
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    async def write(self, data: bytes):
+        self.buffer.write(data)
+
+    async def write_at(self, offset: int, data: bytes):
+        self.buffer.seek(offset)
+        self.buffer.write(data)
+
+    def getvalue(self) -> bytes:
+        return self.buffer.getvalue()
+
+
+class StreamSink(Sink):
+    """A pipe or other unseekable stream, e.g. sys.stdout.buffer.
+
+    Writes run in a thread so a blocked pipe stalls this download but not
+    the event loop.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+
+    async def write(self, data: bytes):
+        await asyncio.get_event_loop().run_in_executor(None, self.stream.write, data)
+
+    def close(self):
+        try:
+            self.stream.flush()
+        except BrokenPipeError:
+            pass
+
+
+class CallbackSink(Sink):
+    """Hands each chunk, in order, to callback(data); an async callback is awaited."""
+
+    def __init__(self, callback: Callable):
+        self.callback = callback
+
+    async def write(self, data: bytes):
+        result = self.callback(data)
+        if inspect.isawaitable(result):
+            await result
+
+
+def open_sink(destination: Union[str, Sink, Callable]) -> Sink:
+    """Sink for a download destination: a Sink, '-' for stdout, a callable or a file path."""
+    if isinstance(destination, Sink):
+        return destination
+    if destination == '-':
+        return StreamSink(sys.stdout.buffer)
+    if callable(destination):
+        return CallbackSink(destination)
+    return FileSink(destination)
@@ -0,0 +1,236 @@
+"""
+Single-pass extraction of a package from the download byte stream
+"""
+import os
+import zlib
+import struct
+import logging
+from typing import Optional, List
+
+from .remote_zip import (ZipDirectory, ZipEntry, parse_central_directory, LOCAL_STRUCT, LOCAL_SIGNATURE,
+                         CENTRAL_SIGNATURE, STORED, DEFLATED)
+from .exceptions import DownloadFailedException
+
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+HEADER, DATA, DESCRIPTOR, TRAILER = range(4)
+
+
+def safe_member_path(root: str, name: str) -> str:
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if any(part == '..' for part in parts) or (parts and ':' in parts[0]):
+        raise DownloadFailedException(f"Refusing to extract unsafe member path: {name}")
+    return os.path.join(root, *parts)
+
+
+class StreamExtractor:
+    """Unpack local file entries into a directory as the package bytes arrive.
+
+    Bytes must be fed in file order. Each member's CRC32 is checked as soon
+    as it is complete, against the local header or its data descriptor. The
+    central directory at the end of the stream (or one supplied up front, for
+    example from RemoteZip) is then used to cross-check every member, and is
+    required to find the end of stored members written with data descriptors.
+    """
+
+    def __init__(self, target_dir: str, directory: Optional[ZipDirectory] = None):
+        self.target_dir = target_dir
+        self.directory = directory
+        self.state = HEADER
+        self.buffer = bytearray()
+        self.position = 0
+        self.extracted = []
+        self.trailer = bytearray()
+        self.trailer_offset = None
+
+        self._entry = None
+        self._file = None
+        self._decompressor = None
+        self._remaining = None
+        self._crc = 0
+        self._size = 0
+        self._zip64 = False
+
+        os.makedirs(target_dir, exist_ok=True)
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        while self._step():
+            pass
+
+    def _consume(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.position += len(data)
+        return data
+
+    def _step(self) -> bool:
+        if self.state == HEADER:
+            return self._read_header()
+        if self.state == DATA:
+            return self._read_data()
+        if self.state == DESCRIPTOR:
+            return self._read_descriptor()
+
+        self.trailer += self.buffer
+        self.position += len(self.buffer)
+        del self.buffer[:]
+        return False
+
+    def _read_header(self) -> bool:
+        if len(self.buffer) < 4:
+            return False
+
+        signature = bytes(self.buffer[:4])
+        if signature != LOCAL_SIGNATURE:
+            if signature == CENTRAL_SIGNATURE or signature[:2] == b'PK':
+                self.state = TRAILER
+                self.trailer_offset = self.position
+                return True
+            raise DownloadFailedException(f"Unexpected data at offset {self.position}")
+
+        if len(self.buffer) < LOCAL_STRUCT.size:
+            return False
+        fields = LOCAL_STRUCT.unpack_from(self.buffer)
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = fields
+        header_size = LOCAL_STRUCT.size + name_len + extra_len
+        if len(self.buffer) < header_size:
+            return False
+
+        offset = self.position
+        header = self._consume(header_size)
+        raw_name = header[LOCAL_STRUCT.size:LOCAL_STRUCT.size + name_len]
+        extra = header[LOCAL_STRUCT.size + name_len:]
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+
+        self._zip64 = False
+        position = 0
+        while position + 4 <= len(extra):
+            header_id, size = struct.unpack_from('<HH', extra, position)
+            if header_id == 0x0001 and size >= 16:
+                usize, csize = struct.unpack_from('<QQ', extra, position + 4)
+                self._zip64 = True
+            position += 4 + size
+
+        entry = ZipEntry(name, flags, method, crc, csize, usize, offset)
+        known = None
+        if entry.has_data_descriptor and self.directory is not None:
+            known = self.directory.find(name)
+            if known is not None:
+                entry.compress_size = known.compress_size
+
+        if method not in (STORED, DEFLATED):
+            raise DownloadFailedException(f"Unsupported compression method {method} for {name}")
+
+        self._entry = entry
+        self._crc = 0
+        self._size = 0
+        self._decompressor = zlib.decompressobj(-15) if method == DEFLATED else None
+
+        if not entry.has_data_descriptor or known is not None:
+            self._remaining = entry.compress_size
+        elif method == DEFLATED:
+            self._remaining = None
+        else:
+            raise DownloadFailedException(
+                f"Stored member {name} uses a data descriptor; the central directory is required to extract it")
+
+        path = safe_member_path(self.target_dir, entry.display_name)
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            self._file = None
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, 'wb')
+
+        self.state = DATA
+        return True
+
+    def _emit(self, data: bytes):
+        if data:
+            self._crc = zlib.crc32(data, self._crc)
+            self._size += len(data)
+            if self._file:
+                self._file.write(data)
+
+    def _read_data(self) -> bool:
+        if not self.buffer and self._remaining != 0:
+            return False
+
+        if self._remaining is not None:
+            data = self._consume(min(self._remaining, len(self.buffer)))
+            self._remaining -= len(data)
+            self._emit(self._decompressor.decompress(data) if self._decompressor else data)
+            if self._remaining > 0:
+                return False
+            if self._decompressor:
+                self._emit(self._decompressor.flush())
+        else:
+            data = self._consume(len(self.buffer))
+            self._emit(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                return False
+            unused = self._decompressor.unused_data
+            self.buffer[:0] = unused
+            self.position -= len(unused)
+
+        if self._entry.has_data_descriptor:
+            self.state = DESCRIPTOR
+        else:
+            self._finish_entry(self._entry.crc32, self._entry.file_size)
+        return True
+
+    def _read_descriptor(self) -> bool:
+        field_size = 8 if self._zip64 else 4
+        needed = 4 + 4 + 2 * field_size
+        if len(self.buffer) < needed:
+            return False
+
+        skip = 4 if bytes(self.buffer[:4]) == DESCRIPTOR_SIGNATURE else 0
+        fmt = '<LQQ' if self._zip64 else '<LLL'
+        crc, _, usize = struct.unpack_from(fmt, self.buffer, skip)
+        self._consume(skip + 4 + 2 * field_size)
+        self._finish_entry(crc, usize)
+        return True
+
+    def _finish_entry(self, crc: int, size: int):
+        entry = self._entry
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        if self._crc != crc or self._size != size:
+            raise DownloadFailedException(f"Checksum mismatch while extracting {entry.name}")
+
+        entry.crc32 = self._crc
+        entry.file_size = self._size
+        self.extracted.append(entry)
+        self._entry = None
+        self.state = HEADER
+
+    def finish(self) -> List[ZipEntry]:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        if self.state not in (HEADER, TRAILER) or self.buffer:
+            raise DownloadFailedException("Package stream ended in the middle of a member")
+
+        directory = self.directory
+        if directory is None and self.trailer:
+            directory = parse_central_directory(bytes(self.trailer), self.position, self.trailer_offset)
+
+        if directory is not None:
+            expected = {entry.name: entry for entry in directory.entries}
+            for entry in self.extracted:
+                known = expected.pop(entry.name, None)
+                if known is None or known.crc32 != entry.crc32 or known.file_size != entry.file_size:
+                    raise DownloadFailedException(f"{entry.name} does not match the central directory")
+            if expected:
+                raise DownloadFailedException(f"{len(expected)} members missing from the package stream")
+
+        logger.info("extract: %d members extracted to %s", len(self.extracted), self.target_dir)
+        return self.extracted
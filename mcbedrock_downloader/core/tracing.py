@@ -0,0 +1,156 @@
+"""
+Structured tracing of download phases
+"""
+import time
+import logging
+import contextlib
+import contextvars
+from typing import Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('mcbedrock_current_span', default=None)
+
+
+class Span:
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'parent': self.parent.name if self.parent else None,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': dict(self.attributes),
+        }
+
+
+class TraceListener:
+    """Receives spans and events from a Tracer. Override the hooks you need."""
+
+    def on_span_start(self, span: Span):
+        pass
+
+    def on_span_end(self, span: Span):
+        pass
+
+    def on_event(self, name: str, fields: Dict):
+        pass
+
+
+class LoggingListener(TraceListener):
+    """Emit finished spans as DEBUG log records with the span in record.span."""
+
+    def __init__(self, log: logging.Logger = logger):
+        self.log = log
+
+    def on_span_end(self, span: Span):
+        self.log.debug("span %s took %.3fs", span.name, span.duration, extra={'span': span.to_dict()})
+
+    def on_event(self, name: str, fields: Dict):
+        self.log.debug("event %s %s", name, fields, extra={'event': name, 'fields': fields})
+
+
+class PhaseTimer(TraceListener):
+    """Aggregate span durations by name for a per-phase breakdown."""
+
+    def __init__(self):
+        self.phases = {}
+        self.order = []
+
+    def on_span_end(self, span: Span):
+        if span.name not in self.phases:
+            self.phases[span.name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            self.order.append(span.name)
+        phase = self.phases[span.name]
+        phase['count'] += 1
+        phase['total'] += span.duration
+        phase['max'] = max(phase['max'], span.duration)
+
+    def report(self) -> str:
+        lines = [f"{'Phase':<22} {'Count':>6} {'Total':>10} {'Mean':>10} {'Max':>10}", "-" * 62]
+        for name in self.order:
+            phase = self.phases[name]
+            lines.append(f"{name:<22} {phase['count']:>6} {phase['total']:>9.3f}s "
+                         f"{phase['total'] / phase['count']:>9.3f}s {phase['max']:>9.3f}s")
+        return '\n'.join(lines)
+
+
+class Tracer:
+
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, listener: TraceListener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: TraceListener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, _current_span.get(), **attributes)
+        token = _current_span.set(span)
+        for listener in self.listeners:
+            listener.on_span_start(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            for listener in self.listeners:
+                listener.on_span_end(span)
+
+    def record(self, name: str, start: float, end: float, **attributes) -> Span:
+        """Report a span measured elsewhere with time.perf_counter() timestamps."""
+        span = Span(name, _current_span.get(), **attributes)
+        span.start = start
+        span.end = end
+        for listener in self.listeners:
+            listener.on_span_start(span)
+            listener.on_span_end(span)
+        return span
+
+    def event(self, name: str, **fields):
+        for listener in self.listeners:
+            listener.on_event(name, fields)
+
+    def aiohttp_trace_config(self):
+        """Build an aiohttp TraceConfig reporting connection setup as 'connect' spans."""
+        import aiohttp
+
+        async def on_create_start(session, context, params):
+            context.connect_started = time.perf_counter()
+
+        async def on_create_end(session, context, params):
+            started = getattr(context, 'connect_started', None)
+            if started is not None:
+                self.record('connect', started, time.perf_counter())
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        return trace_config
+
+
+tracer = Tracer()
+tracer.add_listener(LoggingListener())
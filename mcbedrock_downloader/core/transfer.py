@@ -0,0 +1,369 @@
+"""
+Multi-connection ranged transfer engine
+"""
+import re
+import time
+import bisect
+import statistics
+import asyncio
+import logging
+import aiohttp
+from collections import deque
+from typing import Dict, Optional, Callable, BinaryIO, Union
+
+from . import metrics
+from .adaptive import AdaptiveController
+from .sinks import FileSink, Sink
+from .exceptions import DownloadFailedException
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class Segment:
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.position = start
+        # Progress of the request currently reading this segment, if any
+        self.fetch_started = None
+        self.fetch_bytes = 0
+        self.progress_at = None
+        # Set while the output holds this segment back; it is not stalled then
+        self.waiting = False
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.end - self.position)
+
+    def rate(self, now: float) -> float:
+        if self.fetch_started is None or now <= self.fetch_started:
+            return 0.0
+        return self.fetch_bytes / (now - self.fetch_started)
+
+    def __repr__(self):
+        return f"Segment({self.start}-{self.end} @ {self.position})"
+
+
+async def probe(session: aiohttp.ClientSession, url: str):
+    """Return (total_size, supports_ranges) for url using a one byte ranged GET."""
+    async with session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+        response.raise_for_status()
+        if response.status == 206:
+            match = CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+            if match and match.group(3) != '*':
+                return int(match.group(3)), True
+        return int(response.headers.get('content-length', 0)), False
+
+
+async def probe_metadata(session: aiohttp.ClientSession, url: str) -> Dict:
+    """Size, ETag and Last-Modified of url from a HEAD request, or a ranged GET if HEAD tells nothing."""
+    async with session.head(url, allow_redirects=True) as response:
+        if response.status < 400 and 'content-length' in response.headers:
+            return {
+                'size': int(response.headers['content-length']),
+                'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+            }
+
+    async with session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+        response.raise_for_status()
+        size = int(response.headers.get('content-length', 0)) or None
+        if response.status == 206:
+            match = CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+            size = int(match.group(3)) if match and match.group(3) != '*' else None
+        return {
+            'size': size,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+        }
+
+
+class SegmentedTransfer:
+    """Download url into output over several ranged requests.
+
+    Connections claim fresh segments from the front of the file. Once none are
+    left, an idle connection steals the tail of the segment expected to finish
+    last, split so that both halves finish together at their measured rates;
+    a segment without progress for stall_timeout is taken over entirely.
+    Bytes a slow request still delivers past its shortened end are discarded.
+
+    An output that must be written in order gets bytes from ahead of the
+    first unfinished segment held back, up to max_buffer; beyond that those
+    connections stop reading until the output catches up.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, total_size: int, output: Union[BinaryIO, Sink],
+                 controller: AdaptiveController, progress_callback: Optional[Callable] = None,
+                 max_retries: int = 3, limiter=None, stall_timeout: float = 10.0, min_steal_age: float = 1.0,
+                 max_buffer: int = 32 * 1024 * 1024):
+        self.session = session
+        self.url = url
+        self.total_size = total_size
+        self.output = output if isinstance(output, Sink) else FileSink(output)
+        self.controller = controller
+        self.progress_callback = progress_callback
+        self.max_retries = max_retries
+        # Optional rate limiter with an async consume(n); may be swapped out mid-transfer
+        self.limiter = limiter
+        self.stall_timeout = stall_timeout
+        # Segments are only split after their rate has been measured this long
+        self.min_steal_age = min_steal_age
+
+        self.next_offset = 0
+        self.downloaded = 0
+        self.segments = []
+        self.active = {}
+        self.first_byte_at = None
+        self.steals = 0
+        self.discarded = 0
+        self.rates = deque(maxlen=32)
+        self.max_buffer = max_buffer
+        # In-order output: bytes written so far and chunks held back by offset
+        self.flushed = 0
+        self.held = {}
+        self.held_bytes = 0
+        self.peak_held = 0
+        self._flushed_changed = asyncio.Event()
+
+    def _claim(self) -> Optional[Segment]:
+        if self.next_offset >= self.total_size:
+            return None
+
+        start = self.next_offset
+        end = min(self.total_size, start + self.controller.segment_size)
+        if self.total_size - end < self.controller.min_segment_size // 2:
+            end = self.total_size
+
+        self.next_offset = end
+        segment = Segment(start, end)
+        self.segments.append(segment)
+        return segment
+
+    def _median_rate(self, now: float) -> float:
+        rates = list(self.rates)
+        rates.extend(segment.rate(now) for segment in self.segments
+                     if segment.remaining > 0 and segment.fetch_started is not None and segment.fetch_bytes
+                     and now - segment.fetch_started >= self.min_steal_age)
+        return statistics.median(rates) if rates else 0.0
+
+    def _buffer_full(self) -> bool:
+        return not self.output.seekable and self.held_bytes >= self.max_buffer
+
+    def _straggler(self, now: float):
+        """The fetching segment expected to finish last, with the offset to split it at."""
+        buffer_full = self._buffer_full()
+        median = self._median_rate(now)
+        min_steal = self.controller.min_segment_size // 2
+        best = None
+        for segment in self.segments:
+            if segment.remaining == 0 or segment.fetch_started is None or segment.waiting:
+                continue
+            if buffer_full and segment.position != self.flushed:
+                # The output is the bottleneck; only the segment holding up the flush is worth replacing
+                continue
+            if now - segment.progress_at > self.stall_timeout:
+                # Taken over whole, however little is left
+                split = segment.position
+                finish = float('inf')
+            elif buffer_full or now - segment.fetch_started < self.min_steal_age:
+                continue
+            else:
+                rate = segment.rate(now)
+                if rate <= 0:
+                    continue
+                # The thief is expected to run at the median rate, or this one's if it is faster
+                keep = int(segment.remaining * rate / (rate + max(median, rate)))
+                split = segment.position + keep
+                finish = segment.remaining / rate
+            if finish != float('inf') and segment.end - split < min_steal:
+                continue
+            if best is None or finish > best[2]:
+                best = (segment, split, finish)
+        return best
+
+    def _steal(self) -> Optional[Segment]:
+        found = self._straggler(time.monotonic())
+        if found is None:
+            return None
+
+        victim, split, finish = found
+        reason = 'stalled' if finish == float('inf') else 'slow'
+        logger.info("splitting %r at %d (%s)", victim, split, reason)
+        segment = Segment(split, victim.end)
+        victim.end = split
+        # Keep segments ordered by offset for contiguous_bytes()
+        index = bisect.bisect([s.start for s in self.segments], split)
+        self.segments.insert(index, segment)
+        self.steals += 1
+        metrics.SEGMENT_STEALS.inc(reason=reason)
+        return segment
+
+    async def _write(self, segment: Segment, chunk: bytes):
+        segment.fetch_bytes += len(chunk)
+        segment.progress_at = time.monotonic()
+        if len(chunk) > segment.remaining:
+            # Past the end of a segment that was split while this request was running
+            self.discarded += len(chunk) - segment.remaining
+            chunk = chunk[:segment.remaining]
+        if not chunk:
+            return
+
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+
+        segment.waiting = True
+        try:
+            if self.output.seekable:
+                await self.output.write_at(segment.position, chunk)
+            else:
+                await self._write_in_order(segment.position, chunk)
+        finally:
+            segment.waiting = False
+            segment.progress_at = time.monotonic()
+        segment.position += len(chunk)
+        self.downloaded += len(chunk)
+        metrics.BYTES_TRANSFERRED.inc(len(chunk), source='cdn')
+
+        if self.progress_callback:
+            self.progress_callback(self.downloaded, self.total_size)
+
+    async def _write_in_order(self, offset: int, chunk: bytes):
+        while offset != self.flushed and self.held_bytes >= self.max_buffer:
+            await self._flushed_changed.wait()
+        if offset != self.flushed:
+            self.held[offset] = chunk
+            self.held_bytes += len(chunk)
+            self.peak_held = max(self.peak_held, self.held_bytes)
+            return
+
+        while chunk is not None:
+            await self.output.write(chunk)
+            self.flushed += len(chunk)
+            chunk = self.held.pop(self.flushed, None)
+            if chunk is not None:
+                self.held_bytes -= len(chunk)
+            changed, self._flushed_changed = self._flushed_changed, asyncio.Event()
+            changed.set()
+
+    async def _fetch(self, connection_id: int, segment: Segment):
+        headers = {'Range': f'bytes={segment.position}-{segment.end - 1}'}
+        sent = time.monotonic()
+
+        segment.fetch_started = segment.progress_at = sent
+        segment.fetch_bytes = 0
+        metrics.ACTIVE_CONNECTIONS.inc()
+        try:
+            await self._read_segment(connection_id, segment, headers, sent)
+        finally:
+            metrics.ACTIVE_CONNECTIONS.dec()
+            if segment.fetch_bytes:
+                self.rates.append(segment.rate(time.monotonic()))
+            segment.fetch_started = None
+
+    async def _read_segment(self, connection_id: int, segment: Segment, headers: dict, sent: float):
+        async with self.session.get(self.url, headers=headers) as response:
+            if response.status == 429 or response.status >= 500:
+                # Temporary; raised as a ClientError so _worker retries it with backoff
+                response.raise_for_status()
+            if response.status in (200, 416):
+                raise DownloadFailedException(f"Server ignored range request (HTTP {response.status})")
+            if response.status != 206:
+                raise DownloadFailedException(f"Segment request failed (HTTP {response.status})")
+            self.controller.record_rtt(connection_id, time.monotonic() - sent)
+
+            while segment.remaining > 0:
+                started = time.monotonic()
+                chunk = await response.content.read(self.controller.read_size)
+                if not chunk:
+                    break
+                self.controller.record_transfer(connection_id, len(chunk), time.monotonic() - started)
+                await self._write(segment, chunk)
+                if self.limiter is not None:
+                    await self.limiter.consume(len(chunk))
+
+    async def _worker(self, connection_id: int):
+        while True:
+            # New segments would only wait for a full output buffer; replace a stalled front one first
+            segment = self._steal() if self._buffer_full() else None
+            if segment is None:
+                if len(self.active) > self.controller.connections and connection_id == max(self.active):
+                    return
+                segment = self._claim() or self._steal()
+            if segment is None:
+                return
+
+            attempt = 0
+            while segment.remaining > 0:
+                try:
+                    await self._fetch(connection_id, segment)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise DownloadFailedException(f"Segment {segment.start}-{segment.end} failed: {e}")
+                    logger.warning("connection %d: retrying %r after error: %s", connection_id, segment, e)
+                    metrics.RETRIES.inc(operation='segment')
+                    await asyncio.sleep(min(2 ** attempt, 10))
+                    continue
+
+                if segment.remaining > 0:
+                    attempt += 1
+                    metrics.RETRIES.inc(operation='segment')
+                    if attempt > self.max_retries:
+                        raise DownloadFailedException(f"Segment {segment.start}-{segment.end} ended early")
+
+    def contiguous_bytes(self) -> int:
+        """Length of the prefix of the output that has been written without gaps."""
+        for segment in self.segments:
+            if segment.remaining > 0:
+                return segment.position
+        return self.next_offset
+
+    def _has_work(self) -> bool:
+        return self.next_offset < self.total_size or self._straggler(time.monotonic()) is not None
+
+    async def run(self):
+        if self.progress_callback:
+            self.progress_callback(0, self.total_size)
+
+        next_id = 0
+        try:
+            while True:
+                while len(self.active) < self.controller.connections and self._has_work():
+                    self.active[next_id] = asyncio.ensure_future(self._worker(next_id))
+                    next_id += 1
+                if self._buffer_full() and self._straggler(time.monotonic()) is not None:
+                    # Every other connection waits for the stalled front segment; one more replaces it
+                    # and retires afterwards
+                    self.active[next_id] = asyncio.ensure_future(self._worker(next_id))
+                    next_id += 1
+
+                if not self.active:
+                    break
+
+                pending = self.total_size - self.next_offset
+                metrics.QUEUE_DEPTH.set(-(-pending // self.controller.segment_size))
+
+                done, _ = await asyncio.wait(list(self.active.values()), timeout=self.controller.interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for connection_id, task in list(self.active.items()):
+                    if task in done:
+                        del self.active[connection_id]
+                        task.result()
+                if self.downloaded == self.total_size and (self.output.seekable or self.flushed == self.total_size):
+                    # Anything still running is reading past the end of a segment taken over from it
+                    break
+        finally:
+            metrics.QUEUE_DEPTH.set(0)
+            for task in self.active.values():
+                task.cancel()
+            if self.active:
+                await asyncio.gather(*self.active.values(), return_exceptions=True)
+            self.active = {}
+
+        if self.downloaded != self.total_size:
+            raise DownloadFailedException(
+                f"Incomplete download: {self.downloaded} of {self.total_size} bytes")
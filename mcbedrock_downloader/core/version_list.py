@@ -1,64 +1,360 @@
+import os
+import sys
 import json
-import aiohttp
-from typing import List, Dict, Optional
+import time
+import logging
+import hashlib
+from typing import AsyncIterator, List, Dict, Optional, Sequence
+
+from . import metrics
+from .tracing import tracer
+from .exceptions import VersionListException
+from .catalog_snapshot import CatalogSnapshot, write_snapshot
+from ..utils.json_stream import JsonArrayParser
+
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+CONFLICT_POLICIES = ('prefer', 'majority')
+
+
+def default_cache_path(versions_api: str) -> str:
+    """Per-user cache file for the catalog served at versions_api."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    digest = hashlib.sha1(versions_api.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(base, 'mcbedrock-downloader', f'versions-{digest}.json')
+
+
+def is_remote_source(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+def merge_catalogs(catalogs: Sequence[Sequence[Dict]], conflict: str = 'prefer') -> List[Dict]:
+    """Merge catalogs given in priority order, de-duplicating by UUID.
+
+    Versions keep the order of the first catalog listing them. When catalogs
+    disagree about a UUID's name or type, 'prefer' takes the highest-priority
+    catalog and 'majority' the most common entry (ties go to priority).
+    """
+    candidates = {}
+    for catalog in catalogs:
+        seen = set()
+        for version in catalog:
+            if version['uuid'] in seen:
+                continue
+            seen.add(version['uuid'])
+            candidates.setdefault(version['uuid'], []).append(version)
+            
+    merged = []
+    conflicts = 0
+    for entries in candidates.values():
+        if len({(v['name'], v['version_type']) for v in entries}) > 1:
+            conflicts += 1
+            if conflict == 'majority':
+                counts = {}
+                for v in entries:
+                    counts[(v['name'], v['version_type'])] = counts.get((v['name'], v['version_type']), 0) + 1
+                merged.append(max(entries, key=lambda v: counts[(v['name'], v['version_type'])]))
+                continue
+        merged.append(entries[0])
+    if conflicts:
+        logger.info("Resolved %d catalog conflicts by %s", conflicts, conflict)
+    return merged
 
 
 class VersionList:
     
-    def __init__(self, versions_api: str = "https://raw.githubusercontent.com/ddf8196/mc-w10-versiondb-auto-update/refs/heads/master/versions.json.min"):
+    TYPE_NAMES = {
+        0: "Release",
+        1: "Beta", 
+        2: "Preview"
+    }
+    
+    def __init__(self, versions_api: str = "https://raw.githubusercontent.com/ddf8196/mc-w10-versiondb-auto-update/refs/heads/master/versions.json.min",
+                 cache_path: Optional[str] = None, extra_sources: Sequence[str] = (), quorum: int = 1,
+                 conflict: str = 'prefer', source_timeout: float = 15):
         self.versions_api = versions_api
+        self.cache_path = cache_path
+        # The first source is preferred: once it answers, slower sources are not waited for
+        self.sources = [versions_api] + [source for source in extra_sources if source != versions_api]
+        self.quorum = quorum
+        self.conflict = conflict
+        self.source_timeout = source_timeout
         self.versions = []
+        self.snapshot = None
+        self.from_cache = False
+        
+    @property
+    def snapshot_path(self) -> Optional[str]:
+        """Binary snapshot written next to the JSON cache after every load from JSON."""
+        if not self.cache_path:
+            return None
+        return os.path.splitext(self.cache_path)[0] + '.snap'
+        
+    def cache_age(self) -> Optional[float]:
+        """Seconds since the cached catalog was written, or None without a cache."""
+        if not self.cache_path:
+            return None
+        try:
+            return max(0.0, time.time() - os.path.getmtime(self.cache_path))
+        except OSError:
+            return None
+            
+    def load_cached(self, max_age: Optional[float] = None) -> bool:
+        """Load the catalog from cache_path without touching the network."""
+        age = self.cache_age()
+        if age is None or (max_age is not None and age > max_age):
+            metrics.CACHE_MISSES.inc(cache='catalog_file')
+            return False
+            
+        if self._load_snapshot():
+            metrics.CACHE_HITS.inc(cache='catalog_snapshot')
+            self.from_cache = True
+            return True
+        metrics.CACHE_MISSES.inc(cache='catalog_snapshot')
+            
+        try:
+            parser = JsonArrayParser()
+            versions = []
+            with open(self.cache_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                    versions.extend(self._records(parser.feed(chunk)))
+            versions.extend(self._records(parser.close()))
+        except (OSError, ValueError):
+            metrics.CACHE_MISSES.inc(cache='catalog_file')
+            return False
+            
+        metrics.CACHE_HITS.inc(cache='catalog_file')
+        self._set_versions(versions)
+        self._write_snapshot()
+        self.from_cache = True
+        return True
+        
+    def _load_snapshot(self) -> bool:
+        """Map the snapshot if it is at least as new as the JSON cache."""
+        try:
+            if os.path.getmtime(self.snapshot_path) < os.path.getmtime(self.cache_path):
+                return False
+            snapshot = CatalogSnapshot(self.snapshot_path, self.TYPE_NAMES)
+        except (OSError, ValueError):
+            return False
+        self._set_versions(snapshot)
+        self.snapshot = snapshot
+        return True
+        
+    def _write_snapshot(self):
+        try:
+            write_snapshot(self.snapshot_path, self.versions)
+        except OSError:
+            pass
         
     async def download_list(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.versions_api) as response:
-                response.raise_for_status()
-                content_type = response.headers.get('content-type', '')
-                if 'application/json' in content_type:
-                    data = await response.json()
-                else:
-                    text = await response.text()
-                    data = json.loads(text)
-                
-        self.versions = []
-        for item in data:
+        async for _ in self.iter_list():
+            pass
+        return self.versions
+        
+    async def iter_list(self) -> AsyncIterator[Dict]:
+        """Download the catalog, yielding each version as soon as its record has arrived.
+
+        The body is parsed incrementally and copied to the cache file as it
+        arrives; self.versions is replaced only once the whole list is in.
+        With several sources (or a local file) the merged list is yielded
+        once the federated fetch completes.
+        """
+        import aiohttp
+        
+        if len(self.sources) > 1 or not is_remote_source(self.versions_api):
+            for version in await self._download_federated():
+                yield version
+            return
+            
+        started = time.monotonic()
+        parser = JsonArrayParser()
+        versions = []
+        cache_file = self._open_cache()
+        try:
+            with tracer.span('catalog_fetch', url=self.versions_api):
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(self.versions_api) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(READ_SIZE):
+                            if cache_file:
+                                cache_file.write(chunk)
+                            for version in self._records(parser.feed(chunk)):
+                                versions.append(version)
+                                yield version
+                        for version in self._records(parser.close()):
+                            versions.append(version)
+                            yield version
+        except BaseException as e:
+            if cache_file:
+                self._discard_cache(cache_file)
+            if isinstance(e, Exception):
+                metrics.CATALOG_LOADS.inc(result='error')
+            raise
+            
+        self._set_versions(versions)
+        if cache_file:
+            self._commit_cache(cache_file)
+            self._write_snapshot()
+        self.from_cache = False
+        metrics.CATALOG_LOAD_SECONDS.observe(time.monotonic() - started)
+        metrics.CATALOG_LOADS.inc(result='ok')
+        
+    async def _download_federated(self) -> List[Dict]:
+        """Fetch all sources concurrently and merge what has answered once the
+        preferred source or a quorum of sources has."""
+        import asyncio
+        
+        started = time.monotonic()
+        tasks = {}
+        for index, source in enumerate(self.sources):
+            task = asyncio.ensure_future(asyncio.wait_for(self._fetch_source(source), self.source_timeout))
+            tasks[task] = index
+            
+        results = {}
+        pending = set(tasks)
+        try:
+            with tracer.span('catalog_fetch', url=self.versions_api, sources=len(self.sources)):
+                while pending and 0 not in results and len(results) < self.quorum:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        source = self.sources[tasks[task]]
+                        try:
+                            results[tasks[task]] = task.result()
+                        except Exception as e:
+                            logger.warning("Catalog source %s failed: %s", source,
+                                           'timed out' if isinstance(e, asyncio.TimeoutError) else e)
+                            metrics.CATALOG_SOURCE_LOADS.inc(source=source, result='error')
+                            continue
+                        metrics.CATALOG_SOURCE_LOADS.inc(source=source, result='ok')
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            
+        if not results:
+            metrics.CATALOG_LOADS.inc(result='error')
+            raise VersionListException(f"No catalog source answered ({len(self.sources)} tried)")
+            
+        versions = merge_catalogs([results[index] for index in sorted(results)], self.conflict)
+        logger.info("Catalog from %d of %d sources: %d versions", len(results), len(self.sources), len(versions))
+        self._set_versions(versions)
+        cache_file = self._open_cache()
+        if cache_file:
+            cache_file.write(json.dumps([[v['name'], v['uuid'], v['version_type']] for v in versions]).encode('utf-8'))
+            self._commit_cache(cache_file)
+            self._write_snapshot()
+        self.from_cache = False
+        metrics.CATALOG_LOAD_SECONDS.observe(time.monotonic() - started)
+        metrics.CATALOG_LOADS.inc(result='ok')
+        return versions
+        
+    async def _fetch_source(self, source: str) -> List[Dict]:
+        import asyncio
+        
+        parser = JsonArrayParser()
+        versions = []
+        if not is_remote_source(source):
+            path = source[len('file://'):] if source.startswith('file://') else source
+            
+            def read_file():
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                        versions.extend(self._records(parser.feed(chunk)))
+                        
+            await asyncio.get_event_loop().run_in_executor(None, read_file)
+        else:
+            import aiohttp
+            
+            async with aiohttp.ClientSession() as session:
+                async with session.get(source) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(READ_SIZE):
+                        versions.extend(self._records(parser.feed(chunk)))
+        versions.extend(self._records(parser.close()))
+        return versions
+        
+    def _open_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            return open(self.cache_path + '.tmp', 'wb')
+        except OSError:
+            return None
+            
+    def _commit_cache(self, cache_file):
+        try:
+            cache_file.close()
+            os.replace(self.cache_path + '.tmp', self.cache_path)
+        except OSError:
+            pass
+            
+    def _discard_cache(self, cache_file):
+        cache_file.close()
+        try:
+            os.remove(self.cache_path + '.tmp')
+        except OSError:
+            pass
+        
+    def _records(self, items) -> List[Dict]:
+        records = []
+        for item in items:
             if len(item) >= 3:
                 name, uuid, version_type = item[0], item[1], item[2]
-                self.versions.append({
+                records.append({
                     'name': name,
                     'uuid': uuid,
                     'version_type': version_type,
                     'type_name': self.get_version_type_name(version_type)
                 })
-                
-        return self.versions
+        return records
+        
+    def _set_versions(self, versions: Sequence[Dict]):
+        if self.snapshot is not None:
+            # Unmap before the snapshot file can be replaced (required on Windows)
+            self.snapshot.close()
+            self.snapshot = None
+        self.versions = versions
+        metrics.CATALOG_VERSIONS.set(len(self.versions))
         
     def get_version_type_name(self, version_type: int) -> str:
-        type_names = {
-            0: "Release",
-            1: "Beta", 
-            2: "Preview"
-        }
-        return type_names.get(version_type, "Unknown")
+        return self.TYPE_NAMES.get(version_type, "Unknown")
         
     def get_versions_by_type(self, version_type: int) -> List[Dict]:
+        if self.snapshot is not None:
+            return self.snapshot.of_type(version_type)
         return [v for v in self.versions if v['version_type'] == version_type]
         
     def search_versions(self, query: str) -> List[Dict]:
+        if self.snapshot is not None:
+            return self.snapshot.search(query)
         query_lower = query.lower()
         return [v for v in self.versions if query_lower in v['name'].lower()]
         
     def get_version_by_uuid(self, uuid: str) -> Optional[Dict]:
+        if self.snapshot is not None:
+            return self.snapshot.by_uuid(uuid)
         for version in self.versions:
             if version['uuid'] == uuid:
                 return version
         return None
         
     def get_version_by_name(self, name: str) -> Optional[Dict]:
+        if self.snapshot is not None:
+            return self.snapshot.by_name(name)
         for version in self.versions:
             if version['name'] == name:
                 return version
         return None
         
     def sort_versions(self, reverse: bool = True) -> List[Dict]:
+        if self.snapshot is not None:
+            return self.snapshot.sorted_by_name(reverse)
         return sorted(self.versions, key=lambda x: x['name'], reverse=reverse)
@@ -5,6 +5,8 @@ from xml.etree import ElementTree as ET
 from typing import List, Optional
 import aiohttp
 
+from . import metrics
+
 
 class WUProtocol:
     
@@ -20,8 +22,9 @@ class WUProtocol:
         'wuclient': 'http://www.microsoft.com/SoftwareDistribution/Server/ClientWebService'
     }
     
-    def __init__(self):
+    def __init__(self, secured_url: Optional[str] = None):
         self.msa_user_token = None
+        self.secured_url = secured_url or self.SECURED_URL
         
     def set_msa_user_token(self, token: str):
         self.msa_user_token = token
@@ -79,7 +82,7 @@ class WUProtocol:
         return header
         
     def get_download_url(self) -> str:
-        return self.SECURED_URL
+        return self.secured_url
         
     def build_download_request(self, update_identity: str, revision_number: str) -> str:
         envelope = ET.Element("{%s}Envelope" % self.NAMESPACES['soap'])
@@ -87,6 +90,7 @@ class WUProtocol:
         envelope.set("{%s}s" % ET._namespace_map.get('xmlns', 'xmlns'), self.NAMESPACES['soap'])
         
         envelope.append(self.build_header(self.get_download_url(), "GetExtendedUpdateInfo2"))
+        metrics.SOAP_ENVELOPES.inc(method='GetExtendedUpdateInfo2')
         
         body = ET.SubElement(envelope, "{%s}Body" % self.NAMESPACES['soap'])
         get_extended_update_info = ET.SubElement(body, "{%s}GetExtendedUpdateInfo2" % self.NAMESPACES['wuclient'])
@@ -126,6 +130,7 @@ class WUProtocol:
                     break
                     
             if result_elem is None:
+                metrics.SOAP_PARSE_ERRORS.inc()
                 return []
                 
             urls = []
@@ -133,7 +138,9 @@ class WUProtocol:
                 if elem.tag.endswith('Url'):
                     urls.append(elem.text)
                     
+            metrics.SOAP_URLS.inc(len(urls))
             return urls
             
         except ET.ParseError:
+            metrics.SOAP_PARSE_ERRORS.inc()
             return []
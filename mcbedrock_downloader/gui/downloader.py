@@ -3,8 +3,11 @@ GUI version of the downloader components
 """
 
 from ..core.downloader import VersionDownloader
-from ..core.version_list import VersionList
+from ..core.version_list import VersionList, default_cache_path
+from ..core.catalog_db import CatalogDatabase, SEARCH_COLUMNS
+from ..core.resolution_cache import ResolutionCache, default_resolution_cache_path
+from ..core.bulk_resolve import BulkResolver
 from ..core.exceptions import BadUpdateIdentityException, DownloadFailedException
 from ..utils.helpers import format_size, progress_callback
 
-__all__ = ['VersionDownloader', 'VersionList', 'BadUpdateIdentityException', 'DownloadFailedException', 'format_size', 'progress_callback']
+__all__ = ['VersionDownloader', 'VersionList', 'default_cache_path', 'CatalogDatabase', 'SEARCH_COLUMNS', 'ResolutionCache', 'default_resolution_cache_path', 'BulkResolver', 'BadUpdateIdentityException', 'DownloadFailedException', 'format_size', 'progress_callback']
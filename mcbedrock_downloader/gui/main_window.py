@@ -9,11 +9,14 @@ import threading
 import json
 import os
 import sys
+import time
 from datetime import datetime
 from typing import Optional, List, Dict, Callable
 import webbrowser
 
-from mcbedrock_downloader.gui.downloader import VersionDownloader, VersionList, BadUpdateIdentityException, format_size
+from mcbedrock_downloader.gui.downloader import (VersionDownloader, VersionList, BadUpdateIdentityException, format_size,
+                                                 CatalogDatabase, SEARCH_COLUMNS, default_cache_path,
+                                                 ResolutionCache, default_resolution_cache_path, BulkResolver)
 
 LIGHT_COLORS = {
     'bg': '#f3f3f3',
@@ -54,6 +57,8 @@ DARK_COLORS = {
 }
 
 COLORS = LIGHT_COLORS
+
+VERSION_PAGE_SIZE = 200
 class DownloaderGUI:
     """Main GUI class for Minecraft Bedrock Version Downloader"""
     
@@ -83,6 +88,13 @@ class DownloaderGUI:
         self.progress_var = tk.DoubleVar()
         self.download_status = tk.StringVar(value="Ready")
         self.versions_data = []
+        self.catalog_db = None
+        self.version_query = None
+        self.loaded_rows = 0
+        self.total_rows = 0
+        self.resolution_cache = None
+        self.version_items = {}
+        self.fetching_sizes = False
         
         self.create_widgets()
         self.create_menu()
@@ -357,23 +369,30 @@ class DownloaderGUI:
                                 style='Secondary.TButton')
         refresh_btn.pack(side=tk.RIGHT)
         
+        self.sizes_btn = ttk.Button(controls_frame, text="Fetch Sizes",
+                                    command=self.fetch_sizes,
+                                    style='Secondary.TButton')
+        self.sizes_btn.pack(side=tk.RIGHT, padx=(0, 10))
+        
         list_frame = tk.Frame(card, bg=COLORS['surface'])
         list_frame.pack(fill=tk.BOTH, expand=True)
         
-        columns = ('Name', 'Type', 'UUID')
+        columns = ('Name', 'Type', 'Size', 'UUID')
         self.version_tree = ttk.Treeview(list_frame, columns=columns, show='headings', 
                                         style='Modern.Treeview')
         
         self.version_tree.heading('Name', text='Version Name')
         self.version_tree.heading('Type', text='Type')
+        self.version_tree.heading('Size', text='Size')
         self.version_tree.heading('UUID', text='UUID')
         
         self.version_tree.column('Name', width=180, anchor=tk.W)
         self.version_tree.column('Type', width=80, anchor=tk.CENTER)
+        self.version_tree.column('Size', width=90, anchor=tk.E)
         self.version_tree.column('UUID', width=280, anchor=tk.W)
         
         scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.version_tree.yview)
-        self.version_tree.configure(yscrollcommand=scrollbar.set)
+        self.version_tree.configure(yscrollcommand=lambda first, last: self.on_version_scroll(scrollbar, first, last))
         
         self.version_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -528,8 +547,21 @@ class DownloaderGUI:
                 self.download_status.set("Loading versions...")
                 
                 version_list = VersionList()
+                self.root.after(0, self.clear_version_list)
                 
-                loop.run_until_complete(version_list.download_list())
+                async def stream_versions():
+                    # Hand records to the tree in batches while the catalog downloads
+                    batch = []
+                    flushed = time.monotonic()
+                    async for version in version_list.iter_list():
+                        batch.append(version)
+                        if time.monotonic() - flushed >= 0.2:
+                            self.root.after(0, self.append_versions, batch)
+                            batch = []
+                            flushed = time.monotonic()
+                    self.root.after(0, self.append_versions, batch)
+                
+                loop.run_until_complete(stream_versions())
                 
                 self.root.after(0, self.update_version_list, version_list.versions)
                 
@@ -541,6 +573,34 @@ class DownloaderGUI:
         thread = threading.Thread(target=load_async, daemon=True)
         thread.start()
         
+    def open_catalog_db(self, versions: List[Dict]):
+        """Merge the loaded catalog into the SQLite store used for paged listing"""
+        try:
+            if self.catalog_db is None:
+                path = os.path.splitext(default_cache_path(VersionList().versions_api))[0] + '.sqlite'
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.catalog_db = CatalogDatabase(path)
+            self.catalog_db.sync(versions)
+        except Exception as e:
+            self.log_message(f"Catalog database unavailable, keeping versions in memory: {e}")
+            self.catalog_db = None
+            
+    def clear_version_list(self):
+        """Drop the current versions before a reload streams in new ones"""
+        self.versions_data = []
+        self.version_query = None
+        self.loaded_rows = self.total_rows = 0
+        self.version_items = {}
+        for item in self.version_tree.get_children():
+            self.version_tree.delete(item)
+        
+    def append_versions(self, versions: List[Dict]):
+        """Show versions that arrived while the list is still loading"""
+        self.versions_data.extend(versions)
+        for version in versions:
+            if self.version_matches(version):
+                self.insert_version(version)
+                
     def update_version_list(self, versions: List[Dict]):
         """Update version list in GUI"""
         def version_key(v):
@@ -550,38 +610,161 @@ class DownloaderGUI:
             except:
                 return v['name']
         
-        sorted_versions = sorted(versions, key=version_key, reverse=True)
-        self.versions_data = sorted_versions
+        self.open_catalog_db(versions)
+        if self.catalog_db is not None:
+            # Rows are paged in from the database from now on
+            self.versions_data = []
+        else:
+            self.versions_data = sorted(versions, key=version_key, reverse=True)
         self.filter_versions()
         self.download_status.set("Ready")
         self.log_message(f"Loaded {len(versions)} versions")
         
     def filter_versions(self, event=None):
         """Filter versions based on selected filter and search query"""
+        self.version_items = {}
         for item in self.version_tree.get_children():
             self.version_tree.delete(item)
             
+        if self.catalog_db is not None and not self.versions_data:
+            filter_value = self.version_filter.get()
+            type_ids = {name.lower(): version_type for version_type, name in VersionList.TYPE_NAMES.items()}
+            self.version_query = {
+                'version_type': type_ids.get(filter_value) if filter_value != "all" else None,
+                'search': self.search_query.get().strip() or None,
+                'search_columns': SEARCH_COLUMNS,
+            }
+            self.total_rows = self.catalog_db.count(**self.version_query)
+            self.loaded_rows = 0
+            self.load_version_page()
+            return
+            
         if not self.versions_data:
             return
             
+        for version in self.versions_data:
+            if self.version_matches(version):
+                self.insert_version(version)
+                
+    def load_version_page(self):
+        """Append the next page of database results to the tree"""
+        if self.catalog_db is None or self.version_query is None or self.loaded_rows >= self.total_rows:
+            return
+        versions = self.catalog_db.query(order='name', reverse=True, limit=VERSION_PAGE_SIZE,
+                                         offset=self.loaded_rows, **self.version_query)
+        self.loaded_rows += len(versions)
+        for version in versions:
+            self.insert_version(version)
+            
+    def on_version_scroll(self, scrollbar, first, last):
+        """Keep the scrollbar in sync and load more rows near the end of the list"""
+        scrollbar.set(first, last)
+        if float(last) >= 0.98 and self.loaded_rows < self.total_rows:
+            self.root.after_idle(self.load_version_page)
+            
+    def find_version(self, uuid: str) -> Optional[Dict]:
+        """Look up a listed version by UUID"""
+        for version in self.versions_data:
+            if version['uuid'] == uuid:
+                return version
+        if self.catalog_db is not None:
+            return self.catalog_db.get(uuid)
+        return None
+        
+    def version_matches(self, version: Dict) -> bool:
+        """Check a version against the selected filter and search query"""
         filter_value = self.version_filter.get()
         search_value = self.search_query.get().lower()
         
-        for version in self.versions_data:
-            if filter_value != "all" and version['type_name'].lower() != filter_value:
-                continue
+        if filter_value != "all" and version['type_name'].lower() != filter_value:
+            return False
+            
+        if search_value:
+            if (search_value not in version['name'].lower() and 
+                search_value not in version['uuid'].lower() and
+                search_value not in version['type_name'].lower()):
+                return False
                 
-            if search_value:
-                if (search_value not in version['name'].lower() and 
-                    search_value not in version['uuid'].lower() and
-                    search_value not in version['type_name'].lower()):
-                    continue
+        return True
+        
+    def insert_version(self, version: Dict):
+        """Add a version row to the tree"""
+        self.version_items[version['uuid']] = self.version_tree.insert('', 'end', values=(
+            version['name'],
+            version['type_name'],
+            self.cached_size(version['uuid']),
+            version['uuid']
+        ))
+        
+    def open_resolution_cache(self) -> Optional[ResolutionCache]:
+        """Package sizes found by earlier size fetches (or the resolve command)"""
+        if self.resolution_cache is None:
+            try:
+                self.resolution_cache = ResolutionCache(
+                    default_resolution_cache_path(default_cache_path(VersionList().versions_api)))
+            except Exception as e:
+                self.log_message(f"Size cache unavailable: {e}")
+        return self.resolution_cache
+        
+    def cached_size(self, uuid: str) -> str:
+        cache = self.open_resolution_cache()
+        record = cache.get(uuid) if cache is not None else None
+        if record is None or record.get('size') is None:
+            return ''
+        return format_size(record['size'])
+        
+    def listed_versions(self) -> List[Dict]:
+        """Every version matching the current filter, including rows not paged in yet"""
+        if self.catalog_db is not None and self.version_query is not None:
+            return self.catalog_db.query(order='name', reverse=True, **self.version_query)
+        return [version for version in self.versions_data if self.version_matches(version)]
+        
+    def fetch_sizes(self):
+        """Resolve URLs and probe package sizes for the listed versions"""
+        if self.fetching_sizes or self.open_resolution_cache() is None:
+            return
+        token = self.msa_token.get()
+        versions = [version for version in self.listed_versions() if token or version['version_type'] != 1]
+        if not versions:
+            return
+        self.fetching_sizes = True
+        self.sizes_btn.config(state=tk.DISABLED)
+        self.log_message(f"Fetching sizes for {len(versions)} versions...")
+        
+        def fetch_async():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            
+            async def resolve():
+                async with VersionDownloader() as downloader:
+                    if token:
+                        downloader.enable_user_authorization(token)
+                    resolver = BulkResolver(downloader, self.resolution_cache)
+                    async for record in resolver.resolve(versions):
+                        self.root.after(0, self.update_size, record)
+                    return resolver.stats
                     
-            self.version_tree.insert('', 'end', values=(
-                version['name'],
-                version['type_name'],
-                version['uuid']
-            ))
+            try:
+                stats = loop.run_until_complete(resolve())
+                self.root.after(0, self.log_message, f"Fetched {stats['resolved']} sizes "
+                                f"({stats['cached']} already known, {stats['failed']} failed)")
+            except Exception as e:
+                self.root.after(0, self.log_message, f"Error fetching sizes: {e}")
+            finally:
+                loop.close()
+                self.root.after(0, self.sizes_fetched)
+                
+        threading.Thread(target=fetch_async, daemon=True).start()
+        
+    def update_size(self, record: Dict):
+        item = self.version_items.get(record['uuid'])
+        if item is not None and self.version_tree.exists(item) and record.get('size') is not None:
+            self.version_tree.set(item, 'Size', format_size(record['size']))
+            
+    def sizes_fetched(self):
+        self.fetching_sizes = False
+        self.sizes_btn.config(state=tk.NORMAL)
+        self.resolution_cache.compact()
                 
     def on_version_select(self, event):
         """Handle version selection"""
@@ -590,10 +773,7 @@ class DownloaderGUI:
             item = self.version_tree.item(selection[0])
             values = item['values']
             
-            for version in self.versions_data:
-                if version['uuid'] == values[2]:
-                    self.selected_version = version
-                    break
+            self.selected_version = self.find_version(values[3]) or self.selected_version
                     
             if self.selected_version:
                 type_name = self.selected_version['type_name']
@@ -745,6 +925,10 @@ class DownloaderGUI:
             self.progress_var.set(100)
             self.download_status.set("Download completed successfully!")
             self.log_message(f"✅ Download completed: {self.output_path.get()}")
+            if self.catalog_db is not None and self.selected_version:
+                path = os.path.abspath(self.output_path.get())
+                self.catalog_db.record_download(self.selected_version['uuid'], self.selected_version['name'], path,
+                                                os.path.getsize(path) if os.path.exists(path) else None)
             
             self.show_success_notification("Download completed successfully!")
         else:
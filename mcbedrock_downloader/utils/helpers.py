@@ -1,4 +1,6 @@
+import os
 import re
+import shutil
 from typing import Optional, Tuple
 
 
@@ -60,6 +62,20 @@ def progress_callback(downloaded: int, total: int):
         print()
 
 
+def free_disk_space(path: str) -> Optional[int]:
+    """Free bytes on the filesystem that would hold path, or None if it cannot be determined."""
+    directory = os.path.dirname(os.path.abspath(path))
+    while directory and not os.path.isdir(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    try:
+        return shutil.disk_usage(directory).free
+    except OSError:
+        return None
+
+
 def get_default_filename(version_name: str, version_type: str) -> str:
     if version_type == "Preview":
         return f"Minecraft-Preview-{version_name}.appx"
@@ -0,0 +1,88 @@
+import json
+import codecs
+from typing import Any, List
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonArrayParser:
+    """Incremental parser for a top-level JSON array.
+
+    Feed it chunks of bytes as they arrive; each call returns the elements
+    completed by that chunk, so only the unfinished tail is ever buffered.
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._started = False
+        self._finished = False
+        self._expect_value = True
+        self.count = 0
+
+    def feed(self, data: bytes) -> List[Any]:
+        self._buffer += self._decoder.decode(data)
+        return self._parse(final=False)
+
+    def close(self) -> List[Any]:
+        self._buffer += self._decoder.decode(b'', final=True)
+        items = self._parse(final=True)
+        if not self._finished:
+            raise ValueError("Unexpected end of JSON array")
+        return items
+
+    def _skip(self, position: int) -> int:
+        while position < len(self._buffer) and self._buffer[position] in WHITESPACE:
+            position += 1
+        return position
+
+    def _parse(self, final: bool) -> List[Any]:
+        items = []
+        buffer = self._buffer
+        position = self._skip(0)
+
+        if not self._started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError("Expected a JSON array")
+            self._started = True
+            position = self._skip(position + 1)
+
+        while self._started and not self._finished and position < len(buffer):
+            char = buffer[position]
+            if char == ']':
+                if self._expect_value and self.count:
+                    raise ValueError("Unexpected ']' after ',' in JSON array")
+                self._finished = True
+                position += 1
+                break
+            if char == ',':
+                if self._expect_value:
+                    raise ValueError("Unexpected ',' in JSON array")
+                self._expect_value = True
+                position = self._skip(position + 1)
+                continue
+            if not self._expect_value:
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+
+            try:
+                item, end = self._json.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                # Element not complete yet; wait for more data
+                break
+            if not final and not isinstance(item, (list, dict, str)) and (
+                    end == len(buffer) or buffer[end] not in WHITESPACE + ',]'):
+                # A number may continue in the next chunk, e.g. '1.' + '5'
+                break
+            items.append(item)
+            self.count += 1
+            self._expect_value = False
+            position = self._skip(end)
+
+        if self._finished and buffer[position:].strip():
+            raise ValueError("Extra data after JSON array")
+        self._buffer = buffer[position:]
+        return items
@@ -0,0 +1,141 @@
+import re
+import csv
+import json
+import time
+from typing import Dict, Iterable, List, Optional, TextIO
+
+from .helpers import format_size
+
+
+FORMATS = ('table', 'json', 'ndjson', 'csv')
+
+VERSION_FIELDS = ['name', 'type_name', 'uuid', 'version_type', 'first_seen', 'last_seen',
+                  'size', 'etag', 'last_modified']
+DEFAULT_FIELDS = ['name', 'type_name', 'uuid']
+
+TABLE_WIDTHS = {'name': 30, 'type_name': 10, 'version_type': 4, 'first_seen': 25, 'last_seen': 25,
+                'at': 25, 'event': 10, 'size': 10, 'etag': 36, 'last_modified': 30}
+# Human-readable values for the table format; the others keep raw values
+TABLE_FORMATTERS = {'size': format_size}
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in VERSION_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown)}; choose from {', '.join(VERSION_FIELDS)}")
+    return fields
+
+
+def natural_key(value):
+    """Sort key that orders digit runs numerically, so 1.9 < 1.10 and 2 < 10."""
+    if isinstance(value, (int, float)):
+        return ((0, value, ''),)
+    parts = re.split(r'(\d+)', str(value if value is not None else ''))
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part.lower()) for part in parts if part)
+
+
+def sort_records(records: Iterable[Dict], field: str, reverse: bool = False) -> List[Dict]:
+    return sorted(records, key=lambda record: natural_key(record.get(field)), reverse=reverse)
+
+
+class RecordWriter:
+    """Writes records one at a time so output starts before the input is exhausted."""
+
+    def __init__(self, stream: TextIO, fields: List[str]):
+        self.stream = stream
+        self.fields = fields
+        self.count = 0
+
+    def select(self, record: Dict) -> Dict:
+        return {field: record.get(field) for field in self.fields}
+
+    def write(self, record: Dict):
+        self.count += 1
+
+    def write_all(self, records: Iterable[Dict]) -> int:
+        for record in records:
+            self.write(record)
+        self.close()
+        return self.count
+
+    def close(self):
+        self.stream.flush()
+
+
+class TableWriter(RecordWriter):
+
+    def write(self, record: Dict):
+        super().write(record)
+        columns = []
+        for index, field in enumerate(self.fields):
+            value = record.get(field)
+            if value is not None and field in TABLE_FORMATTERS:
+                value = TABLE_FORMATTERS[field](value)
+            value = '' if value is None else str(value)
+            if index < len(self.fields) - 1:
+                value = f"{value:<{TABLE_WIDTHS.get(field, 20)}}"
+            columns.append(value)
+        print(' '.join(columns), file=self.stream)
+
+
+class JsonWriter(RecordWriter):
+
+    def write(self, record: Dict):
+        self.stream.write(',\n  ' if self.count else '[\n  ')
+        self.stream.write(json.dumps(self.select(record)))
+        super().write(record)
+
+    def close(self):
+        self.stream.write('\n]\n' if self.count else '[]\n')
+        super().close()
+
+
+class NdjsonWriter(RecordWriter):
+
+    def write(self, record: Dict):
+        super().write(record)
+        self.stream.write(json.dumps(self.select(record)) + '\n')
+
+
+class CsvWriter(RecordWriter):
+
+    def __init__(self, stream: TextIO, fields: List[str]):
+        super().__init__(stream, fields)
+        self.writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore', lineterminator='\n')
+        self.writer.writeheader()
+
+    def write(self, record: Dict):
+        super().write(record)
+        self.writer.writerow(self.select(record))
+
+
+WRITERS = {'table': TableWriter, 'json': JsonWriter, 'ndjson': NdjsonWriter, 'csv': CsvWriter}
+
+
+def create_writer(output_format: str, stream: TextIO, fields: List[str]) -> RecordWriter:
+    return WRITERS[output_format](stream, fields)
+
+
+class EventStream:
+    """NDJSON events for downloads: progress (rate limited) and results."""
+
+    def __init__(self, stream: TextIO, interval: float = 0.5):
+        self.stream = stream
+        self.interval = interval
+        self._last_progress = 0.0
+
+    def emit(self, event: str, **fields):
+        fields = dict(event=event, time=round(time.time(), 3), **fields)
+        self.stream.write(json.dumps(fields) + '\n')
+        self.stream.flush()
+
+    def progress(self, downloaded: int, total: int):
+        now = time.monotonic()
+        finished = 0 < total <= downloaded
+        if not finished and now - self._last_progress < self.interval:
+            return
+        self._last_progress = now
+        self.emit('progress', downloaded=downloaded, total=total)
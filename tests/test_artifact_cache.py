@@ -0,0 +1,29 @@
+import asyncio
+
+from stub_server import StubServer, StubOptions, make_package
+from run import make_downloader
+from mcbedrock_downloader.core.artifact_cache import ArtifactCache
+
+MB = 1024 * 1024
+
+
+def test_caches_sharing_a_directory_fetch_once(tmp_path):
+    data = make_package(6 * MB, seed=4)
+
+    async def scenario():
+        async with StubServer(StubOptions(bandwidth=8 * MB)) as server:
+            server.add_package('pkg', data)
+            # Two caches over one directory stand in for two processes on a host
+            async with make_downloader(server) as first, make_downloader(server) as second:
+                caches = [ArtifactCache(str(tmp_path), downloader, poll_interval=0.05)
+                          for downloader in (first, second)]
+                paths = await asyncio.gather(*(cache.ensure('pkg') for cache in caches))
+        return paths, server
+
+    paths, server = asyncio.run(scenario())
+    assert server.requests['soap'] == 1
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read() == data
+    # The lock and progress files go once the fetch completes
+    assert not [p for p in tmp_path.rglob('*') if p.suffix in ('.lock', '.progress')]
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from stub_server import StubServer, StubOptions, make_catalog
+from run import make_downloader
+from mcbedrock_downloader.core.bulk_resolve import AimdLimiter, BulkResolver
+from mcbedrock_downloader.core.resolution_cache import ResolutionCache
+
+
+def catalog_versions(count):
+    return [{'name': name, 'uuid': uuid, 'version_type': version_type, 'type_name': "Release"}
+            for name, uuid, version_type in make_catalog(count, seed=3)]
+
+
+async def resolve_all(server, versions, cache, **kwargs):
+    for version in versions:
+        server.add_package(version['uuid'], b'x' * (1000 + len(version['name'])))
+    async with make_downloader(server) as downloader:
+        resolver = BulkResolver(downloader, cache, **kwargs)
+        records = [record async for record in resolver.resolve(versions)]
+    return records, resolver
+
+
+def test_limiter_grows_per_round_and_backs_off_once_per_burst():
+    async def scenario():
+        limiter = AimdLimiter(initial=4, maximum=8)
+        tickets = [await limiter.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limiter.release(ticket, latency=0.01)
+        # About one slot per round of completions
+        assert 4.9 < limiter.limit < 5
+
+        tickets = [await limiter.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limiter.release(ticket, congested=True)
+        assert limiter.decreases == 1
+        assert 2 <= limiter.limit < 3
+        assert limiter.inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_throttled_resolution_retries_and_caches(tmp_path):
+    versions = catalog_versions(40)
+    path = str(tmp_path / 'resolutions.jsonl')
+
+    async def scenario():
+        async with StubServer(StubOptions(soap_latency=0.01, soap_capacity=4)) as server:
+            with ResolutionCache(path) as cache:
+                first, resolver = await resolve_all(server, versions, cache, limiter=AimdLimiter(initial=16),
+                                                    probe=False, max_retries=10)
+            soap_calls = server.requests['soap']
+            with ResolutionCache(path) as cache:
+                second, _ = await resolve_all(server, versions, cache)
+            assert server.requests['soap'] == soap_calls
+            return first, second, resolver, server
+
+    first, second, resolver, server = asyncio.run(scenario())
+    assert server.requests['throttled'] > 0
+    assert resolver.stats['throttled'] > 0 and resolver.limiter.decreases > 0
+    assert resolver.stats['resolved'] == len(versions)
+    assert sorted(record['uuid'] for record in first) == sorted(v['uuid'] for v in versions)
+    assert all(record['url'] and not record['error'] for record in first)
+    assert [record['uuid'] for record in second] == [v['uuid'] for v in versions]
+
+
+def test_cache_recovers_from_a_cut_line(tmp_path):
+    path = tmp_path / 'resolutions.jsonl'
+    cache = ResolutionCache(str(path))
+    for attempt in range(3):
+        cache.put({'uuid': 'a', 'url': f'http://x/{attempt}'})
+    cache.close()
+    with open(path, 'a') as f:
+        f.write('{"uuid": "c", "url": "http:')
+
+    cache = ResolutionCache(str(path))
+    assert len(cache) == 1
+    assert cache.get('a')['url'] == 'http://x/2'
+    assert cache.get('a', max_age=-1) is None
+    assert cache.get('c') is None
+    # Appended after an interrupted run, the next record must not join the cut line
+    with cache:
+        cache.put({'uuid': 'b', 'url': 'http://x/b'})
+    assert ResolutionCache(str(path)).get('b')['url'] == 'http://x/b'
+    assert json.loads(path.read_text().splitlines()[-1])['uuid'] == 'b'
+
+
+def test_probed_sizes_reach_listings(tmp_path):
+    versions = catalog_versions(5)
+
+    async def scenario():
+        async with StubServer() as server:
+            with ResolutionCache(str(tmp_path / 'resolutions.jsonl')) as cache:
+                records, _ = await resolve_all(server, versions, cache)
+            return records
+
+    records = asyncio.run(scenario())
+    for record in records:
+        assert record['size'] == 1000 + len(record['name'])
+        assert record['etag'] and record['last_modified']
+
+    enriched = ResolutionCache(str(tmp_path / 'resolutions.jsonl')).metadata(versions + [
+        {'name': 'unresolved', 'uuid': 'x', 'version_type': 0, 'type_name': "Release"}])
+    assert [v['size'] for v in enriched] == [1000 + len(v['name']) for v in versions] + [None]
+    assert enriched[0]['name'] == versions[0]['name']
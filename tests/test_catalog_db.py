@@ -0,0 +1,56 @@
+from mcbedrock_downloader.core.catalog_db import CatalogDatabase, FTS_REBUILD_ROWS
+
+
+def version(name, uuid, version_type=0):
+    return {'name': name, 'uuid': uuid, 'version_type': version_type,
+            'type_name': ("Release", "Beta", "Preview")[version_type]}
+
+
+def names(records):
+    return [record['name'] for record in records]
+
+
+def test_sync_records_added_updated_removed_and_returned(tmp_path):
+    with CatalogDatabase(str(tmp_path / 'catalog.db')) as db:
+        assert db.sync([version('1.0.0', 'a'), version('1.1.0', 'b'), version('1.2.0', 'c', 1)],
+                       seen_at=1000) == {'added': 3, 'returned': 0, 'removed': 0}
+        # b is renamed in place, c disappears
+        assert db.sync([version('1.0.0', 'a'), version('1.1.1', 'b')],
+                       seen_at=2000) == {'added': 0, 'returned': 0, 'removed': 1}
+        assert db.get('b')['name'] == '1.1.1'
+        assert db.get('c')['removed_at'] is not None
+        assert names(db.query()) == ['1.0.0', '1.1.1']
+        assert names(db.query(include_removed=True)) == ['1.0.0', '1.1.1', '1.2.0']
+
+        assert db.sync([version('1.0.0', 'a'), version('1.1.1', 'b'), version('1.2.0', 'c', 1)],
+                       seen_at=3000) == {'added': 0, 'returned': 1, 'removed': 0}
+        returned = db.get('c')
+        assert returned['removed_at'] is None
+        assert returned['first_seen'] < returned['last_seen']
+        assert [event['event'] for event in db.history('c')] == ['returned', 'removed', 'added']
+        assert db.synced_at() == 3000
+
+
+def test_search_follows_renames(tmp_path):
+    with CatalogDatabase(str(tmp_path / 'catalog.db')) as db:
+        db.sync([version('1.16.100.4', 'uuid-one'), version('1.16.200.2', 'uuid-two', 2)], seen_at=1000)
+        assert names(db.query(search='16.2')) == ['1.16.200.2']
+        assert names(db.query(search='PREVIEW', search_columns=('type_name',))) == ['1.16.200.2']
+        assert names(db.query(search='one', search_columns=('name', 'uuid'))) == ['1.16.100.4']
+        # Shorter than a trigram, served by LIKE
+        assert names(db.query(search='.4')) == ['1.16.100.4']
+        assert db.count(search='1.16') == 2
+
+        db.sync([version('1.17.0.2', 'uuid-one'), version('1.16.200.2', 'uuid-two', 2)], seen_at=2000)
+        assert names(db.query(search='16.100')) == []
+        assert names(db.query(search='17.0')) == ['1.17.0.2']
+
+
+def test_large_sync_rebuilds_the_index(tmp_path):
+    count = FTS_REBUILD_ROWS + 100
+    with CatalogDatabase(str(tmp_path / 'catalog.db')) as db:
+        db.sync([version(f'1.{i}.0', str(i)) for i in range(count)], seen_at=1000)
+        db.sync([version(f'2.{i}.0', str(i)) for i in range(count)], seen_at=2000)
+        assert db.count(search='1.1') == 0
+        assert db.count(search='2.10') == 11
+        assert names(db.query(order='name', limit=3)) == ['2.0.0', '2.1.0', '2.2.0']
@@ -0,0 +1,77 @@
+import pytest
+
+from stub_server import make_catalog
+from mcbedrock_downloader.core.catalog_snapshot import CatalogSnapshot, write_snapshot
+
+TYPE_NAMES = {0: "Release", 1: "Beta", 2: "Preview"}
+
+
+def versions_for(count):
+    versions = [{'name': name, 'uuid': uuid, 'version_type': version_type}
+                for name, uuid, version_type in make_catalog(count, seed=7)]
+    versions.append({'name': 'Ünïcode 1.0', 'uuid': 'u-1', 'version_type': 1})
+    return versions
+
+
+def snapshot_of(tmp_path, versions):
+    path = str(tmp_path / 'catalog.snapshot')
+    write_snapshot(path, versions)
+    return CatalogSnapshot(path, TYPE_NAMES)
+
+
+def test_round_trip_keeps_catalog_order(tmp_path):
+    versions = versions_for(500)
+    snapshot = snapshot_of(tmp_path, versions)
+    try:
+        assert len(snapshot) == len(versions)
+        assert [{k: v[k] for k in ('name', 'uuid', 'version_type')} for v in snapshot] == versions
+        assert snapshot[-1]['type_name'] == "Beta"
+        assert snapshot[10:12] == [snapshot[10], snapshot[11]]
+        with pytest.raises(IndexError):
+            snapshot[len(versions)]
+    finally:
+        snapshot.close()
+
+
+def test_lookups_match_a_scan(tmp_path):
+    versions = versions_for(500)
+    snapshot = snapshot_of(tmp_path, versions)
+    try:
+        for version in versions[::37]:
+            assert snapshot.by_name(version['name'])['uuid'] == version['uuid']
+            assert snapshot.by_uuid(version['uuid'])['name'] == version['name']
+        assert snapshot.by_name('9.9.9') is None
+        assert snapshot.by_uuid('missing') is None
+
+        for version_type in (0, 1, 2, 3):
+            assert ([v['name'] for v in snapshot.of_type(version_type)]
+                    == [v['name'] for v in versions if v['version_type'] == version_type])
+        assert [v['name'] for v in snapshot.sorted_by_name(reverse=True)] == sorted(
+            (v['name'] for v in versions), reverse=True)
+
+        for query in ('1.0.1', '.19', 'ÜNÏ', 'nothing'):
+            assert ([v['name'] for v in snapshot.search(query)]
+                    == [v['name'] for v in versions if query.lower() in v['name'].lower()])
+    finally:
+        snapshot.close()
+
+
+def test_empty_catalog(tmp_path):
+    snapshot = snapshot_of(tmp_path, [])
+    try:
+        assert len(snapshot) == 0
+        assert list(snapshot) == []
+        assert snapshot.by_name('1.0') is None
+        assert snapshot.search('1') == []
+    finally:
+        snapshot.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'catalog.snapshot'
+    path.write_bytes(b'[["1.0", "uuid", 0]]' * 10)
+    with pytest.raises(ValueError):
+        CatalogSnapshot(str(path))
+    path.write_bytes(b'MCB')
+    with pytest.raises(ValueError):
+        CatalogSnapshot(str(path))
@@ -0,0 +1,61 @@
+import hashlib
+import random
+
+from stub_server import make_package
+from test_delta import build_package, sample_members
+from mcbedrock_downloader.core.chunk_store import ChunkStore
+
+KB = 1024
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_versions_share_unchanged_members(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'), max_chunk=64 * KB)
+    members = sample_members(seed=1)
+    old = build_package(members)
+    # A member inserted up front shifts everything else to new offsets
+    new = build_package([('AppxManifest.xml', b'<Package/>')] + members[:5] + [('data/new.bin', b'x' * 300 * KB)])
+
+    first = store.add_file('1.0.appx', write(tmp_path / 'old.appx', old))
+    second = store.add_file('1.1.appx', write(tmp_path / 'new.appx', new))
+
+    assert first['new_bytes'] == len(old)
+    assert second['new_bytes'] < len(new) // 2
+    assert store.stats()['dedup_ratio'] > 1.5
+    for name, data in (('1.0.appx', old), ('1.1.appx', new)):
+        assert b''.join(store.stream(name)) == data
+        restored = store.restore(name, str(tmp_path / 'restored'))
+        with open(restored, 'rb') as f:
+            assert hashlib.sha256(f.read()).hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_gc_frees_only_unreferenced_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'), max_chunk=64 * KB)
+    store.add_file('a.appx', write(tmp_path / 'a', make_package(512 * KB, members=4, seed=1)))
+    store.add_file('b.appx', write(tmp_path / 'b', make_package(512 * KB, members=4, seed=2)))
+
+    assert store.gc() == 0
+    store.remove('a.appx')
+    assert store.gc() > 0
+    assert [index['name'] for index in store.versions()] == ['b.appx']
+    assert b''.join(store.stream('b.appx')) == make_package(512 * KB, members=4, seed=2)
+
+
+def test_writer_indexes_out_of_order_writes_on_close(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'))
+    data = random.Random(3).getrandbits(200 * KB * 8).to_bytes(200 * KB, 'little')
+
+    with store.writer('x.appx') as writer:
+        writer.truncate(len(data))
+        for start in (100 * KB, 0):
+            writer.seek(start)
+            writer.write(data[start:start + 100 * KB])
+
+    assert writer.index['sha256'] == hashlib.sha256(data).hexdigest()
+    assert b''.join(store.stream('x.appx')) == data
+    assert list((tmp_path / 'store' / 'tmp').iterdir()) == []
@@ -0,0 +1,39 @@
+import asyncio
+import sys
+
+from mcbedrock_downloader import cli
+from mcbedrock_downloader.core.downloader import VersionDownloader
+from mcbedrock_downloader.core.exceptions import DownloadFailedException
+from mcbedrock_downloader.core.version_list import VersionList
+
+UUID = '5f6e0c3d-1111-4c4a-9a5e-000000000001'
+
+
+def test_failed_uuid_download_removes_its_part_file(tmp_path, monkeypatch):
+    async def get_download_url(self, update_identity, revision_number):
+        return 'http://cdn.invalid/package.appx'
+
+    async def warm_up(self):
+        pass
+
+    async def download(self, update_identity, revision_number, destination, *args, **kwargs):
+        with open(destination, 'wb') as f:
+            f.write(b'partial')
+        raise DownloadFailedException("connection reset")
+
+    monkeypatch.setattr(VersionDownloader, 'get_download_url', get_download_url)
+    monkeypatch.setattr(VersionDownloader, 'warm_up', warm_up)
+    monkeypatch.setattr(VersionDownloader, 'download', download)
+    monkeypatch.chdir(tmp_path)
+
+    args = cli.build_parser().parse_intermixed_args(['--download', UUID])
+    args.stdout = sys.stdout
+    args.hedge_policy = None
+
+    async def scenario():
+        # The version list is still loading, so the package has no name yet
+        catalog_task = asyncio.ensure_future(asyncio.sleep(0))
+        return await cli.download_version(args, UUID, VersionList(), catalog_task)
+
+    assert asyncio.run(scenario()) == 1
+    assert list(tmp_path.iterdir()) == []
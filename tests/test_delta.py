@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import io
+import os
+import random
+import zipfile
+
+import pytest
+
+from stub_server import StubServer
+from run import make_downloader
+from mcbedrock_downloader.core.exceptions import DownloadFailedException
+
+KB = 1024
+
+
+def build_package(members, prefix=b''):
+    buf = io.BytesIO()
+    buf.write(prefix)
+    with zipfile.ZipFile(buf, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def sample_members(seed, count=8, size=200 * KB):
+    rng = random.Random(seed)
+    return [(f'data/chunk{index:04d}.bin', rng.getrandbits(size * 8).to_bytes(size, 'little'))
+            for index in range(count)]
+
+
+def delta_packages():
+    members = sample_members(seed=1)
+    base = build_package(members)
+    changed = list(members)
+    changed[3] = (changed[3][0], sample_members(seed=2, count=1)[0][1])
+    # Bytes ahead of the first local header must come from the remote package too
+    remote = build_package(changed + [('AppxManifest.xml', b'<Package/>')], prefix=b'\x00stub' * 100)
+    return base, remote
+
+
+def run_delta(tmp_path, base, remote):
+    base_path = str(tmp_path / 'base.appx')
+    with open(base_path, 'wb') as f:
+        f.write(base)
+    destination = str(tmp_path / 'new.appx')
+
+    async def scenario():
+        async with StubServer() as server:
+            server.add_package('pkg', remote)
+            async with make_downloader(server) as downloader:
+                return await downloader.download_delta(server.cdn_prefix + 'pkg', destination, base_path)
+
+    return asyncio.run(scenario()), destination
+
+
+def test_delta_package_matches_remote(tmp_path):
+    base, remote = delta_packages()
+    plan, destination = run_delta(tmp_path, base, remote)
+
+    with open(destination, 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == hashlib.sha256(remote).hexdigest()
+    assert plan.reused_members == 7
+    assert plan.fetched_bytes < len(remote) // 2
+    assert sorted(os.listdir(tmp_path)) == ['base.appx', 'new.appx']
+
+
+def test_failed_delta_leaves_no_destination(tmp_path):
+    base, remote = delta_packages()
+    # Same names and CRCs but the base is corrupt where a reused member's data sits
+    offset = base.index(sample_members(seed=1)[5][1])
+    corrupt = base[:offset] + b'\xff' * 16 + base[offset + 16:]
+
+    with pytest.raises(DownloadFailedException):
+        run_delta(tmp_path, corrupt, remote)
+    assert os.listdir(tmp_path) == ['base.appx']
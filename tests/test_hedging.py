@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from stub_server import StubServer, make_package
+from run import make_downloader
+from mcbedrock_downloader.core.hedging import HedgePolicy
+
+
+def test_delay_follows_the_latency_percentile():
+    policy = HedgePolicy(percentile=0.9, initial_delay=1.0, min_delay=0.02, min_samples=10)
+    for latency in range(9):
+        policy.record(latency / 100)
+    assert policy.delay() == 1.0
+    for latency in range(9, 100):
+        policy.record(latency / 100)
+    assert policy.delay() == 0.9
+    policy.latencies.clear()
+    for _ in range(10):
+        policy.record(0.001)
+    assert policy.delay() == 0.02
+
+
+def test_budget_caps_the_hedge_rate():
+    policy = HedgePolicy(max_rate=0.1, burst=2.0)
+    hedged = 0
+    for _ in range(1000):
+        policy.started()
+        hedged += policy.try_hedge()
+    assert hedged <= 0.1 * 1000 + 2
+    assert policy.skipped == 1000 - hedged
+    assert policy.stats()['hedge_rate'] == hedged / 1000
+
+
+def test_first_answer_wins_and_the_other_is_cancelled():
+    calls = []
+
+    async def scenario():
+        async with StubServer() as server:
+            server.add_package('pkg', make_package(64 * 1024))
+            policy = HedgePolicy(initial_delay=0.05)
+            async with make_downloader(server, hedge=policy) as downloader:
+                post = downloader.post_xml_async
+
+                async def slow_first(url, xml):
+                    index = len(calls)
+                    calls.append('started')
+                    try:
+                        if index == 0:
+                            await asyncio.sleep(5)
+                        response = await post(url, xml)
+                    except asyncio.CancelledError:
+                        calls[index] = 'cancelled'
+                        raise
+                    calls[index] = 'answered'
+                    return response
+
+                downloader.post_xml_async = slow_first
+                started = time.monotonic()
+                url = await downloader.get_download_url('pkg', '1')
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(0)
+        return url, elapsed, policy, server
+
+    url, elapsed, policy, server = asyncio.run(scenario())
+    assert url.endswith('pkg.appx')
+    assert elapsed < 2
+    assert calls == ['cancelled', 'answered']
+    assert (policy.hedges, policy.hedge_wins) == (1, 1)
+    assert server.requests['soap'] == 1
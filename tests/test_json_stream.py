@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from mcbedrock_downloader.utils.json_stream import JsonArrayParser
+
+DOCUMENT = json.dumps([
+    ["1.20.1.2", "5f6e0c3d-1111-4c4a-9a5e-000000000001", 0],
+    {"name": "Préversion ], \"quoted\"", "tags": [1, 2, {"x": None}]},
+    12.5, -3e4, 1234567, True, False, None, "ünïcödé ✓",
+], ensure_ascii=False, indent=1).encode('utf-8')
+
+
+def parse(chunks):
+    parser = JsonArrayParser()
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    items.extend(parser.close())
+    return items
+
+
+def test_every_split_point_yields_the_same_elements():
+    expected = json.loads(DOCUMENT)
+    for split in range(len(DOCUMENT) + 1):
+        assert parse([DOCUMENT[:split], DOCUMENT[split:]]) == expected, split
+
+
+def test_single_byte_chunks():
+    assert parse([DOCUMENT[i:i + 1] for i in range(len(DOCUMENT))]) == json.loads(DOCUMENT)
+
+
+def test_elements_are_returned_as_soon_as_complete():
+    parser = JsonArrayParser()
+    assert parser.feed(b'[[1, 2], [3') == [[1, 2]]
+    assert parser.feed(b', 4], 5') == [[3, 4]]
+    # 5 could still become 56
+    assert parser.feed(b'6 ]') == [56]
+    assert parser.close() == []
+    assert parser.count == 3
+
+
+@pytest.mark.parametrize('document', [b'{"a": 1}', b'[1, 2', b'[1,, 2]', b'[1, 2,]', b'[1 2]', b'[1] 2'])
+def test_malformed_arrays_are_rejected(document):
+    with pytest.raises(ValueError):
+        parse([document])
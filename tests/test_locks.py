@@ -0,0 +1,83 @@
+import json
+import socket
+import subprocess
+import sys
+
+from mcbedrock_downloader.core.locks import FileLock
+
+
+def write_dead_holder(path):
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    with open(path, 'w') as f:
+        json.dump({'owner': f"{socket.gethostname()}:{process.pid}", 'acquired': 0}, f)
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    path = str(tmp_path / 'x.lock')
+    write_dead_holder(path)
+    lock = FileLock(path)
+    assert lock.acquire()
+    assert lock.holder()['token'] == lock.token
+    assert not FileLock(path).acquire()
+
+
+def test_racing_takeovers_leave_one_holder(tmp_path):
+    path = str(tmp_path / 'x.lock')
+    write_dead_holder(path)
+    first = FileLock(path)
+
+    class Racing(FileLock):
+        def _stale(self, snapshot):
+            stale = super()._stale(snapshot)
+            # The rival breaks the same stale lock and takes it right after this check
+            assert first.acquire()
+            return stale
+
+    second = Racing(path)
+    assert not second.acquire()
+    assert FileLock(path).holder()['token'] == first.token
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['x.lock']
+
+
+def test_release_keeps_a_lock_taken_over_since(tmp_path):
+    path = str(tmp_path / 'x.lock')
+    old = FileLock(path)
+    assert old.acquire()
+    new = FileLock(path)
+    with open(path, 'w') as f:
+        json.dump({'owner': new.owner, 'token': new.token, 'acquired': 0}, f)
+
+    old.release()
+    assert FileLock(path).holder()['token'] == new.token
+    new.release()
+    assert not (tmp_path / 'x.lock').exists()
+
+
+def test_pid_check_does_not_signal_on_windows(tmp_path, monkeypatch):
+    from mcbedrock_downloader.core import locks
+
+    def kill(pid, sig):
+        raise AssertionError("os.kill must not be used on Windows")
+
+    checked = []
+    monkeypatch.setattr(locks.sys, 'platform', 'win32')
+    monkeypatch.setattr(locks.os, 'kill', kill)
+    monkeypatch.setattr(locks, '_windows_pid_alive', lambda pid: checked.append(pid) or False)
+    path = str(tmp_path / 'x.lock')
+    write_dead_holder(path)
+    assert FileLock(path).acquire()
+    assert len(checked) == 1
+
+
+def test_lock_held_open_elsewhere_is_not_acquired(tmp_path, monkeypatch):
+    from mcbedrock_downloader.core import locks
+
+    def rename(src, dst):
+        raise PermissionError(13, "The process cannot access the file")
+
+    path = str(tmp_path / 'x.lock')
+    write_dead_holder(path)
+    monkeypatch.setattr(locks.os, 'rename', rename)
+    assert not FileLock(path).acquire()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['x.lock']
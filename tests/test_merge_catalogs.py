@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from mcbedrock_downloader.core.version_list import VersionList, merge_catalogs
+
+
+def catalog(*entries):
+    return [{'name': name, 'uuid': uuid, 'version_type': version_type} for name, uuid, version_type in entries]
+
+
+def test_merge_keeps_first_listing_order_and_dedupes():
+    first = catalog(('1.0', 'a', 0), ('1.1', 'b', 0), ('1.0', 'a', 0))
+    second = catalog(('1.2', 'c', 1), ('1.1', 'b', 0), ('0.9', 'z', 0))
+    assert [v['uuid'] for v in merge_catalogs([first, second])] == ['a', 'b', 'c', 'z']
+
+
+def test_conflicts_prefer_priority_or_majority():
+    catalogs = [catalog(('1.1 wrong', 'b', 2)), catalog(('1.1', 'b', 0)), catalog(('1.1', 'b', 0))]
+    assert merge_catalogs(catalogs)[0]['name'] == '1.1 wrong'
+    assert merge_catalogs(catalogs, conflict='majority')[0]['name'] == '1.1'
+
+
+def test_majority_ties_go_to_priority():
+    catalogs = [catalog(('x', 'b', 0)), catalog(('y', 'b', 0)), catalog(('y', 'b', 0)), catalog(('x', 'b', 0))]
+    assert merge_catalogs(catalogs, conflict='majority')[0]['name'] == 'x'
+    # The same name with a different type is a different entry
+    catalogs = [catalog(('x', 'b', 1)), catalog(('x', 'b', 0)), catalog(('y', 'b', 0))]
+    assert merge_catalogs(catalogs, conflict='majority')[0]['version_type'] == 1
+
+
+def write_sources(tmp_path, *catalogs):
+    paths = []
+    for index, entries in enumerate(catalogs):
+        path = tmp_path / f'source{index}.json'
+        path.write_text(json.dumps(entries))
+        paths.append(str(path))
+    return paths
+
+
+def test_quorum_without_the_preferred_source(tmp_path):
+    sources = write_sources(tmp_path, [['1.0', 'a', 0], ['1.1 bad', 'b', 0]],
+                            [['1.0', 'a', 0], ['1.1', 'b', 0], ['1.2', 'c', 0]],
+                            [['1.1', 'b', 0]])
+    missing = str(tmp_path / 'missing.json')
+
+    versions = VersionList(missing, extra_sources=sources, quorum=3, conflict='majority')
+    asyncio.run(versions.download_list())
+    assert [(v['name'], v['uuid']) for v in versions.versions] == [('1.0', 'a'), ('1.1', 'b'), ('1.2', 'c')]
+
+
+def test_preferred_source_answers_alone(tmp_path):
+    preferred, other = write_sources(tmp_path, [['1.0', 'a', 0]], [['1.0 other', 'a', 0], ['2.0', 'x', 0]])
+    versions = VersionList(preferred, extra_sources=[other], quorum=2)
+    asyncio.run(versions.download_list())
+    assert versions.versions[0]['name'] == '1.0'
+    assert versions.versions[0]['type_name'] == "Release"
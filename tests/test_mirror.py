@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import os
+
+from stub_server import StubServer, make_package
+from mcbedrock_downloader.core.downloader import VersionDownloader
+from mcbedrock_downloader.core.mirror import Mirror, mirror_versions, package_filename, run_mirror
+from mcbedrock_downloader.core.wu_protocol import WUProtocol
+
+MB = 1024 * 1024
+
+
+def mirror_with(tmp_path, monkeypatch, packages, versions, prepare=None):
+    async def scenario():
+        async with StubServer() as server:
+            monkeypatch.setattr(VersionDownloader, 'DOWNLOAD_URL_PREFIXES', (server.cdn_prefix,))
+            for uuid, data in packages.items():
+                server.add_package(uuid, data)
+            mirror = Mirror(str(tmp_path / 'mirror'))
+            if prepare:
+                prepare(mirror)
+            stats = await mirror_versions(mirror, versions, {'protocol': WUProtocol(server.soap_url)})
+            return mirror, stats
+
+    return asyncio.run(scenario())
+
+
+def version(name, uuid):
+    return {'name': name, 'uuid': uuid, 'version_type': 0, 'type_name': "Release"}
+
+
+def test_versions_sharing_a_name_get_their_own_files(tmp_path, monkeypatch):
+    packages = {'uuid-a': make_package(MB, seed=1), 'uuid-b': make_package(MB, seed=2)}
+    versions = [version('1.2.3', 'uuid-a'), version('1.2.3', 'uuid-b')]
+    mirror, stats = mirror_with(tmp_path, monkeypatch, packages, versions)
+
+    assert stats['fetched'] == 2
+    for v in versions:
+        record = mirror.record(v['uuid'])
+        assert record['file'] == package_filename(v)
+        with open(os.path.join(mirror.packages_dir, record['file']), 'rb') as f:
+            assert hashlib.sha256(f.read()).hexdigest() == record['sha256']
+        assert record['sha256'] == hashlib.sha256(packages[v['uuid']]).hexdigest()
+
+
+def test_interrupted_package_resumes_from_its_part_file(tmp_path, monkeypatch):
+    data = make_package(2 * MB, seed=3)
+    v = version('1.0.0', 'uuid-a')
+
+    def prepare(mirror):
+        with open(os.path.join(mirror.packages_dir, package_filename(v) + '.part'), 'wb') as f:
+            f.write(data[:MB + 123])
+
+    async def no_full_download(*args, **kwargs):
+        raise AssertionError("the package should have been resumed")
+
+    monkeypatch.setattr(VersionDownloader, 'download', no_full_download)
+    mirror, stats = mirror_with(tmp_path, monkeypatch, {'uuid-a': data}, [v], prepare)
+    assert stats['fetched'] == 1
+    assert mirror.record('uuid-a')['sha256'] == hashlib.sha256(data).hexdigest()
+
+
+def test_locked_versions_are_reported(tmp_path, monkeypatch):
+    root = str(tmp_path / 'mirror')
+    assert Mirror(root).lock('uuid-a').acquire()
+
+    async def scenario():
+        async with StubServer() as server:
+            monkeypatch.setattr(VersionDownloader, 'DOWNLOAD_URL_PREFIXES', (server.cdn_prefix,))
+            server.add_package('uuid-a', make_package(MB))
+            server.add_package('uuid-b', make_package(MB, seed=1))
+            return await run_mirror(root, [version('1.0.0', 'uuid-a'), version('1.1.0', 'uuid-b')],
+                                    downloader_options={'protocol': WUProtocol(server.soap_url)})
+
+    totals = asyncio.run(scenario())
+    assert (totals['fetched'], totals['locked'], totals['missing']) == (1, 1, 1)
@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from stub_server import StubServer, StubOptions, make_package
+from run import make_downloader
+from mcbedrock_downloader.core.chunk_store import ChunkStore
+from mcbedrock_downloader.core.sinks import BufferSink, CallbackSink, FileSink
+
+MB = 1024 * 1024
+
+
+def test_failed_store_write_is_not_indexed(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'))
+    with pytest.raises(RuntimeError):
+        with FileSink(store.writer('x.appx')) as sink:
+            sink.truncate(MB)
+            raise RuntimeError("transfer failed")
+    assert store.versions() == []
+
+
+def test_cancelled_store_download_is_not_indexed(tmp_path):
+    async def scenario():
+        store = ChunkStore(str(tmp_path / 'store'))
+        async with StubServer(StubOptions(bandwidth=2 * MB)) as server:
+            server.add_package('pkg', make_package(8 * MB, seed=1))
+            async with make_downloader(server, store=store) as downloader:
+                task = asyncio.ensure_future(downloader.download('pkg', '1', 'x.appx'))
+                await asyncio.sleep(0.5)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+        return store
+
+    assert asyncio.run(scenario()).versions() == []
+
+
+@pytest.mark.parametrize('destination', ['buffer', 'callback', 'async_callback'])
+def test_download_into_sinks(destination):
+    data = make_package(6 * MB, seed=2)
+    received = []
+
+    async def consume(chunk):
+        received.append(chunk)
+        await asyncio.sleep(0)
+
+    sinks = {'buffer': BufferSink(), 'callback': CallbackSink(received.append), 'async_callback': consume}
+
+    async def scenario():
+        async with StubServer(StubOptions()) as server:
+            server.add_package('pkg', data)
+            async with make_downloader(server) as downloader:
+                await downloader.download('pkg', '1', sinks[destination])
+
+    asyncio.run(scenario())
+    output = sinks['buffer'].getvalue() if destination == 'buffer' else b''.join(received)
+    assert hashlib.sha256(output).digest() == hashlib.sha256(data).digest()
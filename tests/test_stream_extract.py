@@ -0,0 +1,78 @@
+import io
+import random
+import zipfile
+
+import pytest
+
+from mcbedrock_downloader.core.exceptions import DownloadFailedException
+from mcbedrock_downloader.core.remote_zip import read_directory
+from mcbedrock_downloader.core.stream_extract import StreamExtractor
+
+
+class Unseekable(io.RawIOBase):
+    """Makes zipfile write data descriptors, as streaming packers do."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def streamed_package(compress_type):
+    rng = random.Random(5)
+    members = {'AppxManifest.xml': b'<Package/>' * 50,
+               'data/random.bin': rng.getrandbits(300000 * 8).to_bytes(300000, 'little'),
+               'data/empty.txt': b''}
+    out = Unseekable()
+    with zipfile.ZipFile(out, 'w', compression=compress_type) as archive:
+        for name, data in members.items():
+            with archive.open(name, 'w') as f:
+                f.write(data)
+    return bytes(out.data), members
+
+
+def extract(tmp_path, package, chunk_size, directory=None):
+    extractor = StreamExtractor(str(tmp_path / 'out'), directory)
+    for start in range(0, len(package), chunk_size):
+        extractor.feed(package[start:start + chunk_size])
+    return extractor.finish()
+
+
+def assert_extracted(tmp_path, members):
+    for name, data in members.items():
+        assert (tmp_path / 'out' / name).read_bytes() == data
+
+
+@pytest.mark.parametrize('chunk_size', [7, 4096, 1 << 20])
+def test_deflated_members_with_data_descriptors(tmp_path, chunk_size):
+    package, members = streamed_package(zipfile.ZIP_DEFLATED)
+    assert all(info.flag_bits & 0x08 for info in zipfile.ZipFile(io.BytesIO(package)).infolist())
+
+    extracted = extract(tmp_path, package, chunk_size)
+    assert sorted(entry.name for entry in extracted) == sorted(members)
+    assert_extracted(tmp_path, members)
+
+
+def test_stored_members_with_data_descriptors_need_the_directory(tmp_path):
+    package, members = streamed_package(zipfile.ZIP_STORED)
+    with pytest.raises(DownloadFailedException):
+        extract(tmp_path, package, 4096)
+
+    directory = read_directory(io.BytesIO(package), len(package))
+    extract(tmp_path, package, 4096, directory)
+    assert_extracted(tmp_path, members)
+
+
+def test_corrupt_member_fails_its_crc(tmp_path):
+    package, members = streamed_package(zipfile.ZIP_STORED)
+    directory = read_directory(io.BytesIO(package), len(package))
+    offset = package.index(members['data/random.bin'][:64]) + 1000
+    corrupt = package[:offset] + bytes([package[offset] ^ 0xff]) + package[offset + 1:]
+
+    with pytest.raises(DownloadFailedException, match='Checksum mismatch'):
+        extract(tmp_path, corrupt, 4096, directory)
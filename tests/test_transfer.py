@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+
+import aiohttp
+
+from stub_server import StubServer, StubOptions, make_package
+from run import make_downloader
+from mcbedrock_downloader.core.adaptive import AdaptiveController
+from mcbedrock_downloader.core.sinks import BufferSink, CallbackSink
+from mcbedrock_downloader.core.transfer import Segment, SegmentedTransfer
+
+MB = 1024 * 1024
+
+
+def make_transfer(total_size=16 * MB, connections=4, **kwargs):
+    controller = AdaptiveController.fixed(connections, segment_size=4 * MB, read_size=64 * 1024)
+    return SegmentedTransfer(None, 'http://unused', total_size, BufferSink(), controller, **kwargs)
+
+
+async def download(options, size=8 * MB, connections=4, **kwargs):
+    data = make_package(size, seed=7)
+    async with StubServer(options) as server:
+        server.add_package('pkg', data)
+        async with aiohttp.ClientSession() as session:
+            controller = AdaptiveController.fixed(connections, segment_size=MB, read_size=64 * 1024)
+            sink = BufferSink()
+            transfer = SegmentedTransfer(session, server.cdn_prefix + 'pkg.appx', len(data), sink, controller,
+                                         **kwargs)
+            await transfer.run()
+    assert hashlib.sha256(sink.getvalue()).digest() == hashlib.sha256(data).digest()
+    return transfer, server
+
+
+def test_steal_skips_segment_in_retry_backoff():
+    transfer = make_transfer(min_steal_age=0.0)
+    now = 100.0
+    # Dropped connection: bytes were read, then _fetch's finally cleared fetch_started
+    backing_off = Segment(0, 4 * MB)
+    backing_off.position = backing_off.fetch_bytes = MB
+    running = Segment(4 * MB, 8 * MB)
+    running.fetch_started, running.progress_at, running.fetch_bytes = now - 2, now, MB
+    running.position = 5 * MB
+    transfer.segments = [backing_off, running]
+    transfer.next_offset = 8 * MB
+
+    assert transfer._median_rate(now) > 0
+    segment, split, _ = transfer._straggler(now)
+    assert segment is running and running.position < split < running.end
+
+
+def test_dropped_connections_and_stragglers_complete():
+    options = StubOptions(drop_rate=0.2, straggler_rate=0.3, straggler_bandwidth=256 * 1024, seed=3)
+    transfer, server = asyncio.run(download(options, max_retries=10, min_steal_age=0.05, stall_timeout=1.0))
+    assert server.requests['dropped'] > 0
+    assert transfer.downloaded == transfer.total_size
+
+
+def test_server_errors_on_segments_are_retried():
+    transfer, server = asyncio.run(download(StubOptions(fail_rate=0.3, seed=1), size=4 * MB, max_retries=6))
+    assert server.requests['failed'] > 0
+    assert transfer.downloaded == transfer.total_size
+
+
+def test_stalled_front_segment_is_replaced_when_in_order_buffer_is_full():
+    data = make_package(4 * MB, seed=7)
+    received = []
+
+    async def scenario():
+        # With this seed only the first request, for the front segment, is throttled to a near stall
+        options = StubOptions(straggler_rate=0.5, straggler_bandwidth=16 * 1024, seed=139)
+        async with StubServer(options) as server:
+            server.add_package('pkg', data)
+            async with aiohttp.ClientSession() as session:
+                controller = AdaptiveController.fixed(2, segment_size=MB, read_size=64 * 1024)
+                transfer = SegmentedTransfer(session, server.cdn_prefix + 'pkg.appx', len(data),
+                                             CallbackSink(received.append), controller,
+                                             stall_timeout=0.5, max_buffer=MB)
+                await asyncio.wait_for(transfer.run(), 20)
+        return transfer, server
+
+    transfer, server = asyncio.run(scenario())
+    assert server.requests['stragglers'] == 1
+    assert transfer.steals >= 1
+    assert b''.join(received) == data
+
+
+def test_only_segmented_downloads_use_a_controller():
+    small, large = make_package(MB, seed=1), make_package(4 * MB, seed=2)
+
+    async def scenario():
+        controllers = {}
+        async with StubServer() as server:
+            server.add_package('small', small)
+            server.add_package('large', large)
+            async with make_downloader(server) as downloader:
+                for name in ('small', 'large'):
+                    sink = BufferSink()
+                    await downloader.download(name, '1', sink)
+                    controllers[name] = downloader.last_transfer
+                    assert sink.getvalue() == {'small': small, 'large': large}[name]
+        return controllers
+
+    controllers = asyncio.run(scenario())
+    assert controllers['small'] is None
+    assert controllers['large'].stats